@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from Balance_Store import open_balances, EPOCH
+from Instrumentation import timed_read
+
+"""
+Account -> adviser rollup of the performance data. The performance extract only has AcctId, the holdings extract
+(sales page) has adviserCode <-> AcctId, so the two are joined once at upload instead of on every request:
+
+- account_advisers -> AcctId, adviserCode (from the latest holdings upload)
+- adviser_accounts -> every account with its adviser, first / last closing balance and gain (indexed by adviser)
+- adviser_ranking  -> per adviser: accounts, first / last total balance, gain, gain % and rank by gain
+- adviser_series   -> per adviser total closing balance at every month end (day numbers, indexed by adviser)
+
+Whichever of the two files is uploaded second completes the join. The join itself runs on the memory-mapped
+balance arrays (Balance_Store.py): first / last balances come straight from the offsets index and accounts are
+matched to advisers with a binary search -> about half a second for 100k accounts, plus a couple of seconds
+writing the tables. The performance page then only reads the ranking and one adviser's rows through the index.
+"""
+
+ROLLUP_DATABASE = os.getenv('ADVISER_ROLLUP_DB', 'adviser_rollup.db')
+
+
+def _connect(database):
+    return sqlite3.connect(database, timeout=30)
+
+
+def save_account_advisers(holdings, database=ROLLUP_DATABASE):
+    """
+    Keeps the account -> adviser mapping of a holdings upload and rebuilds the rollup.
+
+    :param holdings: holdings data frame (adviserCode, AcctId and ValueDate if there is one).
+    :param database: sqlite file of the rollup.
+    :return: True if the rollup was rebuilt (a performance file was uploaded already).
+    """
+    mapping = holdings[['AcctId', 'adviserCode'] + (['ValueDate'] if 'ValueDate' in holdings.columns else [])]
+    if 'ValueDate' in mapping.columns:
+        # An account that moved adviser belongs to the adviser of its latest holdings
+        mapping = mapping.sort_values('ValueDate', kind='stable')
+    mapping = mapping.drop_duplicates('AcctId', keep='last')[['AcctId', 'adviserCode']].astype('int64')
+
+    db_connection = _connect(database)
+    with db_connection:
+        mapping.to_sql('account_advisers', db_connection, if_exists='replace', index=False)
+    db_connection.close()
+    return build_rollup(database)
+
+
+def build_rollup(database=ROLLUP_DATABASE):
+    """
+    Joins the balance store with the account -> adviser mapping and writes the adviser tables.
+
+    :param database: sqlite file of the rollup.
+    :return: True if the rollup was written, False while one of the two uploads is missing.
+    """
+    store = open_balances()
+    if store is None or not os.path.exists(database):
+        return False
+    db_connection = _connect(database)
+    try:
+        mapping = pd.read_sql("SELECT AcctId, adviserCode FROM account_advisers ORDER BY AcctId", db_connection)
+    except pd.errors.DatabaseError:
+        mapping = None
+    if mapping is None or mapping.empty:
+        db_connection.close()
+        return False
+
+    start = time.perf_counter()
+    acct_ids, offsets, days, balances = store.acct_ids, store.offsets, store.days, store.balances
+    # Binary search of every account in the mapping (both sorted by AcctId), unmatched accounts get -1
+    mapped_ids = mapping['AcctId'].to_numpy(np.int64)
+    positions = np.minimum(np.searchsorted(mapped_ids, acct_ids), len(mapped_ids) - 1)
+    found = mapped_ids[positions] == acct_ids
+    advisers = np.where(found, mapping['adviserCode'].to_numpy(np.int64)[positions], -1)
+
+    counts = np.diff(offsets)
+    first, last = np.asarray(balances[offsets[:-1]]), np.asarray(balances[offsets[1:] - 1])
+    accounts = pd.DataFrame({'AcctId': np.asarray(acct_ids), 'adviserCode': advisers, 'FirstBal': first,
+                             'LastBal': last, 'Gain': last - first})[found]
+
+    ranking = accounts.groupby('adviserCode').agg(Accounts=('AcctId', 'size'), FirstBal=('FirstBal', 'sum'),
+                                                  LastBal=('LastBal', 'sum'), Gain=('Gain', 'sum'))
+    ranking['GainPct'] = 100 * ranking['Gain'] / ranking['FirstBal'].where(ranking['FirstBal'] != 0)
+    ranking = ranking.sort_values('Gain', ascending=False).reset_index()
+    ranking.insert(0, 'Rank', np.arange(1, len(ranking) + 1))
+
+    # Every row of a mapped account, summed per adviser and month end
+    rows = np.repeat(found, counts)
+    series = pd.DataFrame({'adviserCode': np.repeat(advisers, counts)[rows], 'EOM': np.asarray(days)[rows],
+                           'ClosingBal': np.asarray(balances)[rows]}) \
+        .groupby(['adviserCode', 'EOM'], sort=True)['ClosingBal'].sum().reset_index()
+
+    with db_connection:
+        accounts.to_sql('adviser_accounts', db_connection, if_exists='replace', index=False)
+        ranking.to_sql('adviser_ranking', db_connection, if_exists='replace', index=False)
+        series.to_sql('adviser_series', db_connection, if_exists='replace', index=False)
+        db_connection.execute("CREATE INDEX adviser_accounts_adviser ON adviser_accounts (adviserCode)")
+        db_connection.execute("CREATE INDEX adviser_series_adviser ON adviser_series (adviserCode)")
+    db_connection.close()
+    print(f"Adviser rollup: {len(accounts):,} of {len(acct_ids):,} accounts matched to {len(ranking):,} advisers "
+          f"in {time.perf_counter() - start:.2f}s")
+    return True
+
+
+def _read(query, params=(), database=ROLLUP_DATABASE):
+    if not os.path.exists(database):
+        return None
+    db_connection = _connect(database)
+    try:
+        return pd.read_sql(query, db_connection, params=params)
+    except pd.errors.DatabaseError:
+        # Nothing joined yet
+        return None
+    finally:
+        db_connection.close()
+
+
+@timed_read
+def get_adviser_ranking(limit=None, database=ROLLUP_DATABASE):
+    """
+    :param limit: number of advisers (all of them when None).
+    :param database: sqlite file of the rollup.
+    :return: data frame of Rank, adviserCode, Accounts, FirstBal, LastBal, Gain, GainPct, None before the join.
+    """
+    query = "SELECT * FROM adviser_ranking ORDER BY Rank" + (" LIMIT ?" if limit else "")
+    return _read(query, (limit,) if limit else (), database)
+
+
+@timed_read
+def get_adviser_accounts(adviser, database=ROLLUP_DATABASE):
+    """
+    :param adviser: adviser code.
+    :param database: sqlite file of the rollup.
+    :return: accounts of the adviser (AcctId, FirstBal, LastBal, Gain) best gain first, None before the join.
+    """
+    return _read("SELECT AcctId, FirstBal, LastBal, Gain FROM adviser_accounts WHERE adviserCode = ? "
+                 "ORDER BY Gain DESC", (int(adviser),), database)
+
+
+@timed_read
+def get_adviser_series(adviser, database=ROLLUP_DATABASE):
+    """
+    :param adviser: adviser code.
+    :param database: sqlite file of the rollup.
+    :return: total closing balance of the adviser's accounts per month end (EOM, ClosingBal), None before the join.
+    """
+    series = _read("SELECT EOM, ClosingBal FROM adviser_series WHERE adviserCode = ? ORDER BY EOM",
+                   (int(adviser),), database)
+    if series is not None:
+        series['EOM'] = EPOCH + series['EOM'].to_numpy().astype('timedelta64[D]')
+    return series
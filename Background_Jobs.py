@@ -0,0 +1,49 @@
+import os
+import diskcache
+from dash import DiskcacheManager
+
+"""
+Local job manager for the slow callbacks (stock prediction, full performance graph, hexabin plots).
+
+Background callbacks run in their own process instead of the request thread, so a slow chart doesn't hold
+a web worker. Jobs and their results live in a diskcache folder on local disk -> no broker (redis/celery)
+required, and every worker on the machine sees the same cache.
+"""
+
+CACHE_DIRECTORY = os.getenv('JOB_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+# How long a cached chart is kept (seconds)
+RESULT_EXPIRY = int(os.getenv('JOB_CACHE_EXPIRY', 60 * 60))
+
+job_cache = diskcache.Cache(CACHE_DIRECTORY)
+
+# Manager given to the Dash app -> runs background callbacks, does not cache results
+background_manager = DiskcacheManager(job_cache)
+
+
+def file_version(path):
+    """
+    Returns a value that changes whenever the file is rewritten (i.e. a new upload), used so that cached
+    results are thrown away once the underlying data changes.
+
+    :param path: path of the sqlite database (or any file).
+    :return: last modified time, or None if the file doesn't exist yet.
+    """
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def cached_manager(*data_files):
+    """
+    Background callback manager that also caches results by the callback inputs. The cache key includes
+    the version of every file in data_files, so a new upload is never answered with a stale chart.
+
+    :param data_files: paths of the files the callback reads from.
+    :return: DiskcacheManager to pass to @callback(manager=...).
+    """
+    return DiskcacheManager(
+        job_cache,
+        cache_by=[lambda: tuple(file_version(path) for path in data_files)],
+        expire=RESULT_EXPIRY,
+    )
@@ -0,0 +1,243 @@
+import argparse
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from Market_Data_Store import get_prices
+from Stock_Price_Predictor import STATES, classify_data, get_transition_function, forecast_percentiles, \
+    predict_future_values, simulate_paths
+
+"""
+Walk-forward backtest of the Markov chain price predictor (Stock_Price_Predictor.py), scoring the forecast the
+chatbot page serves.
+
+Every window of `window` days is the model the page would fit on it -> the states of classify_data, the
+transition matrix of get_transition_function and the simulation with the default +/- 5 moves, continuing from
+the last states of the window. The forecast `horizon` days after the window is compared with the actual close.
+Which forecast is scored:
+    median -> median of the simulated paths, the line drawn by prediction_graph (default)
+    path   -> one simulated path, predict_future_values
+
+Vectorised across windows -> the series is classified once, the transition counts of every window are the
+difference of two cumulative counts, and all windows are simulated in one simulate_paths stack (window i with
+seed + i, the same draws as the served functions). --check N runs N random windows through the served functions
+one by one and compares. Tickers are spread across a pool of processes. Prices come from the local market data
+store, so cached or fixture data works offline.
+
+Usage:
+    python Backtest.py --tickers ^AXJO CBA.AX --start 2015-01-01 --window 60 --horizon 5
+"""
+
+FORECASTS = {
+    'median': 'median of the simulated paths (prediction_graph)',
+    'path': 'one simulated path (predict_future_values)',
+}
+# Windows x paths x days simulated at a time, keeps the memory of long series bounded
+SIMULATION_CHUNK = 4_000_000
+
+
+def window_transition_matrices(states, starts, window, order=1):
+    """
+    Transition matrix of every window, as get_transition_function builds it from the window alone.
+
+    :param states: StateIndex of the whole series (classify_data, sign states).
+    :param starts: first row of every window.
+    :param window: number of rows per window.
+    :param order: order of the Markov chain.
+    :return: array of shape (windows, 3 ** order, 3).
+    """
+    n_states = len(STATES)
+    n_codes = n_states ** order
+    # Code of the previous `order` states of every day that has them all (same encoding as
+    # estimate_transition_matrix)
+    code = np.zeros(len(states) - order, dtype=np.int64)
+    valid = states[order:] >= 0
+    for lag in range(order, 0, -1):
+        previous = states[order - lag: len(states) - lag]
+        code = code * n_states + np.maximum(previous, 0)
+        valid &= previous >= 0
+    targets = np.arange(order, len(states))[valid]
+    counted = np.zeros((len(states), n_codes * n_states), dtype=np.int32)
+    counted[targets, code[valid] * n_states + states[order:][valid]] = 1
+    cumulative = np.vstack([np.zeros((1, n_codes * n_states), dtype=np.int32), np.cumsum(counted, axis=0)])
+
+    # The first day of a window has no previous close in the window -> its transitions start `order` days later
+    counts = (cumulative[starts + window] - cumulative[starts + order + 1]).reshape(len(starts), n_codes, n_states)
+    totals = counts.sum(axis=2, keepdims=True)
+    return np.where(totals > 0, counts / np.maximum(totals, 1), 1 / n_states)
+
+
+def backtest_series(prices, window=60, horizon=5, stride=1, order=1, forecast='median', n_paths=1000, seed=0):
+    """
+    Walk-forward backtest of one price series through the served predictor, every window at once.
+
+    :param prices: Data frame with Date and Close columns (oldest first).
+    :param window: Number of days each model is fitted on (the page trains on 60).
+    :param horizon: Number of days ahead that is forecast from the end of each window.
+    :param stride: Number of days between the start of two windows.
+    :param order: Order of the Markov chain (how many previous days the next state depends on).
+    :param forecast: 'median' or 'path', see FORECASTS.
+    :param n_paths: Number of paths simulated per window for the median.
+    :param seed: Seed of the first window (window i uses seed + i), for repeatable results.
+    :return: Data frame with one row per window -> Start, Last, Predicted and Actual values.
+    """
+    prices = prices[['Date', 'Close']].reset_index(drop=True)
+    closes = prices['Close'].to_numpy(dtype=float)
+    starts = np.arange(0, len(closes) - window - horizon + 1, stride)
+    if len(starts) == 0 or window <= order + 1:
+        return pd.DataFrame(columns=['Start', 'Last', 'Predicted', 'Actual'])
+
+    states = classify_data(prices.copy())['StateIndex'].to_numpy()
+    matrices = window_transition_matrices(states, starts, window, order)
+    ends = starts + window - 1
+    # The simulation continues from the last `order` states of each window
+    initial_states = states[ends[:, None] + np.arange(1 - order, 1)]
+    if forecast == 'path':
+        n_paths = 1
+
+    predicted = np.empty(len(starts))
+    chunk = max(1, SIMULATION_CHUNK // (n_paths * horizon))
+    for first in range(0, len(starts), chunk):
+        part = slice(first, first + chunk)
+        paths = simulate_paths(matrices[part], closes[ends[part]], horizon, n_paths=n_paths,
+                               seed=seed + np.arange(len(starts))[part], initial_states=initial_states[part])
+        predicted[part] = paths[:, 0, -1] if forecast == 'path' else np.percentile(paths[:, :, -1], 50, axis=1)
+
+    return pd.DataFrame({
+        'Start': starts,
+        'Last': closes[ends],
+        'Predicted': predicted,
+        'Actual': closes[ends + horizon],
+    })
+
+
+def served_forecast(prices, start, window=60, horizon=5, order=1, forecast='median', n_paths=1000, seed=0):
+    """
+    Forecast of one window through the functions the page calls, one by one (what backtest_series is checked
+    against).
+
+    :param prices: Data frame with Date and Close columns (oldest first).
+    :param start: first row of the window.
+    :return: forecast close `horizon` days after the window.
+    """
+    # Exactly what the page does with its training data
+    training_data = classify_data(prices[['Date', 'Close']].iloc[start:start + window].reset_index(drop=True))
+    transition_func = get_transition_function(training_data, order)
+    if forecast == 'path':
+        return predict_future_values(transition_func, training_data['Close'].to_numpy(), horizon, seed=seed,
+                                     initial_states=training_data['StateIndex'].to_numpy()[window - order:])[-1]
+    _, bands = forecast_percentiles(transition_func, training_data, horizon, n_paths, seed=seed)
+    return bands[50][-1]
+
+
+def check_windows(prices, results, sample, window=60, horizon=5, order=1, forecast='median', n_paths=1000,
+                  seed=0):
+    """
+    Runs a random sample of the backtest windows through served_forecast and compares.
+
+    :param results: Data frame from backtest_series with the same settings.
+    :param sample: number of windows checked.
+    :return: largest absolute difference between the two.
+    """
+    rows = np.random.default_rng().choice(len(results), min(sample, len(results)), replace=False)
+    return max((abs(served_forecast(prices, results['Start'].iloc[row], window, horizon, order, forecast, n_paths,
+                                    seed + row) - results['Predicted'].iloc[row]) for row in rows), default=0.0)
+
+
+def score(results):
+    """
+    Error and hit rate of the backtest results, with the error of the naive 'no change' forecast
+    for reference.
+
+    :param results: Data frame from backtest_series.
+    :return: Dictionary of metrics.
+    """
+    error = results['Predicted'] - results['Actual']
+    predicted_direction = np.sign(results['Predicted'] - results['Last'])
+    actual_direction = np.sign(results['Actual'] - results['Last'])
+    return {
+        'Windows': len(results),
+        'MAE': error.abs().mean(),
+        'RMSE': np.sqrt((error ** 2).mean()),
+        'MAPE %': 100 * (error.abs() / results['Actual'].abs()).mean(),
+        'Hit Rate %': 100 * (predicted_direction == actual_direction).mean(),
+        'Naive MAE': (results['Last'] - results['Actual']).abs().mean(),
+    }
+
+
+def backtest_ticker(task):
+    """
+    Runs in a pool process -> backtests one ticker from the market data store.
+
+    :param task: tuple of (ticker, start, end, window, horizon, stride, order, forecast, check).
+    :return: dictionary of metrics for the ticker.
+    """
+    ticker, start, end, window, horizon, stride, order, forecast, check = task
+    prices = get_prices(ticker, start, end)
+    began = time.perf_counter()
+    results = backtest_series(prices, window, horizon, stride, order, forecast)
+    elapsed = time.perf_counter() - began
+    metrics = score(results) if len(results) else {'Windows': 0}
+    metrics.update({'Ticker': ticker, 'Seconds': elapsed})
+    if check:
+        # Should be 0 -> the windows forecast exactly what the served functions do
+        metrics['Check Diff'] = check_windows(prices, results, check, window, horizon, order, forecast)
+    return metrics
+
+
+def run_backtest(tickers, start, end=None, window=60, horizon=5, stride=1, order=1, forecast='median',
+                 processes=None, check=0):
+    """
+    Backtests every ticker across a pool of processes and prints the report.
+
+    :param tickers: list of ticker symbols.
+    :param start: first date of history used.
+    :param end: date after the last date of history used (defaults to today).
+    :param window: number of days each model is fitted on.
+    :param horizon: number of days ahead that is forecast.
+    :param stride: number of days between two windows.
+    :param order: order of the Markov chain.
+    :param forecast: 'median' or 'path', see FORECASTS.
+    :param processes: number of processes (defaults to the number of cores).
+    :param check: number of windows per ticker compared with the served functions (see check_windows).
+    :return: data frame with the metrics of every ticker.
+    """
+    end = end or pd.Timestamp.today().normalize()
+    tasks = [(ticker, start, end, window, horizon, stride, order, forecast, check)
+             for ticker in dict.fromkeys(tickers)]
+
+    began = time.perf_counter()
+    with Pool(processes) as pool:
+        report = pd.DataFrame(pool.map(backtest_ticker, tasks)).set_index('Ticker')
+    elapsed = time.perf_counter() - began
+
+    windows = report['Windows'].sum()
+    print(f"Scoring the {FORECASTS[forecast]}, +/- 5 moves, fitted on {window} days, {horizon} days ahead\n")
+    print(report.round(3).to_string())
+    print(f"\n{windows} windows across {len(tasks)} tickers in {elapsed:.2f}s -> {windows / elapsed:,.0f} windows/s "
+          f"(fitting and scoring only: {windows / report['Seconds'].sum():,.0f} windows/s per process)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of the stock price predictor.')
+    parser.add_argument('--tickers', nargs='+', default=['^AXJO'])
+    parser.add_argument('--start', default='2010-01-01')
+    parser.add_argument('--end')
+    parser.add_argument('--window', type=int, default=60)
+    parser.add_argument('--horizon', type=int, default=5)
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--order', type=int, default=1)
+    parser.add_argument('--forecast', choices=list(FORECASTS), default='median', help='forecast that is scored')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--check', type=int, default=0, help='windows per ticker compared with the served functions')
+    args = parser.parse_args()
+
+    run_backtest(args.tickers, args.start, args.end, args.window, args.horizon, args.stride, args.order,
+                 args.forecast, args.processes, args.check)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import os
+import time
+import shutil
+
+import numpy as np
+import pandas as pd
+
+"""
+Per-account closing balances of the performance extract as memory-mapped NumPy arrays, written at upload next to
+performance_data.db so drawing lines or picking accounts doesn't have to read the whole table into pandas.
+
+    acct_ids.npy  int64   sorted distinct AcctId
+    offsets.npy   int64   rows of acct_ids[i] are offsets[i]:offsets[i + 1] (len(acct_ids) + 1 values)
+    days.npy      int32   EOM as days since 1970-01-01, sorted within each account
+    balances.npy  float64 ClosingBal
+
+Arrays are opened read-only with mmap, so slicing accounts or dates gives views into the file (nothing copied,
+cost in the size of the selection) and every worker process shares the same pages through the OS cache instead
+of holding its own copy. Each upload writes a new version folder and then points CURRENT at it, so a reader
+never sees half an upload; older versions are removed (open maps keep working on Linux until they're closed).
+"""
+
+BALANCE_STORE_DIRECTORY = os.getenv('BALANCE_STORE_DIR', 'performance_store')
+ARRAYS = ['acct_ids', 'offsets', 'days', 'balances']
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+# directory -> (version, BalanceStore) of the store opened by this process
+_open_stores = {}
+
+
+def _to_days(values):
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        # Same day first format as the extracts when the dates are still text
+        values = pd.to_datetime(values, dayfirst=True, format='mixed')
+    return (values.to_numpy().astype('datetime64[D]') - EPOCH).astype(np.int32)
+
+
+def save_balances(df, directory=BALANCE_STORE_DIRECTORY):
+    """
+    Writes the performance data as a new version of the store.
+
+    :param df: performance data (AcctId, EOM, ClosingBal), in any order.
+    :param directory: folder of the store.
+    :return: name of the version written.
+    """
+    acct = df['AcctId'].to_numpy(np.int64)
+    days = _to_days(df['EOM'])
+    order = np.lexsort((days, acct))
+    acct, days = acct[order], days[order]
+    balances = df['ClosingBal'].to_numpy(np.float64)[order]
+    acct_ids, starts = np.unique(acct, return_index=True)
+    offsets = np.append(starts, len(acct)).astype(np.int64)
+
+    version = f'v{time.time_ns()}'
+    folder = os.path.join(directory, version)
+    os.makedirs(folder)
+    for name, values in zip(ARRAYS, [acct_ids, offsets, days, balances]):
+        np.save(os.path.join(folder, f'{name}.npy'), values)
+
+    # Switch readers over in one step, then clean up the versions they no longer open
+    pointer = os.path.join(directory, 'CURRENT')
+    with open(f'{pointer}.{os.getpid()}.tmp', 'w') as current:
+        current.write(version)
+    os.replace(f'{pointer}.{os.getpid()}.tmp', pointer)
+    for old in os.listdir(directory):
+        if old.startswith('v') and old != version:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return version
+
+
+class BalanceStore:
+    """
+    Read-only view of one version of the store.
+    """
+
+    def __init__(self, folder):
+        arrays = {name: np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        self.acct_ids = arrays['acct_ids']
+        self.offsets = arrays['offsets']
+        self.days = arrays['days']
+        self.balances = arrays['balances']
+
+    def __len__(self):
+        return len(self.balances)
+
+    def _positions(self, acct_ids):
+        if acct_ids is None:
+            return np.arange(len(self.acct_ids))
+        wanted = np.unique(np.asarray(acct_ids, dtype=np.int64))
+        positions = np.searchsorted(self.acct_ids, wanted)
+        # Accounts that aren't in the store are skipped
+        found = positions < len(self.acct_ids)
+        found[found] = self.acct_ids[positions[found]] == wanted[found]
+        return positions[found]
+
+    def _bounds(self, position, start, end):
+        begin, stop = self.offsets[position], self.offsets[position + 1]
+        days = self.days[begin:stop]
+        if start is not None:
+            begin += np.searchsorted(days, start, 'left')
+        if end is not None:
+            stop = self.offsets[position] + np.searchsorted(days, end, 'right')
+        return begin, max(begin, stop)
+
+    def series(self, acct_id, start=None, end=None):
+        """
+        Balances of one account, as views into the store (nothing is copied).
+
+        :param acct_id: account id.
+        :param start: first date kept (anything np.datetime64 accepts), None for the first month end.
+        :param end: last date kept, None for the last month end.
+        :return: (int32 days since 1970-01-01, float64 balances), empty arrays for an unknown account.
+        """
+        positions = self._positions([acct_id])
+        if not len(positions):
+            return self.days[:0], self.balances[:0]
+        begin, stop = self._bounds(positions[0], _day(start), _day(end))
+        return self.days[begin:stop], self.balances[begin:stop]
+
+    def slices(self, acct_ids=None, start=None, end=None):
+        """
+        :param acct_ids: accounts wanted (all of them when None).
+        :param start: first date kept, None for no lower bound.
+        :param end: last date kept, None for no upper bound.
+        :return: list of (account id, days view, balances view) in account order.
+        """
+        start, end = _day(start), _day(end)
+        result = []
+        for position in self._positions(acct_ids):
+            begin, stop = self._bounds(position, start, end)
+            result.append((int(self.acct_ids[position]), self.days[begin:stop], self.balances[begin:stop]))
+        return result
+
+    def frame(self, acct_ids=None, start=None, end=None):
+        """
+        Selection as a data frame in the shape of performance_data_table (AcctId, EOM, ClosingBal sorted by account
+        and month end) -> only the selected rows are copied.
+
+        :param acct_ids: accounts wanted (all of them when None).
+        :param start: first date kept, None for no lower bound.
+        :param end: last date kept, None for no upper bound.
+        :return: data frame.
+        """
+        if acct_ids is None and start is None and end is None:
+            counts = np.diff(self.offsets)
+            acct, days, balances = np.repeat(self.acct_ids, counts), self.days, self.balances
+        else:
+            parts = self.slices(acct_ids, start, end)
+            acct = np.repeat([acct_id for acct_id, _, _ in parts], [len(days) for _, days, _ in parts])
+            days = np.concatenate([days for _, days, _ in parts]) if parts else self.days[:0]
+            balances = np.concatenate([balances for _, _, balances in parts]) if parts else self.balances[:0]
+        return pd.DataFrame({
+            'AcctId': np.asarray(acct, dtype=np.int64),
+            'EOM': (EPOCH + np.asarray(days)).astype('datetime64[us]'),
+            'ClosingBal': np.array(balances),
+        })
+
+
+def _day(value):
+    # Date bound -> day number, like the days array
+    if value is None:
+        return None
+    return int((np.datetime64(pd.Timestamp(value), 'D') - EPOCH).astype(np.int64))
+
+
+def open_balances(directory=BALANCE_STORE_DIRECTORY):
+    """
+    :param directory: folder of the store.
+    :return: BalanceStore of the current version (reopened after a new upload), None if nothing was saved yet.
+    """
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as current:
+            version = current.read().strip()
+    except OSError:
+        return None
+    opened = _open_stores.get(directory)
+    if opened is None or opened[0] != version:
+        try:
+            opened = _open_stores[directory] = (version, BalanceStore(os.path.join(directory, version)))
+        except OSError:
+            # Replaced by another upload while opening
+            return None
+    return opened[1]
@@ -0,0 +1,182 @@
+import os
+import re
+import sqlite3
+import argparse
+import time
+from datetime import date, timedelta
+from multiprocessing import Pool
+
+import pandas as pd
+
+from Stock_Price_Predictor import obtain_data, classify_data, get_transition_function, forecast_percentiles, \
+    PERCENTILES, TRAINING_DAYS
+
+"""
+Overnight batch forecasts for a list of tickers (i.e. the ASX200 constituents and the holdings in the
+spider_graph_data extract), run across a pool of processes and saved to a local sqlite store.
+The chatbot page reads the latest forecast (at most FORECAST_MAX_AGE days old) from the store instead of
+simulating on click.
+
+Usage:
+    python Batch_Forecast.py --tickers-file asx200.txt --holdings --days 365
+"""
+
+FORECAST_DATABASE = os.getenv('FORECAST_DB', 'forecasts.db')
+# Days a batch run is still shown for -> last night's run in the morning, Friday's run over the weekend
+FORECAST_MAX_AGE = int(os.getenv('FORECAST_MAX_AGE', 3))
+HOLDINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data', 'spider_graph_data.csv')
+# APIR codes (managed funds, i.e. MAQ0789AU) have no exchange price
+APIR_CODE = re.compile(r'^[A-Z]{3}\d{4}AU$')
+ASX_CODE = re.compile(r'^[A-Z0-9]{3,6}$')
+
+
+def load_tickers(path):
+    """
+    Reads a ticker list, one ticker per line (a CSV with a 'Ticker' or 'Code' column also works).
+
+    :param path: path of the ticker list.
+    :return: list of ticker symbols.
+    """
+    if path.endswith('.csv'):
+        df = pd.read_csv(path)
+        column = 'Ticker' if 'Ticker' in df.columns else 'Code'
+        return df[column].dropna().astype(str).str.strip().tolist()
+    with open(path) as ticker_file:
+        return [line.strip() for line in ticker_file if line.strip() and not line.startswith('#')]
+
+
+def holdings_tickers(holdings_file=HOLDINGS_FILE):
+    """
+    Exchange listed holdings (SecCode) of the sales extract as Yahoo Finance tickers, i.e. TLS -> TLS.AX.
+    Managed funds (APIR codes), bonds and other codes without an exchange price are skipped.
+
+    :param holdings_file: CSV file with a SecCode column.
+    :return: list of ticker symbols.
+    """
+    codes = pd.read_csv(holdings_file)['SecCode'].dropna().astype(str).unique()
+    return [f'{code}.AX' for code in codes if ASX_CODE.match(code) and not APIR_CODE.match(code)]
+
+
+def forecast_ticker(task):
+    """
+    Runs in a pool process -> estimates the transition matrix of one ticker, simulates it and keeps only
+    the percentiles (the simulated paths never leave the process).
+
+    :param task: tuple of (ticker, days, n_paths, history_days, seed).
+    :return: (ticker, data frame of the forecast or None, error message or None).
+    """
+    ticker, days, n_paths, history_days, seed = task
+    try:
+        history = classify_data(obtain_data(ticker, history_days))
+        if len(history) < 3:
+            return ticker, None, 'not enough price history'
+        future_dates, bands = forecast_percentiles(get_transition_function(history), history, days, n_paths, seed)
+        forecast = pd.DataFrame({f'p{percentile}': bands[percentile] for percentile in PERCENTILES})
+        forecast.insert(0, 'Date', future_dates.strftime('%Y-%m-%d'))
+        forecast.insert(0, 'Ticker', ticker)
+        return ticker, forecast, None
+    except Exception as e:
+        return ticker, None, str(e)
+
+
+def _connect(output):
+    db_connection = sqlite3.connect(output, timeout=60)
+    db_connection.execute("CREATE TABLE IF NOT EXISTS forecasts (Ticker TEXT, RunDate TEXT, Date TEXT, "
+                          + ", ".join(f"p{percentile} REAL" for percentile in PERCENTILES)
+                          + ", PRIMARY KEY (Ticker, RunDate, Date))")
+    return db_connection
+
+
+def run_batch(tickers, days=365, n_paths=10000, history_days=TRAINING_DAYS, processes=None, output=FORECAST_DATABASE,
+              seed=None, max_tasks_per_process=50):
+    """
+    Forecasts every ticker across a pool of processes and saves the results as they arrive, so memory stays
+    bounded by one forecast per process no matter how long the ticker list is.
+
+    :param tickers: list of ticker symbols.
+    :param days: number of days to forecast.
+    :param n_paths: number of simulated paths per ticker.
+    :param history_days: days of price history used to estimate the transitions (the page trains on
+                         TRAINING_DAYS, a different window gives a different model than the page draws).
+    :param processes: number of processes (defaults to the number of cores).
+    :param output: sqlite file the forecasts are saved to.
+    :param seed: seed for the simulations, for repeatable runs.
+    :param max_tasks_per_process: processes are replaced after this many tickers to hand memory back.
+    :return: dictionary of ticker -> error message for the tickers that failed.
+    """
+    run_date = date.today().isoformat()
+    tasks = [(ticker, days, n_paths, history_days, seed) for ticker in dict.fromkeys(tickers)]
+    failed = {}
+    start = time.perf_counter()
+
+    db_connection = _connect(output)
+    with Pool(processes, maxtasksperchild=max_tasks_per_process) as pool:
+        for ticker, forecast, error in pool.imap_unordered(forecast_ticker, tasks):
+            if error is not None:
+                failed[ticker] = error
+                print(f"{ticker}: failed ({error})")
+                continue
+            forecast.insert(1, 'RunDate', run_date)
+            with db_connection:
+                db_connection.execute("DELETE FROM forecasts WHERE Ticker = ? AND RunDate = ?", (ticker, run_date))
+                forecast.to_sql('forecasts', db_connection, if_exists='append', index=False)
+    db_connection.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Forecast {len(tasks) - len(failed)}/{len(tasks)} tickers in {elapsed:.1f}s "
+          f"({len(tasks) / elapsed if elapsed else 0:.1f} tickers/s)")
+    return failed
+
+
+def get_forecast(ticker, days=None, output=FORECAST_DATABASE, run_date=None, max_age=FORECAST_MAX_AGE):
+    """
+    Reads a precomputed forecast.
+
+    :param ticker: ticker symbol.
+    :param days: number of days wanted, None for all of them.
+    :param output: sqlite file the forecasts were saved to.
+    :param run_date: date of the batch run, None for the latest run.
+    :param max_age: days the latest run may be old (ignored when run_date is given).
+    :return: data frame with Date and the percentile columns, or None if there is no (long enough) forecast.
+    """
+    if not os.path.exists(output):
+        return None
+    db_connection = _connect(output)
+    if run_date is None:
+        oldest = (date.today() - timedelta(days=max_age)).isoformat()
+        run_date = db_connection.execute("SELECT max(RunDate) FROM forecasts WHERE Ticker = ? AND RunDate >= ?",
+                                         (ticker, oldest)).fetchone()[0]
+    forecast = pd.read_sql("SELECT * FROM forecasts WHERE Ticker = ? AND RunDate = ? ORDER BY Date",
+                           db_connection, params=(ticker, run_date), parse_dates=['Date'])
+    db_connection.close()
+    if forecast.empty or (days is not None and len(forecast) < days):
+        return None
+    return forecast if days is None else forecast.iloc[:days]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch forecasts for a list of tickers.')
+    parser.add_argument('--tickers', nargs='*', default=[], help='ticker symbols, i.e. ^AXJO CBA.AX')
+    parser.add_argument('--tickers-file', help='file with one ticker per line (i.e. the ASX200 constituents)')
+    parser.add_argument('--holdings', action='store_true', help='add the listed holdings of spider_graph_data')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--history-days', type=int, default=TRAINING_DAYS)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', default=FORECAST_DATABASE)
+    args = parser.parse_args()
+
+    tickers = list(args.tickers)
+    if args.tickers_file:
+        tickers += load_tickers(args.tickers_file)
+    if args.holdings:
+        tickers += holdings_tickers()
+    # The chatbot page reads the ASX200 forecast
+    tickers = tickers or ['^AXJO']
+
+    run_batch(tickers, args.days, args.paths, args.history_days, args.processes, args.output, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+"""
+Response cache for the chatbot (openai_function.py).
+
+Answers are looked up by the exact prompt first, then by a normalised version of it (case, whitespace and
+trailing punctuation ignored), in an in-memory LRU and then in a sqlite file shared by every worker.
+Identical prompts asked at the same time are coalesced -> one upstream call, everyone gets its answer.
+"""
+
+CHAT_CACHE_DATABASE = os.getenv('CHAT_CACHE_DB', 'chat_cache.db')
+# Seconds an answer is reused for
+CHAT_CACHE_TTL = int(os.getenv('CHAT_CACHE_TTL', 24 * 60 * 60))
+# Number of answers kept in memory per process
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', 1024))
+
+_memory = OrderedDict()
+_in_flight = {}
+_lock = threading.Lock()
+_metrics = {'exact_hits': 0, 'normalised_hits': 0, 'misses': 0, 'coalesced': 0, 'upstream_calls': 0}
+
+
+def normalise_prompt(prompt):
+    """
+    :param prompt: prompt given by the user.
+    :return: the prompt lower case, with single spaces and no trailing punctuation.
+    """
+    return re.sub(r'[\s?!.]+$', '', re.sub(r'\s+', ' ', prompt.strip().lower()))
+
+
+def _key(context, prompt):
+    return hashlib.sha256(f'{context}\x00{prompt}'.encode('utf-8')).hexdigest()
+
+
+def _connect():
+    db_connection = sqlite3.connect(CHAT_CACHE_DATABASE, timeout=30)
+    db_connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created REAL)")
+    return db_connection
+
+
+def _lookup(key):
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if now - entry[1] <= CHAT_CACHE_TTL:
+                _memory.move_to_end(key)
+                return entry[0]
+            del _memory[key]
+
+    db_connection = _connect()
+    row = db_connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+    db_connection.close()
+    if row is not None and now - row[1] <= CHAT_CACHE_TTL:
+        _remember(key, row[0], row[1])
+        return row[0]
+    return None
+
+
+def _remember(key, response, created):
+    with _lock:
+        _memory[key] = (response, created)
+        _memory.move_to_end(key)
+        while len(_memory) > CHAT_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def _save(keys, response):
+    created = time.time()
+    for key in keys:
+        _remember(key, response, created)
+    db_connection = _connect()
+    with db_connection:
+        db_connection.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                                  [(key, response, created) for key in keys])
+    db_connection.close()
+
+
+def lookup_response(prompt, context=''):
+    """
+    Looks the prompt up in the cache without calling the model (counts the hits, a miss is counted by
+    the caller once it knows whether it joins a request in flight).
+
+    :param prompt: prompt given by the user.
+    :param context: anything else that changes the answer (model, system prompt...), part of the key.
+    :return: the cached answer or None.
+    """
+    response = _lookup(_key(context, prompt))
+    if response is not None:
+        _count('exact_hits')
+        return response
+    response = _lookup(_key(context, normalise_prompt(prompt)))
+    if response is not None:
+        _count('normalised_hits')
+    return response
+
+
+def save_response(prompt, response, context=''):
+    """
+    Caches an answer that was obtained outside of cached_response (i.e. a streamed one).
+
+    :param prompt: prompt given by the user.
+    :param response: the full answer.
+    :param context: anything else that changes the answer (model, system prompt...), part of the key.
+    """
+    _count('upstream_calls')
+    _save([_key(context, prompt), _key(context, normalise_prompt(prompt))], response)
+
+
+def count_request(coalesced):
+    """
+    Records a request that missed the cache, for requests handled outside of cached_response.
+
+    :param coalesced: True if it joined an identical request already in flight.
+    """
+    _count('coalesced' if coalesced else 'misses')
+
+
+def cached_response(prompt, compute, context=''):
+    """
+    Returns the cached answer for the prompt, or calls compute() once for it (even if several threads ask
+    the same thing at the same time) and caches the result.
+
+    :param prompt: prompt given by the user.
+    :param compute: function without arguments that asks the model and returns the answer.
+    :param context: anything else that changes the answer (model, system prompt...), part of the key.
+    :return: the answer.
+    """
+    exact_key = _key(context, prompt)
+    normalised_key = _key(context, normalise_prompt(prompt))
+
+    response = _lookup(exact_key)
+    if response is not None:
+        _count('exact_hits')
+        return response
+    response = _lookup(normalised_key)
+    if response is not None:
+        _count('normalised_hits')
+        return response
+
+    with _lock:
+        future = _in_flight.get(normalised_key)
+        owner = future is None
+        if owner:
+            future = _in_flight[normalised_key] = Future()
+            _metrics['misses'] += 1
+        else:
+            _metrics['coalesced'] += 1
+
+    if not owner:
+        return future.result()
+
+    try:
+        # Another thread may have finished the same prompt between the lookup and taking ownership
+        response = _lookup(normalised_key)
+        if response is None:
+            _count('upstream_calls')
+            response = compute()
+            _save([exact_key, normalised_key], response)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            del _in_flight[normalised_key]
+
+
+def _count(name):
+    with _lock:
+        _metrics[name] += 1
+
+
+def cache_metrics():
+    """
+    :return: dictionary of the cache counters of this process and the hit rate (hits + coalesced / requests).
+    """
+    with _lock:
+        metrics = dict(_metrics)
+    requests = metrics['exact_hits'] + metrics['normalised_hits'] + metrics['misses'] + metrics['coalesced']
+    served = metrics['exact_hits'] + metrics['normalised_hits'] + metrics['coalesced']
+    metrics['requests'] = requests
+    metrics['hit_rate'] = served / requests if requests else 0.0
+    return metrics
@@ -0,0 +1,270 @@
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import time
+from multiprocessing import Pool
+
+import pandas as pd
+
+"""
+Streaming export of CSV / Excel extracts to JSON lines, Parquet or Arrow IPC for the downstream js apps.
+
+Sources are read chunk by chunk (pandas chunks for CSV, openpyxl read-only rows for .xlsx) and every chunk is
+written before the next one is read, so memory stays at about one chunk whatever the size of the extract.
+
+- jsonl   -> one JSON record per line (what convert_csv_json used to write), gzip / bz2 / xz compression
+- parquet -> one row group per chunk, snappy (default) / zstd / gzip / brotli / lz4 / none
+- arrow   -> Arrow IPC file (Feather v2), one record batch per chunk, lz4 / zstd / none
+
+The Parquet / Arrow schema comes from the first chunk. A column whose type changes further down (i.e. whole
+numbers at the top, decimals later) stops the export with the column name -> pass its type with dtypes.
+Several files are converted in parallel with processes > 1, one file per process.
+
+Usage:
+    python Data_Export.py Data/performance_extract.csv --format parquet --compression zstd
+    python Data_Export.py extracts/*.csv --format jsonl --compression gzip --columns AcctId ClosingBal --processes 4
+"""
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 250_000))
+EXTENSIONS = {'jsonl': '.jsonl', 'parquet': '.parquet', 'arrow': '.arrow'}
+# Compressions of every format, the first one is the default
+COMPRESSIONS = {
+    'jsonl': [None, 'gzip', 'bz2', 'xz'],
+    'parquet': ['snappy', 'zstd', 'gzip', 'brotli', 'lz4', None],
+    'arrow': [None, 'lz4', 'zstd'],
+}
+JSONL_OPENERS = {None: open, 'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+JSONL_SUFFIXES = {None: '', 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+
+def read_chunks(source, columns=None, chunk_rows=EXPORT_CHUNK_ROWS, dtypes=None, sheet_name=None):
+    """
+    Reads a CSV or Excel file chunk by chunk.
+
+    :param source: path of a .csv, .xlsx / .xlsm or .xls file.
+    :param columns: columns to keep, in this order (all of them when None).
+    :param chunk_rows: number of rows per chunk.
+    :param dtypes: dictionary of column -> dtype, for columns whose type can't be guessed from the first chunk.
+    :param sheet_name: Excel sheet to read (the first one when None).
+    :return: generator of data frames.
+    """
+    extension = os.path.splitext(source)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        yield from _excel_chunks(source, columns, chunk_rows, dtypes, sheet_name)
+    elif extension == '.xls':
+        # xlrd can't stream -> the old format is read whole and written out in chunks
+        df = pd.read_excel(source, sheet_name=sheet_name or 0, usecols=columns, dtype=dtypes)
+        df = df[columns] if columns else df
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+    else:
+        for chunk in pd.read_csv(source, usecols=columns, dtype=dtypes, chunksize=chunk_rows):
+            yield chunk[columns] if columns else chunk
+
+
+def _excel_chunks(source, columns, chunk_rows, dtypes, sheet_name):
+    from openpyxl import load_workbook
+
+    # Read-only workbooks load the rows lazily instead of the whole sheet
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(name) for name in next(rows, ())]
+        wanted = columns or header
+        missing = [column for column in wanted if column not in header]
+        if missing:
+            raise ValueError(f"Columns {missing} are not in '{source}'")
+        positions = [header.index(column) for column in wanted]
+
+        batch = []
+        for row in rows:
+            batch.append([row[i] if i < len(row) else None for i in positions])
+            if len(batch) == chunk_rows:
+                yield _excel_frame(batch, wanted, dtypes)
+                batch = []
+        if batch:
+            yield _excel_frame(batch, wanted, dtypes)
+    finally:
+        workbook.close()
+
+
+def _excel_frame(batch, columns, dtypes):
+    df = pd.DataFrame(batch, columns=columns)
+    return df.astype(dtypes) if dtypes else df
+
+
+def _arrow_table(chunk, schema, source):
+    import pyarrow as pa
+
+    if schema is None:
+        return pa.Table.from_pandas(chunk, preserve_index=False)
+    try:
+        return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(f"A column of '{source}' changed type after the first chunk ({e}), pass its type with "
+                         f"dtypes / --dtype") from e
+
+
+def export_file(source, output, fmt='jsonl', columns=None, compression='default', chunk_rows=EXPORT_CHUNK_ROWS,
+                dtypes=None, sheet_name=None):
+    """
+    Converts a CSV / Excel file to JSON lines, Parquet or Arrow IPC, one chunk at a time.
+
+    :param source: path of the CSV or Excel file.
+    :param output: path of the file written.
+    :param fmt: 'jsonl', 'parquet' or 'arrow'.
+    :param columns: columns to export (all of them when None).
+    :param compression: one of COMPRESSIONS[fmt], 'default' for the first one.
+    :param chunk_rows: number of rows per chunk (memory is about one chunk).
+    :param dtypes: dictionary of column -> dtype for columns whose type changes further down the file.
+    :param sheet_name: Excel sheet to export.
+    :return: dictionary with the rows written, the input / output sizes (MB), seconds and throughput.
+    """
+    if fmt not in COMPRESSIONS:
+        raise ValueError(f"Unknown format '{fmt}', use one of {list(COMPRESSIONS)}")
+    if compression == 'default':
+        compression = COMPRESSIONS[fmt][0]
+    if compression == 'none':
+        compression = None
+    if compression not in COMPRESSIONS[fmt]:
+        raise ValueError(f"{fmt} can't be compressed with '{compression}', use one of {COMPRESSIONS[fmt]}")
+
+    start = time.perf_counter()
+    rows = 0
+    writer = None
+    schema = None
+    try:
+        for chunk in read_chunks(source, columns, chunk_rows, dtypes, sheet_name):
+            if fmt == 'jsonl':
+                if writer is None:
+                    writer = JSONL_OPENERS[compression](output, 'wt', encoding='utf-8')
+                text = chunk.to_json(orient='records', lines=True, date_format='iso')
+                writer.write(text if text.endswith('\n') else text + '\n')
+            else:
+                table = _arrow_table(chunk, schema, source)
+                if writer is None:
+                    schema = table.schema
+                    writer = _columnar_writer(output, fmt, schema, compression)
+                writer.write_table(table)
+            rows += len(chunk)
+        if writer is None:
+            # Empty source -> still leave an (empty) file behind
+            open(output, 'w').close()
+    finally:
+        if writer is not None:
+            writer.close()
+
+    seconds = time.perf_counter() - start
+    input_mb = os.path.getsize(source) / 1e6
+    return {
+        'source': source,
+        'output': output,
+        'rows': rows,
+        'seconds': seconds,
+        'input_mb': input_mb,
+        'output_mb': os.path.getsize(output) / 1e6,
+        'mb_per_second': input_mb / seconds if seconds else 0,
+        'rows_per_second': rows / seconds if seconds else 0,
+    }
+
+
+def _columnar_writer(output, fmt, schema, compression):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if fmt == 'parquet':
+        return pq.ParquetWriter(output, schema, compression=compression or 'none')
+    return pa.ipc.new_file(output, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+
+def output_path(source, output_directory, fmt, compression='default'):
+    """
+    :return: path of the exported file -> <output_directory>/<source name>.<format extension>.
+    """
+    if compression == 'default':
+        compression = COMPRESSIONS[fmt][0]
+    suffix = JSONL_SUFFIXES.get(compression, '') if fmt == 'jsonl' else ''
+    name = os.path.splitext(os.path.basename(source))[0] + EXTENSIONS[fmt] + suffix
+    return os.path.join(output_directory or os.path.dirname(source), name)
+
+
+def _export_task(task):
+    source, output, options = task
+    try:
+        return export_file(source, output, **options)
+    except Exception as e:
+        return {'source': source, 'output': output, 'error': str(e)}
+
+
+def print_result(result):
+    if 'error' in result:
+        print(f"{result['source']}: failed -> {result['error']}")
+        return
+    print(f"{result['source']} -> {result['output']}: {result['rows']:,} rows, {result['input_mb']:,.1f} MB -> "
+          f"{result['output_mb']:,.1f} MB in {result['seconds']:.1f}s ({result['mb_per_second']:,.1f} MB/s, "
+          f"{result['rows_per_second']:,.0f} rows/s)")
+
+
+def export_files(sources, output_directory=None, fmt='jsonl', processes=1, **options):
+    """
+    Exports several files, in parallel with processes > 1 (one file per process at a time). A file that fails
+    doesn't stop the others.
+
+    :param sources: paths of the CSV / Excel files.
+    :param output_directory: folder of the exported files (next to each source when None).
+    :param fmt: 'jsonl', 'parquet' or 'arrow'.
+    :param processes: number of files converted at the same time.
+    :param options: columns, compression, chunk_rows, dtypes, sheet_name (see export_file).
+    :return: list of the results of export_file (with an 'error' instead for the files that failed).
+    """
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    tasks = [(source, output_path(source, output_directory, fmt, options.get('compression', 'default')),
+              dict(options, fmt=fmt)) for source in sources]
+    results = []
+    if processes > 1 and len(tasks) > 1:
+        with Pool(min(processes, len(tasks))) as pool:
+            for result in pool.imap_unordered(_export_task, tasks):
+                print_result(result)
+                results.append(result)
+    else:
+        for task in tasks:
+            result = _export_task(task)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming export of CSV / Excel files to JSONL, Parquet or Arrow.')
+    parser.add_argument('sources', nargs='+', help='.csv, .xlsx or .xls files')
+    parser.add_argument('--format', choices=list(COMPRESSIONS), default='jsonl')
+    parser.add_argument('--output-dir', help='folder of the exported files (next to the sources by default)')
+    parser.add_argument('--columns', nargs='+', help='columns to export (all by default)')
+    parser.add_argument('--compression', default='default', help='gzip / bz2 / xz for jsonl, snappy / zstd / gzip / '
+                                                                  'brotli / lz4 for parquet, lz4 / zstd for arrow, none')
+    parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    parser.add_argument('--dtype', nargs='+', default=[], metavar='COLUMN=TYPE',
+                        help='type of columns whose type changes down the file, i.e. ClosingBal=float64')
+    parser.add_argument('--sheet', help='Excel sheet (the first one by default)')
+    parser.add_argument('--processes', type=int, default=1, help='files converted at the same time')
+    args = parser.parse_args()
+
+    dtypes = dict(item.split('=', 1) for item in args.dtype) or None
+    start = time.perf_counter()
+    results = export_files(args.sources, args.output_dir, args.format, args.processes, columns=args.columns,
+                           compression=args.compression, chunk_rows=args.chunk_rows, dtypes=dtypes,
+                           sheet_name=args.sheet)
+    done = [result for result in results if 'error' not in result]
+    elapsed = time.perf_counter() - start
+    print(f"{len(done)}/{len(results)} files, {sum(r['rows'] for r in done):,} rows, "
+          f"{sum(r['input_mb'] for r in done):,.1f} MB in {elapsed:.1f}s")
+    if len(done) < len(results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
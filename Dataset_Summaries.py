@@ -0,0 +1,229 @@
+import os
+import re
+import time
+
+from Background_Jobs import job_cache
+
+"""
+Compact summaries of the uploaded datasets (home, performance and sales pages) for the chatbot.
+
+Summaries are built once when a file is uploaded and kept in the shared job cache, so every worker can add
+them to the chatbot prompt without reading the tables again. Each summary is a list of sections (schema,
+totals, per-adviser / per-account figures, top movers...) of short lines. chat_context() fits as many lines
+as the token budget (CHAT_CONTEXT_TOKENS) allows, the datasets the question talks about go first.
+"""
+
+CHAT_CONTEXT_TOKENS = int(os.getenv('CHAT_CONTEXT_TOKENS', 600))
+# Number of rows kept in the top / bottom lists of a summary
+SUMMARY_TOP_N = 5
+# Number of month ends kept in the balance history of a summary
+SUMMARY_MONTHS = 12
+# Words that point a question at a dataset
+DATASET_KEYWORDS = {
+    'home': ['income', 'age', 'tax', 'postcode', 'population', 'upload'],
+    'performance': ['account', 'balance', 'gain', 'loss', 'performance', 'best', 'worst', 'month'],
+    'sales': ['adviser', 'advisor', 'asset', 'holding', 'market value', 'portfolio', 'security', 'sales'],
+}
+DATASET_TITLES = {
+    'home': 'Uploaded dataset (home page)',
+    'performance': 'Account performance (performance page)',
+    'sales': 'Adviser holdings (sales page)',
+}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about 4 characters per token for English text and numbers), good enough for a budget.
+
+    :param text: text to be sent to the model.
+    :return: estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+
+def _money(value):
+    sign = '-' if value < 0 else ''
+    value = abs(value)
+    if value >= 1e6:
+        return f"{sign}${value / 1e6:,.2f}M"
+    if value >= 1e3:
+        return f"{sign}${value / 1e3:,.1f}k"
+    return f"{sign}${value:,.2f}"
+
+
+def _schema_lines(df):
+    # Kinds instead of dtypes -> int8 / int32 etc. mean nothing to the model and cost tokens
+    kinds = {'i': 'whole number', 'u': 'whole number', 'f': 'number', 'M': 'date', 'b': 'yes/no'}
+    columns = ", ".join(f"{str(column).strip()} ({kinds.get(dtype.kind, 'text')})"
+                        for column, dtype in df.dtypes.items())
+    return [f"{len(df):,} rows, columns: {columns}"]
+
+
+def summarise_home(df):
+    """
+    :param df: data frame uploaded on the home page (any columns).
+    :return: list of (section title, lines) -> schema, numeric ranges and most common values.
+    """
+    numeric = df.select_dtypes('number')
+    ranges = [f"{column}: min {values.min():,.4g}, mean {values.mean():,.4g}, max {values.max():,.4g}"
+              for column, values in numeric.items()]
+    common = []
+    for column in df.columns.difference(numeric.columns):
+        top = df[column].astype(str).value_counts().head(3)
+        common.append(f"{column}: {df[column].nunique():,} distinct, most common "
+                      + ", ".join(f"{value} ({count:,})" for value, count in top.items()))
+    return [('Schema', _schema_lines(df)), ('Numeric columns', ranges), ('Other columns', common)]
+
+
+def summarise_performance(df):
+    """
+    :param df: performance extract (AcctId, EOM, ClosingBal).
+    :return: list of (section title, lines) -> schema, totals, best / worst accounts and month totals.
+    """
+    df = df.sort_values(['AcctId', 'EOM'])
+    accounts = df.groupby('AcctId', observed=True)['ClosingBal'].agg(['first', 'last', 'count'])
+    accounts['gain'] = accounts['last'] - accounts['first']
+    accounts = accounts.sort_values('gain', ascending=False)
+    months = df.groupby('EOM', observed=True)['ClosingBal'].sum()
+
+    totals = [f"{len(accounts):,} accounts, {len(months):,} month ends from {months.index.min():%d/%m/%Y} "
+              f"to {months.index.max():%d/%m/%Y}",
+              f"total closing balance {_money(months.iloc[0])} at the first month end, "
+              f"{_money(months.iloc[-1])} at the last ({_money(months.iloc[-1] - months.iloc[0])})",
+              f"total gain across accounts {_money(accounts['gain'].sum())}, "
+              f"{(accounts['gain'] > 0).sum():,} accounts gained, {(accounts['gain'] < 0).sum():,} lost"]
+
+    def mover(acct_id, row):
+        return f"account {acct_id}: {_money(row['first'])} -> {_money(row['last'])} (gain {_money(row['gain'])})"
+
+    best = [mover(acct_id, row) for acct_id, row in accounts.head(SUMMARY_TOP_N).iterrows()]
+    worst = [mover(acct_id, row) for acct_id, row in accounts.tail(SUMMARY_TOP_N).iloc[::-1].iterrows()]
+    # At most SUMMARY_MONTHS evenly spread month ends (always the last one)
+    step = -(-len(months) // SUMMARY_MONTHS)
+    monthly = [f"{eom:%d/%m/%Y}: {_money(total)}" for eom, total in months.iloc[::-1][::step].iloc[::-1].items()]
+    return [('Schema', _schema_lines(df)), ('Totals', totals), ('Best accounts', best),
+            ('Worst accounts', worst), ('Total closing balance by month end', monthly)]
+
+
+def summarise_sales(df):
+    """
+    :param df: holdings extract (adviserCode, AcctId, AssetClass, SecCode, MarketValue...).
+    :return: list of (section title, lines) -> schema, totals, per-adviser figures, asset classes and
+             largest holdings.
+    """
+    # Figures are for the latest extract date when the file has several
+    if 'ValueDate' in df.columns and df['ValueDate'].nunique() > 1:
+        df = df[df['ValueDate'] == df['ValueDate'].max()]
+    total = df['MarketValue'].sum()
+
+    advisers = df.groupby('adviserCode', observed=True).agg(accounts=('AcctId', 'nunique'),
+                                                             value=('MarketValue', 'sum'))
+    top_class = (df.groupby(['adviserCode', 'AssetClass'], observed=True)['MarketValue'].sum()
+                 .sort_values(ascending=False).reset_index().drop_duplicates('adviserCode')
+                 .set_index('adviserCode'))
+    advisers = advisers.join(top_class.rename(columns={'MarketValue': 'class_value'}))
+    advisers = advisers.sort_values('value', ascending=False)
+    adviser_lines = [f"adviser {code}: {row['accounts']:,} accounts, {_money(row['value'])}, largest asset class "
+                     f"{row['AssetClass']} ({100 * row['class_value'] / row['value']:.0f}%)"
+                     for code, row in advisers.iterrows()]
+
+    classes = df.groupby('AssetClass', observed=True)['MarketValue'].sum().sort_values(ascending=False)
+    class_lines = [f"{asset_class}: {_money(value)} ({100 * value / total:.0f}%)"
+                   for asset_class, value in classes.items()]
+    holdings = df.groupby('SecCode', observed=True)['MarketValue'].sum().nlargest(SUMMARY_TOP_N)
+    holding_lines = [f"{code}: {_money(value)}" for code, value in holdings.items()]
+
+    totals = [f"{df['adviserCode'].nunique():,} advisers, {df['AcctId'].nunique():,} accounts, "
+              f"{df['SecCode'].nunique():,} securities, total market value {_money(total)}"]
+    if 'ValueDate' in df.columns:
+        totals.append(f"as at {df['ValueDate'].max():%d/%m/%Y}")
+    return [('Schema', _schema_lines(df)), ('Totals', totals), ('Advisers by market value', adviser_lines),
+            ('Asset classes', class_lines), ('Largest holdings', holding_lines)]
+
+
+SUMMARISERS = {'home': summarise_home, 'performance': summarise_performance, 'sales': summarise_sales}
+
+
+def save_summary(name, df):
+    """
+    Summarises a dataset as it is uploaded and keeps the summary for the chatbot. A summary that can't be
+    built (i.e. unexpected columns) is dropped instead of failing the upload.
+
+    :param name: 'home', 'performance' or 'sales'.
+    :param df: the uploaded data frame.
+    """
+    try:
+        sections = SUMMARISERS[name](df)
+    except (KeyError, ValueError, TypeError, AttributeError, IndexError) as e:
+        print(f"Couldn't summarise the {name} data: {e}")
+        job_cache.delete(f'dataset-summary-{name}')
+        return
+    job_cache.set(f'dataset-summary-{name}', {'sections': sections, 'updated': time.time()})
+
+
+def get_summary(name):
+    """
+    :param name: 'home', 'performance' or 'sales'.
+    :return: dictionary with the sections and the time the summary was built, None if nothing was uploaded.
+    """
+    return job_cache.get(f'dataset-summary-{name}')
+
+
+def relevant_datasets(question, names):
+    """
+    :param question: question from the user.
+    :param names: names of the datasets with a summary.
+    :return: the datasets the question mentions keywords of, most keywords first.
+    """
+    question = question.lower()
+    hits = {name: sum(bool(re.search(rf'\b{keyword}', question)) for keyword in DATASET_KEYWORDS[name])
+            for name in names}
+    return sorted((name for name in names if hits[name]), key=lambda name: -hits[name])
+
+
+def chat_context(question, budget=CHAT_CONTEXT_TOKENS):
+    """
+    Builds the data context sent with a question -> the schema and totals of every dataset first, then the
+    detailed sections of the datasets the question is about, then the detailed sections of the others taking
+    turns, line by line until the token budget is used up.
+
+    :param question: question from the user.
+    :param budget: maximum number of tokens of the context.
+    :return: the context text, '' when nothing was uploaded.
+    """
+    summaries = {name: summary for name in SUMMARISERS if (summary := get_summary(name)) is not None}
+    if not summaries or budget <= 0:
+        return ''
+    relevant = relevant_datasets(question, list(summaries))
+    names = relevant + [name for name in summaries if name not in relevant]
+    longest = max(len(summary['sections']) for summary in summaries.values())
+
+    order = [(name, i) for i in range(2) for name in names]
+    order += [(name, i) for name in relevant for i in range(2, len(summaries[name]['sections']))]
+    order += [(name, i) for i in range(2, longest) for name in names
+              if name not in relevant and i < len(summaries[name]['sections'])]
+
+    header = "Summary of the data uploaded to the app (use it to answer questions about the data):"
+    used = estimate_tokens(header)
+    picked = {name: {} for name in names}
+    for name, i in order:
+        title, lines = summaries[name]['sections'][i]
+        for line in lines:
+            # The dataset and section titles only count once something goes under them
+            cost = estimate_tokens(f"- {line}\n") + \
+                (0 if picked[name] else estimate_tokens(f"# {DATASET_TITLES[name]}\n")) + \
+                (0 if i in picked[name] else estimate_tokens(f"{title}:\n"))
+            if used + cost > budget:
+                break
+            used += cost
+            picked[name].setdefault(i, []).append(line)
+
+    text = [header]
+    for name in names:
+        if not picked[name]:
+            continue
+        text.append(f"# {DATASET_TITLES[name]}")
+        for i, lines in sorted(picked[name].items()):
+            text.append(f"{summaries[name]['sections'][i][0]}:")
+            text.extend(f"- {line}" for line in lines)
+    return '\n'.join(text) if len(text) > 1 else ''
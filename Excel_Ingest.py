@@ -0,0 +1,125 @@
+import os
+import io
+import hashlib
+import importlib.util
+
+import pandas as pd
+
+from Data_Export import read_chunks
+
+"""
+Excel ingest -> reads only the sheet and columns needed with the fastest engine installed, and keeps the result
+as a Parquet file named after the hash of the workbook. Refreshing from a workbook that was already read (i.e.
+the same monthly "Sample Data for Visualisations.xlsx", or the same file uploaded again) reads the Parquet file
+and never parses the Excel file again.
+
+Engines -> calamine (pip install python-calamine, a Rust reader, several times faster) when installed, openpyxl
+otherwise for .xlsx (read-only mode, rows streamed so the AcctId / EOM aggregation runs while reading), xlrd for
+the old .xls format.
+
+Cached files live in EXCEL_CACHE_DIR (default ./excel_cache), delete the folder to force a re-read.
+"""
+
+EXCEL_CACHE_DIRECTORY = os.getenv('EXCEL_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  'excel_cache'))
+# Bump when what is cached changes, so old files aren't read back
+EXCEL_CACHE_VERSION = 1
+# Rows per chunk when the workbook is streamed with openpyxl
+EXCEL_CHUNK_ROWS = 100_000
+PERFORMANCE_SHEET = 'Performance'
+PERFORMANCE_COLUMNS = ['AcctId', 'EOM', 'ClosingBal']
+
+
+def excel_engine(filename):
+    """
+    :param filename: name of the workbook (.xlsx / .xlsm / .xls).
+    :return: fastest pandas engine installed that can read it.
+    """
+    if importlib.util.find_spec('python_calamine') is not None:
+        return 'calamine'
+    return 'xlrd' if filename.lower().endswith('.xls') else 'openpyxl'
+
+
+def workbook_hash(source):
+    """
+    :param source: path of the workbook, or its bytes (an upload).
+    :return: sha256 of the workbook contents.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    else:
+        with open(source, 'rb') as workbook:
+            for block in iter(lambda: workbook.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_read(source, name, build):
+    """
+    Returns the cached result for this workbook, or builds it and caches it as Parquet.
+
+    :param source: path or bytes of the workbook.
+    :param name: what is read from it (sheet, columns, aggregation), part of the cache file name.
+    :param build: function building the data frame from the workbook when it isn't cached.
+    :return: data frame.
+    """
+    path = os.path.join(EXCEL_CACHE_DIRECTORY, f"{workbook_hash(source)}-{name}-v{EXCEL_CACHE_VERSION}.parquet")
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    df = build()
+    os.makedirs(EXCEL_CACHE_DIRECTORY, exist_ok=True)
+    # Written under another name first -> another worker never reads half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(temporary, index=False)
+        os.replace(temporary, path)
+    except (ValueError, TypeError, ImportError) as e:
+        # i.e. a column mixing text and numbers that Parquet can't store -> just not cached
+        print(f"Couldn't cache '{name}' of the workbook: {e}")
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return df
+
+
+def _sum_closing_bal(df):
+    return df.groupby(['AcctId', 'EOM'], observed=True, sort=False)['ClosingBal'].sum()
+
+
+def aggregate_performance(excel_input_path):
+    """
+    Total closing balance per account and month end from the Performance sheet, cached per workbook.
+
+    :param excel_input_path: path of the workbook.
+    :return: data frame of AcctId, EOM, ClosingBal sorted by account and month end.
+    """
+    def build():
+        engine = excel_engine(excel_input_path)
+        if engine == 'openpyxl':
+            # Aggregated chunk by chunk as the rows are read, the partial sums are added up at the end
+            partials = [_sum_closing_bal(chunk) for chunk in
+                        read_chunks(excel_input_path, PERFORMANCE_COLUMNS, EXCEL_CHUNK_ROWS,
+                                    sheet_name=PERFORMANCE_SHEET)]
+            if not partials:
+                # Headers but no rows
+                return pd.DataFrame(columns=PERFORMANCE_COLUMNS)
+            totals = pd.concat(partials).groupby(level=['AcctId', 'EOM']).sum()
+        else:
+            df = pd.read_excel(excel_input_path, PERFORMANCE_SHEET, usecols=PERFORMANCE_COLUMNS, engine=engine)
+            totals = _sum_closing_bal(df)
+        return totals.sort_index().reset_index()
+
+    return cached_read(excel_input_path, 'performance-closing-bal', build)
+
+
+def read_upload(decoded, filename):
+    """
+    First sheet of an uploaded workbook, cached per workbook so the same file uploaded again isn't parsed.
+
+    :param decoded: bytes of the uploaded file.
+    :param filename: name of the uploaded file.
+    :return: data frame.
+    """
+    return cached_read(decoded, 'first-sheet',
+                       lambda: pd.read_excel(io.BytesIO(decoded), engine=excel_engine(filename)))
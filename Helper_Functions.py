@@ -12,12 +12,86 @@ import plotly.express as px
 import plotly.figure_factory as ff
 import random
 from datetime import timedelta
+from Synthetic_Data import generate_frame
+from Instrumentation import timed_read, timed_phase
+from Data_Export import export_file
+from Excel_Ingest import aggregate_performance, read_upload
+from Balance_Store import open_balances
 
 """
 Helper functions for visualiser tool.
 """
 
+# Columns holding dates in the extracts (performance EOM, holdings ValueDate, generated Date)
+DATE_COLUMNS = ['EOM', 'ValueDate', 'Date']
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_RATIO = 0.5
+# Share of the values of a date column that have to parse, otherwise the column is left as it was
+DATE_PARSE_RATIO = 0.9
 
+
+def parse_dates(values):
+    """
+    Parses a column of dates -> ISO dates (as written back by sqlite) first, otherwise the day first
+    format of the extracts, i.e. 31/01/2018. A column named like a date that doesn't hold dates (numbers,
+    free text...) is returned unchanged, so an upload never fails on it.
+
+    :param values: series of date strings.
+    :return: datetime64 series, or the values as they were if they aren't dates.
+    """
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        # Numbers would be read as nanoseconds since 1970
+        return values
+    try:
+        return pd.to_datetime(values, format='ISO8601')
+    except (ValueError, TypeError):
+        pass
+    parsed = pd.to_datetime(values, dayfirst=True, format='mixed', errors='coerce')
+    # A few bad cells become NaT, a column that is mostly not dates is kept as text
+    if parsed.notna().sum() < DATE_PARSE_RATIO * values.notna().sum():
+        return values
+    return parsed
+
+
+def optimise_dtypes(df, date_columns=DATE_COLUMNS, verbose=False):
+    """
+    Shrinks a data frame in place of its default dtypes -> categoricals for low cardinality text
+    (AssetClass, Model, SecCode...), the smallest integer type that fits, float32 only where it is lossless
+    (so balances and market values are never rounded) and datetime64 for the date columns.
+    Applied when data is loaded and when it is uploaded.
+
+    :param df: data frame to shrink.
+    :param date_columns: names of the columns to parse as dates (day first, as in the extracts).
+    :param verbose: print the memory used before and after.
+    :return: the same data frame with the smaller dtypes.
+    """
+    before = df.memory_usage(deep=True).sum()
+
+    for column in df.columns:
+        values = df[column]
+        if column in date_columns:
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                df[column] = parse_dates(values)
+        elif pd.api.types.is_integer_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            downcast = values.astype(np.float32)
+            # Only keep the smaller type if every value survives the round trip exactly
+            if np.array_equal(downcast.astype(np.float64).to_numpy(), values.to_numpy(), equal_nan=True):
+                df[column] = downcast
+        elif values.dtype == object or pd.api.types.is_string_dtype(values):
+            if len(values) and values.nunique() / len(values) <= CATEGORY_RATIO:
+                df[column] = values.astype('category')
+
+    if verbose:
+        after = df.memory_usage(deep=True).sum()
+        print(f"Memory: {before / 1024 ** 2:.2f} MB -> {after / 1024 ** 2:.2f} MB "
+              f"({100 * (1 - after / before) if before else 0:.0f}% saved)")
+
+    return df
+
+
+@timed_read
 def get_uploaded_data():
     """
     Reaches for 'uploaded_data.db' file and creates a df
@@ -29,9 +103,10 @@ def get_uploaded_data():
     query = "SELECT * FROM uploaded_data_table"
     df = pd.read_sql(query, db_connection)
     db_connection.close()
-    return df
+    return optimise_dtypes(df)
 
 
+@timed_phase('figure')
 def create_bubble_plot(df):
     """
     Bubble plot specific output.
@@ -78,6 +153,7 @@ def convert_coordinates(coord_str):
     return decimal_degrees
 
 
+@timed_phase('figure')
 def create_high_tax_geo_bubble_plot(df):
     """
     Creates a figure that is geographical bubble plot...
@@ -106,6 +182,7 @@ def create_high_tax_geo_bubble_plot(df):
     return fig
 
 
+@timed_phase('figure')
 def create_hexabin_graph(df):
     """
     Hexabin tryout -> something funky to mix it up against the bubble plot.
@@ -154,22 +231,50 @@ def create_hexabin_graph(df):
     return hexbin_fig
 
 
+# Columns the home page views need, anything else in an upload never leaves the server
+HOME_VIEW_COLUMNS = ['Income', 'Age', 'Size', 'Latitude', 'Longitude', 'Average Taxable Income']
+
+
+@timed_phase('figure')
+def compact_view_data(df):
+    """
+    Builds the compact copy of the uploaded data that is shipped to the browser once after upload, so the
+    home page can switch between the bubble, geo-bubble and hexabin views without calling the server.
+
+    :param df: data frame of the uploaded data.
+    :return: dictionary with the projected columns (column -> list of values) and, when the data has
+             coordinates and incomes, the precomputed hexabin figure (binning is too heavy for the browser).
+    """
+    columns = [column for column in HOME_VIEW_COLUMNS if column in df.columns]
+    view_data = {
+        'columns': {column: df[column].tolist() for column in columns},
+        'hexbin': None,
+    }
+    if {'Latitude', 'Longitude', 'Income'}.issubset(columns):
+        view_data['hexbin'] = create_hexabin_graph(df).to_plotly_json()
+
+    return view_data
+
+
 # Proof of concept something more aesthetic... than the original data
-def dummy_hexabin_data():
-    # Set seed for reproducibility
-    np.random.seed(42)
+def dummy_hexabin_data(output='Data/dummy_data_sydney.csv', n_points=1000, seed=42):
+    """
+    Random incomes around Sydney for the hexabin plot (Synthetic_Data.py 'geo' covers the whole country at scale).
 
-    # Number of data points
-    n_points = 1000
+    :param output: CSV file written.
+    :param n_points: number of data points.
+    :param seed: seed for reproducibility.
+    """
+    rng = np.random.default_rng(seed)
 
     # Coordinates for Sydney, Australia
     location_lat = -33.8688
     location_lon = 151.2093
 
     # Generate random data around the specified location
-    lat = np.random.normal(loc=location_lat, scale=0.05, size=n_points)
-    lon = np.random.normal(loc=location_lon, scale=0.05, size=n_points)
-    income = np.random.normal(loc=50000, scale=10000, size=n_points)  # Example: income
+    lat = rng.normal(loc=location_lat, scale=0.05, size=n_points)
+    lon = rng.normal(loc=location_lon, scale=0.05, size=n_points)
+    income = rng.normal(loc=50000, scale=10000, size=n_points)  # Example: income
 
     # Create a DataFrame
     df = pd.DataFrame({
@@ -179,12 +284,13 @@ def dummy_hexabin_data():
     })
 
     # Save the data as a CSV file
-    df.to_csv('Data/dummy_data_sydney.csv', index=False)
+    df.to_csv(output, index=False)
 
 
 # dummy_hexabin_data()
 
 
+@timed_phase('figure')
 def create_default_scatter_plot(df):
     fig = {
         'data': [
@@ -195,6 +301,7 @@ def create_default_scatter_plot(df):
     return fig
 
 
+@timed_phase('figure')
 def default_graph():
     # Define coordinates for a smiley face
     data = {
@@ -213,14 +320,35 @@ def default_graph():
     return fig
 
 
-def get_perf_data():
+@timed_read
+def get_perf_data(acct_ids=None, start=None, end=None):
+    """
+    Performance data, from the memory-mapped balance store (Balance_Store.py) when the upload wrote one -> only
+    the accounts / dates asked for are copied out of it. Falls back to performance_data.db otherwise.
+
+    :param acct_ids: accounts wanted (all of them when None).
+    :param start: first month end wanted (None for no lower bound).
+    :param end: last month end wanted (None for no upper bound).
+    :return: data frame of AcctId, EOM, ClosingBal.
+    """
+    store = open_balances()
+    if store is not None:
+        return optimise_dtypes(store.frame(acct_ids, start, end))
+
     db_connection = sqlite3.connect('performance_data.db')
     query = "SELECT * FROM performance_data_table"
-    df = pd.read_sql(query, db_connection)
+    df = optimise_dtypes(pd.read_sql(query, db_connection))
     db_connection.close()
-    return df
+    if acct_ids is not None:
+        df = df[df['AcctId'].isin(acct_ids)]
+    if start is not None:
+        df = df[df['EOM'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['EOM'] <= pd.Timestamp(end)]
+    return df.reset_index(drop=True)
 
 
+@timed_phase('figure')
 def performance_line_graph(df):
     """
     This will track the closing balance at the end of each month...
@@ -349,22 +477,26 @@ def worst_account(df):
 
 
 # Fake data generator for the sales demonstration
-def generate_sample_sales_data(file_path='sample_sales_data.xlsx', num_rows=30):
+def generate_sample_sales_data(file_path='sample_sales_data.xlsx', num_rows=30, seed=None):
     """
-    Generate sample sales data and save it to an Excel file.
+    Generate sample sales data and save it to an Excel file. For holdings in the shape of the sales page
+    extract at any scale use Synthetic_Data.py ('sales').
 
     Parameters:
     - file_path (str): Path to the Excel file where the data will be saved.
     - num_rows (int): Number of rows (entries) to generate in the dataset.
+    - seed (int): Seed for reproducible data.
 
     Returns:
     - None
     """
+    rng = np.random.default_rng(seed)
     data = {
         'Date': pd.date_range(start='2022-01-01', periods=num_rows, freq='D'),
-        'Product': [f'Product_{random.randint(1, 5)}' for _ in range(num_rows)],
-        'Category': [f'Category_{random.choice(["A", "B", "C"])}' for _ in range(num_rows)],
-        'Sales': [random.randint(100, 500) for _ in range(num_rows)],
+        'Product': pd.Categorical.from_codes(rng.integers(0, 5, num_rows), [f'Product_{i}' for i in range(1, 6)]),
+        'Category': pd.Categorical.from_codes(rng.integers(0, 3, num_rows), ['Category_A', 'Category_B',
+                                                                             'Category_C']),
+        'Sales': rng.integers(100, 501, num_rows),
     }
 
     sales_df = pd.DataFrame(data)
@@ -378,59 +510,227 @@ def generate_sample_sales_data(file_path='sample_sales_data.xlsx', num_rows=30):
 # generate_sample_sales_data(file_path='custom_sales_data.xlsx', num_rows=50)
 
 
-def parse_contents(contents, filename, date):
+# Uploads are previewed from this table one page at a time, the browser never gets the whole file
+PREVIEW_DATABASE = 'preview_data.db'
+PREVIEW_TABLE = 'preview_table'
+PREVIEW_PAGE_SIZE = 20
+
+# Dash DataTable filter operators -> SQL operators
+FILTER_OPERATORS = [['ge ', '>='],
+                    ['le ', '<='],
+                    ['lt ', '<'],
+                    ['gt ', '>'],
+                    ['ne ', '!='],
+                    ['eq ', '='],
+                    ['contains '],
+                    ['datestartswith ']]
+
+
+def decode_upload(contents, filename):
+    """
+    Decodes the base64 contents given by dcc.Upload into a data frame.
+
+    :param contents: contents property of the dcc.Upload component.
+    :param filename: name of the uploaded file, used to tell CSV and Excel apart.
+    :return: data frame of the uploaded file.
+    """
     content_type, content_string = contents.split(',')
 
     decoded = base64.b64decode(content_string)
-    try:
-        if 'csv' in filename:
-            # Assume that the user uploaded a CSV file
-            df = pd.read_csv(
-                io.StringIO(decoded.decode('utf-8')))
-        elif 'xls' in filename:
-            # Assume that the user uploaded an CSV file
-            df = pd.read_excel(io.BytesIO(decoded))
-    except Exception as e:
-        print(e)
-        return html.Div([
-            'There was an error processing this file.'
-        ])
+    if 'csv' in filename:
+        # Assume that the user uploaded a CSV file
+        return pd.read_csv(
+            io.StringIO(decoded.decode('utf-8')))
+    elif 'xls' in filename:
+        # Assume that the user uploaded an excel file -> parsed once per workbook, then read from the cache
+        return read_upload(decoded, filename)
+    raise ValueError(f"Unsupported file type: {filename}")
+
+
+def summarise_frame(df):
+    """
+    Cheap summary of a data frame, computed once at ingest and shown above the preview.
+
+    :param df: data frame being ingested.
+    :return: dictionary with the row count and the dtype / null count of every column.
+    """
+    null_counts = df.isna().sum()
+    return {
+        'row_count': len(df),
+        'columns': [{'Column': column, 'Type': str(dtype), 'Nulls': int(null_counts[column])}
+                    for column, dtype in df.dtypes.items()],
+    }
+
+
+def preview_table(columns, data=(), page_count=1, page_size=PREVIEW_PAGE_SIZE):
+    """
+    DataTable that loads its rows page by page from the preview table (see get_preview_page).
+    Paging, sorting and filtering are all done by the server ('custom' actions).
+
+    :param columns: column names of the stored data.
+    :param data: rows of the first page.
+    :param page_count: number of pages stored.
+    :param page_size: rows shown per page.
+    :return: dash DataTable.
+    """
+    return dash_table.DataTable(
+        id='upload-preview',
+        columns=[{'name': i, 'id': i} for i in columns],
+        data=list(data),
+        page_action='custom',
+        page_current=0,
+        page_size=page_size,
+        page_count=max(1, page_count),
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+    )
+
+
+def preview_upload(df, filename, date):
+    """
+    Stores the data frame in the preview table and returns the preview component -> the file name,
+    upload date, summary stats and the paged table.
+
+    :param df: data frame of the uploaded file.
+    :param filename: name of the uploaded file.
+    :param date: last modified timestamp of the uploaded file.
+    :return: html Div with the preview.
+    """
+    db_connection = sqlite3.connect(PREVIEW_DATABASE)
+    df.to_sql(PREVIEW_TABLE, db_connection, if_exists='replace', index=False, chunksize=10000)
+    db_connection.close()
+
+    summary = summarise_frame(df)
+    # The table arrives with its first page -> the paging callback only fires once the user pages, sorts or filters
+    data, page_count = get_preview_page(0, PREVIEW_PAGE_SIZE, [], '')
 
     return html.Div([
         html.H5(filename),
         html.H6(datetime.datetime.fromtimestamp(date)),
+        html.P(f"{summary['row_count']} rows, {len(df.columns)} columns"),
 
         dash_table.DataTable(
-            df.to_dict('records'),
-            [{'name': i, 'id': i} for i in df.columns]
+            summary['columns'],
+            [{'name': i, 'id': i} for i in ['Column', 'Type', 'Nulls']]
         ),
 
         html.Hr(),  # horizontal line
 
-        # For debugging, display the raw contents provided by the web browser
-        html.Div('Raw Content'),
-        html.Pre(contents[0:200] + '...', style={
-            'whiteSpace': 'pre-wrap',
-            'wordBreak': 'break-all'
-        })
+        preview_table(list(df.columns), data, page_count),
     ])
 
 
-def convert_csv_json(csv_file, json_file):
+def parse_contents(contents, filename, date):
+    try:
+        df = decode_upload(contents, filename)
+    except Exception as e:
+        print(e)
+        return html.Div([
+            'There was an error processing this file.'
+        ])
+
+    return preview_upload(df, filename, date)
+
+
+def split_filter_part(filter_part):
+    """
+    Splits one part of a DataTable filter query (i.e. '{Income} ge 1000') into its pieces.
+
+    :param filter_part: single filter expression.
+    :return: (column name, SQL operator, value), or [None] * 3 if it can't be parsed.
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later -> last entry is the SQL version of the operator
+                return name, operator_type[-1].strip(), value
+
+    return [None] * 3
+
+
+@timed_read
+def get_preview_page(page_current, page_size, sort_by, filter_query):
+    """
+    Reads a single page of the preview table, with the DataTable sorting and filtering done in SQL.
+
+    :param page_current: index of the page to read (from 0).
+    :param page_size: rows per page.
+    :param sort_by: DataTable sort_by property, list of {'column_id', 'direction'}.
+    :param filter_query: DataTable filter_query property.
+    :return: (list of row dictionaries for the page, number of pages after filtering).
+    """
+    db_connection = sqlite3.connect(PREVIEW_DATABASE)
+    try:
+        columns = [row[1] for row in db_connection.execute(f'PRAGMA table_info("{PREVIEW_TABLE}")')]
+
+        conditions = []
+        parameters = []
+        for filter_part in (filter_query or '').split(' && '):
+            name, operator, value = split_filter_part(filter_part)
+            # Only ever put known column names into the query
+            if name not in columns:
+                continue
+            if operator == 'contains':
+                conditions.append(f'"{name}" LIKE ?')
+                parameters.append(f'%{value}%')
+            elif operator == 'datestartswith':
+                conditions.append(f'"{name}" LIKE ?')
+                parameters.append(f'{value}%')
+            else:
+                conditions.append(f'"{name}" {operator} ?')
+                parameters.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        order = ', '.join(f'"{sort["column_id"]}" {"DESC" if sort["direction"] == "desc" else "ASC"}'
+                          for sort in (sort_by or []) if sort['column_id'] in columns)
+        order_by = f' ORDER BY {order}' if order else ''
+
+        row_count = db_connection.execute(f'SELECT COUNT(*) FROM "{PREVIEW_TABLE}"{where}', parameters).fetchone()[0]
+        page = pd.read_sql(
+            f'SELECT * FROM "{PREVIEW_TABLE}"{where}{order_by} LIMIT ? OFFSET ?',
+            db_connection,
+            params=parameters + [page_size, page_current * page_size],
+        )
+    finally:
+        db_connection.close()
+
+    return page.to_dict('records'), max(1, -(-row_count // page_size))
+
+
+def convert_csv_json(csv_file, json_file, columns=None, compression=None):
     """
-    Lil helper function to convert any CSV files to JSON files for javascript usage,
-    as data for back-end for js applications...
+    Lil helper function to convert any CSV (or Excel) files to JSON lines files for javascript usage,
+    as data for back-end for js applications... Streams the file chunk by chunk (Data_Export.py), so multi-GB
+    extracts don't have to fit in memory. Use Data_Export directly for Parquet / Arrow or several files at once.
 
     :param csv_file: file path name of the csv desired for conversion.
     :param json_file: output file path name for the JSON output.
+    :param columns: columns to keep (all of them when None).
+    :param compression: None, 'gzip', 'bz2' or 'xz'.
     :return: None, will create and save JSON file in specified location.
     """
     try:
-        df = pd.read_csv(csv_file)
-
-        df.to_json(json_file, orient='records', lines=True)
+        result = export_file(csv_file, json_file, 'jsonl', columns=columns, compression=compression)
 
-        print(f"Conversion success. JSON file saved to: {json_file}")
+        print(f"Conversion success. JSON file saved to: {json_file} ({result['rows']:,} rows, "
+              f"{result['mb_per_second']:,.1f} MB/s)")
 
     except Exception as e:
         print(f"Error: {e}")
@@ -474,31 +774,20 @@ def populate_longitude_latitude(target, source, output):
 
 # Below is some self-made advisor performance data, to show proof of concept, since actual data given was impossible
 # to extrapolate from
-def generate_and_save_sample_data(num_entries=365, output_csv='sample_data.csv'):
+def generate_and_save_sample_data(num_entries=365, output_csv='sample_data.csv', seed=42):
     """
-    Generate sample data with dates, advisor IDs, and returns, and save it to a CSV file.
+    Generate sample data in the shape of performance_extract.csv (AcctId, EOM, ClosingBal -> what the
+    performance page reads) and save it to a CSV file. Larger files are written in chunks by Synthetic_Data.py.
 
     Parameters:
     - num_entries (int): Number of entries to generate.
     - output_csv (str): File path to save the CSV file.
+    - seed (int): Seed for reproducible data.
 
     Returns:
-    - pd.DataFrame: DataFrame with columns for Date, AdvisorID, and Returns.
+    - pd.DataFrame: DataFrame with columns for AcctId, EOM and ClosingBal.
     """
-    start_date = pd.to_datetime('2022-01-01')
-    end_date = start_date + timedelta(days=num_entries - 1)
-
-    # Generate random advisor IDs
-    advisor_ids = [random.randint(1, 5) for _ in range(num_entries)]  # Assume 5 advisors
-
-    # Generate random returns in dollars
-    returns = [random.uniform(-1000, 1000) for _ in range(num_entries)]
-
-    # Create DataFrame
-    data = {'Date': pd.date_range(start=start_date, end=end_date, freq='D'),
-            'AdvisorID': advisor_ids,
-            'Returns': returns}
-    df = pd.DataFrame(data)
+    df = generate_frame('performance', num_entries, seed)
 
     # Save the DataFrame to a CSV file
     df.to_csv(output_csv, index=False)
@@ -507,6 +796,7 @@ def generate_and_save_sample_data(num_entries=365, output_csv='sample_data.csv')
     return df
 
 
+@timed_read
 def get_spider_data():
     """
     Reaches for 'uploaded_data.db' file and creates a df
@@ -518,11 +808,12 @@ def get_spider_data():
     query = "SELECT * FROM sales_data_table"
     df = pd.read_sql(query, db_connection)
     db_connection.close()
-    return df
+    return optimise_dtypes(df)
 
 
 # May add in date slider and can see the portfolio change over time
 # Also add the advisor number etc basic implementation, would look really nice actually...
+@timed_phase('figure')
 def sales_spider(df, adviser):
     """
     Filters through the data frame, obtains enough information about the asset composition,
@@ -567,6 +858,7 @@ def get_advisor_value(data):
     return advisor
 
 
+@timed_phase('figure')
 def sales_bar(data, adviser):
     """
     This function outputs a bar graph summarising the total market value of the aggregated asset classes.
@@ -613,6 +905,7 @@ def sales_bar(data, adviser):
 # uploading different ones... could be very effective to show case the potential at least
 
 
+@timed_phase('figure')
 def sales_spider_2():
     fig = go.Figure(data=go.Scatterpolar(
         r=[4, 3, 2, 5, 1],
@@ -633,14 +926,12 @@ def sales_spider_2():
 
 
 def aggregate_closing_bal_and_save(csv_output_path, excel_input_path):
-    # Read the Excel file into a DataFrame
-    df_excel = pd.read_excel(excel_input_path, "Performance")
+    # Sum the 'ClosingBal' of each 'AcctId' and 'EOM' combination of the Performance sheet -> only those columns
+    # are read, and a workbook that was already read comes straight from the Parquet cache (Excel_Ingest.py)
+    df_aggregated = aggregate_performance(excel_input_path)
 
-    # Group by 'Advisor' and 'Date' and sum the 'Market Value' for each combination
-    df_aggregated = df_excel.groupby(['AcctId', 'EOM'])['ClosingBal'].sum().reset_index()
-
-    # Save the aggregated DataFrame to a new CSV file
-    df_aggregated.to_csv(csv_output_path, index=False)
+    # Save the aggregated DataFrame to a new CSV file, dates written like the extract
+    df_aggregated.to_csv(csv_output_path, index=False, date_format='%d/%m/%Y')
 
 
 # aggregate_closing_bal_and_save("Data/performance_extract.csv",
@@ -653,6 +944,31 @@ def aggregate_closing_bal_and_save(csv_output_path, excel_input_path):
 #
 #     # Store that cumulative row into a new csv file...
 
+@timed_phase('figure')
+def adviser_drilldown_graph(adviser, series, balances):
+    """
+    Closing balances of one adviser -> the total of all their accounts, plus a line per account.
+
+    :param adviser: adviser code.
+    :param series: total closing balance per month end (EOM, ClosingBal) from the adviser rollup.
+    :param balances: balances of the accounts to draw (AcctId, EOM, ClosingBal).
+    :return: line graph of the adviser's accounts.
+    """
+    fig = px.line(balances, x='EOM', y='ClosingBal', color='AcctId',
+                  labels={'EOM': 'Date', 'ClosingBal': 'Closing Balance', 'AcctId': 'Account ID'})
+    fig.update_traces(opacity=0.5)
+    # Total on its own axis -> otherwise it flattens the account lines
+    fig.add_trace(go.Scatter(x=series['EOM'], y=series['ClosingBal'], name='Total', yaxis='y2',
+                             line=dict(color='black', width=3)))
+    fig.update_layout(
+        title=f"Advisor Code {adviser} -> closing balances of their accounts",
+        yaxis2=dict(title='Total Closing Balance', overlaying='y', side='right'),
+        legend=dict(x=1.08),
+    )
+    return fig
+
+
+@timed_phase('figure')
 def create_sales_funnel_chart():
     data = pd.DataFrame(dict(
         Pipeline=["Cold Outreach", "Qualified Leads", "Demo Calls Booked", "Closed",
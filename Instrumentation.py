@@ -0,0 +1,295 @@
+import os
+import time
+import json
+import cProfile
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+import pandas as pd
+
+"""
+Where does the time of a slow callback go? Per-callback timings split into phases, kept in in-process
+histograms and served as Prometheus text on /metrics of the Flask server.
+
+- request   -> whole /_dash-update-component request, per callback
+- read      -> sqlite reads of the data accessors (@timed_read), with the number of rows read
+- figure    -> building plotly figures (@timed_phase('figure'))
+- pandas    -> the rest of the callback body (callback time - read - figure)
+- serialise -> everything Dash does around the callback, mostly turning the result into JSON
+               (request time - callback time)
+plus the response size of every callback and the chatbot cache / LLM client counters.
+
+Callbacks are marked with @instrumented (under @callback). Background callbacks run in the job process, so
+only their request (start and polling) is measured here. Every worker process has its own numbers.
+
+Profiling -> PROFILE_CALLBACKS=all (or a comma separated list of callback names) profiles those callbacks
+with cProfile, or send the header 'X-Profile: 1' with a single request. Profiles are written to PROFILE_DIR
+(default ./profiles) as <callback>-<time>.prof, open them with snakeviz or pstats.
+"""
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf')]
+BYTES_BUCKETS = [1e3, 1e4, 1e5, 1e6, 1e7, 1e8, float('inf')]
+ROWS_BUCKETS = [10, 100, 1e3, 1e4, 1e5, 1e6, 1e7, float('inf')]
+
+PROFILE_CALLBACKS = {name.strip() for name in os.getenv('PROFILE_CALLBACKS', '').split(',') if name.strip()}
+PROFILE_DIRECTORY = os.getenv('PROFILE_DIR', 'profiles')
+
+_lock = threading.Lock()
+# (metric name, labels) -> [bucket counts, sum, count]
+_histograms = {}
+_buckets = {}
+# State of the request being handled by this thread
+_request = threading.local()
+
+
+def observe(name, value, buckets=DURATION_BUCKETS, **labels):
+    """
+    Adds a value to a histogram.
+
+    :param name: metric name.
+    :param value: observed value (seconds, bytes, rows...).
+    :param buckets: upper bounds of the buckets (the last one must be infinity).
+    :param labels: labels of the series, i.e. callback='pages.home.store_data'.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _buckets.setdefault(name, buckets)
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [[0] * len(buckets), 0.0, 0]
+        series[0][bisect_left(buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+
+def _callback_name(func):
+    return f"{func.__module__}.{func.__name__}"
+
+
+def _phases():
+    # Phase totals of the callback running in this thread (None outside of a callback)
+    return getattr(_request, 'phases', None)
+
+
+class _Phase:
+    """
+    Times a phase of the current callback, nested phases only count once (the outer one).
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.phases = _phases()
+        self.outer = self.phases is not None and not _request.in_phase
+        if self.outer:
+            _request.in_phase = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.outer:
+            self.phases[self.phase] = self.phases.get(self.phase, 0) + time.perf_counter() - self.start
+            _request.in_phase = False
+        return False
+
+
+def timed_phase(phase):
+    """
+    Decorator -> the time spent in the function counts towards the phase of the callback calling it.
+
+    :param phase: name of the phase, i.e. 'figure'.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Phase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_read(func):
+    """
+    Decorator for the data accessors -> times the read (also outside of a callback) and counts the rows of the
+    data frame returned.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        with _Phase('read'):
+            result = func(*args, **kwargs)
+        observe('data_read_seconds', time.perf_counter() - start, accessor=func.__name__)
+        # Preview pages come back as (records, page count) -> only count the records read
+        if isinstance(result, pd.DataFrame):
+            rows = len(result)
+        elif isinstance(result, tuple) and result and isinstance(result[0], list):
+            rows = len(result[0])
+        else:
+            rows = 0
+        observe('data_read_rows', rows, ROWS_BUCKETS, accessor=func.__name__)
+        if _phases() is not None:
+            _request.rows = getattr(_request, 'rows', 0) + rows
+        return result
+    return wrapper
+
+
+def instrumented(func):
+    """
+    Decorator for the Dash callbacks (under @callback) -> times the callback and splits the time in phases.
+    """
+    name = _callback_name(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        _request.callback = name
+        _request.phases = {}
+        _request.in_phase = False
+        _request.rows = 0
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            phases = _request.phases
+            _request.phases = None
+            phases['pandas'] = max(elapsed - sum(phases.values()), 0)
+            for phase, seconds in phases.items():
+                observe('dash_callback_phase_seconds', seconds, callback=name, phase=phase)
+            observe('dash_callback_seconds', elapsed, callback=name)
+            observe('dash_callback_rows_read', _request.rows, ROWS_BUCKETS, callback=name)
+            _request.callback_seconds = elapsed
+    return wrapper
+
+
+def _profile_wanted(callback, headers):
+    return headers.get('X-Profile') == '1' or 'all' in PROFILE_CALLBACKS or callback in PROFILE_CALLBACKS \
+        or callback.rsplit('.', 1)[-1] in PROFILE_CALLBACKS
+
+
+def _requested_output(body):
+    # Name of the callback before it runs -> the outputs it updates, i.e. '..output-container.children..'
+    try:
+        return json.loads(body).get('output', 'unknown')
+    except (ValueError, AttributeError):
+        return 'unknown'
+
+
+def _format_labels(labels):
+    # Pattern matching ids are JSON, so label values can hold quotes
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+
+
+def _histogram_lines():
+    lines = []
+    with _lock:
+        items = sorted((key, [list(series[0]), series[1], series[2]]) for key, series in _histograms.items())
+        buckets = dict(_buckets)
+    typed = set()
+    for (name, labels), (counts, total, count) in items:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(buckets[name], counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'{name}_bucket{{{_format_labels(labels + (("le", le),))}}} {cumulative}')
+        label_text = f'{{{_format_labels(labels)}}}' if labels else ''
+        lines.append(f'{name}_sum{label_text} {total}')
+        lines.append(f'{name}_count{label_text} {count}')
+    return lines
+
+
+def _counter_lines(prefix, metrics, help_text):
+    lines = [f"# {help_text}"]
+    for key, value in metrics.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            lines.append(f"{prefix}_{key} {value}")
+    return lines
+
+
+def metrics_text():
+    """
+    :return: every metric of this process in the Prometheus text format.
+    """
+    from Chat_Cache import cache_metrics
+    from LLM_Client import llm_metrics
+
+    lines = _histogram_lines()
+    lines += _counter_lines('chat_cache', cache_metrics(), 'Chatbot response cache (Chat_Cache.py)')
+    llm = llm_metrics()
+    latency = llm.pop('latency_buckets')
+    latency_sum = llm.pop('latency_sum')
+    lines += _counter_lines('llm', llm, 'Chatbot backend client (LLM_Client.py)')
+    lines.append("# TYPE llm_latency_seconds histogram")
+    cumulative = 0
+    for bound, count in latency.items():
+        cumulative += count
+        lines.append(f'llm_latency_seconds_bucket{{le="{"+Inf" if bound == float("inf") else f"{bound:g}"}"}} '
+                     f'{cumulative}')
+    lines.append(f"llm_latency_seconds_sum {latency_sum}")
+    lines.append(f"llm_latency_seconds_count {cumulative}")
+    lines.append(f"process_pid {os.getpid()}")
+    return '\n'.join(lines) + '\n'
+
+
+def install_instrumentation(server):
+    """
+    Adds the request hooks (callback timings, response sizes, profiling) and the /metrics endpoint to the Flask
+    server of the Dash app.
+
+    :param server: Flask server (app.server).
+    """
+    from flask import request, Response
+
+    @server.before_request
+    def start_request():
+        _request.callback = None
+        _request.callback_seconds = None
+        _request.profiler = None
+        if not request.path.endswith('/_dash-update-component'):
+            return
+        _request.started = time.perf_counter()
+        # The callback name is only known once it ran -> profile and only keep the profiles wanted
+        if PROFILE_CALLBACKS or request.headers.get('X-Profile') == '1':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                _request.profiler = profiler
+            except ValueError:
+                # Another request is already being profiled (one profiler at a time from python 3.12)
+                pass
+
+    @server.after_request
+    def finish_request(response):
+        if not request.path.endswith('/_dash-update-component'):
+            return response
+        elapsed = time.perf_counter() - _request.started
+        name = _request.callback or _requested_output(request.get_data(cache=True))
+        profiler = _request.profiler
+        if profiler is not None:
+            profiler.disable()
+            _request.profiler = None
+            if _profile_wanted(name, request.headers):
+                os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+                safe_name = ''.join(c if c.isalnum() or c in '._-' else '_' for c in name)[:100]
+                profiler.dump_stats(os.path.join(PROFILE_DIRECTORY, f"{safe_name}-{time.time():.0f}.prof"))
+
+        observe('dash_request_seconds', elapsed, callback=name)
+        if _request.callback_seconds is not None:
+            observe('dash_callback_phase_seconds', max(elapsed - _request.callback_seconds, 0), callback=name,
+                    phase='serialise')
+        size = response.calculate_content_length() if not response.is_streamed else None
+        if size is not None:
+            observe('dash_response_bytes', size, BYTES_BUCKETS, callback=name)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,206 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from bisect import bisect_left
+
+import openai
+
+"""
+Protects the app from a slow or failing LLM backend (openai_function.py).
+
+- at most LLM_MAX_CONCURRENCY requests go upstream at once per process, at most LLM_MAX_QUEUE more wait for
+  a slot (for up to LLM_QUEUE_TIMEOUT seconds), anything past that is turned away straight away
+- every request has a timeout (LLM_TIMEOUT seconds)
+- timeouts, connection errors, rate limits and server errors are retried LLM_RETRIES times with jittered
+  exponential backoff
+- after LLM_BREAKER_FAILURES failures in a row the circuit opens and requests fail fast for
+  LLM_BREAKER_RESET seconds, then a single trial request decides whether it closes again
+Where the requests go is set by LLM_BASE_URL (i.e. a local stand-in for load tests).
+"""
+
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 16))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 10))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', 2))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', 0.5))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', 8))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', 30))
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')]
+
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                    openai.InternalServerError)
+
+
+class LLMUnavailable(Exception):
+    """
+    Raised when a request is not sent upstream -> the queue is full, no slot came free in time or the
+    circuit is open.
+    """
+
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_slots = None
+_breaker = {'failures': 0, 'opened_at': None, 'trial_running': False}
+_metrics = {'requests': 0, 'successes': 0, 'failures': 0, 'retries': 0, 'rejected': 0, 'queue_depth': 0,
+            'max_queue_depth': 0, 'in_flight': 0, 'latency_sum': 0.0,
+            'latency_buckets': [0] * len(LATENCY_BUCKETS)}
+
+
+def _admit():
+    """
+    Checks the circuit breaker and the queue before a request waits for a slot.
+    """
+    with _lock:
+        _metrics['requests'] += 1
+        # Queue first -> a rejected request must not take the half open trial slot
+        if _metrics['queue_depth'] >= LLM_MAX_QUEUE:
+            _metrics['rejected'] += 1
+            raise LLMUnavailable('too many chatbot requests are waiting')
+        if _breaker['opened_at'] is not None:
+            if time.time() - _breaker['opened_at'] < LLM_BREAKER_RESET or _breaker['trial_running']:
+                _metrics['rejected'] += 1
+                raise LLMUnavailable('the chatbot backend is failing, requests are paused for a moment')
+            # Half open -> let this one request through to see if the backend is back
+            _breaker['trial_running'] = True
+        _metrics['queue_depth'] += 1
+        _metrics['max_queue_depth'] = max(_metrics['max_queue_depth'], _metrics['queue_depth'])
+
+
+def _dequeue(acquired):
+    with _lock:
+        _metrics['queue_depth'] -= 1
+        if acquired:
+            _metrics['in_flight'] += 1
+        else:
+            _metrics['rejected'] += 1
+            _breaker['trial_running'] = False
+
+
+def _record(started, success):
+    elapsed = time.perf_counter() - started
+    with _lock:
+        _metrics['in_flight'] -= 1
+        _metrics['latency_sum'] += elapsed
+        _metrics['latency_buckets'][bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        _breaker['trial_running'] = False
+        if success:
+            _metrics['successes'] += 1
+            _breaker['failures'] = 0
+            _breaker['opened_at'] = None
+        else:
+            _metrics['failures'] += 1
+            _breaker['failures'] += 1
+            if _breaker['failures'] >= LLM_BREAKER_FAILURES or _breaker['opened_at'] is not None:
+                _breaker['opened_at'] = time.time()
+
+
+def _backoff(attempt):
+    # Full jitter -> a random wait up to the exponential backoff, so retries don't arrive together
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def _should_retry(error, attempt):
+    if not isinstance(error, RETRYABLE_ERRORS) or attempt >= LLM_RETRIES:
+        return False
+    with _lock:
+        _metrics['retries'] += 1
+        return _breaker['opened_at'] is None
+
+
+def call_llm(request, timeout=LLM_TIMEOUT):
+    """
+    Sends a request upstream through the limiter, with retries and the circuit breaker.
+
+    :param request: function taking the timeout (seconds) that makes the upstream call.
+    :param timeout: timeout of each attempt.
+    :return: whatever request returns.
+    """
+    _admit()
+    acquired = _slots.acquire(timeout=LLM_QUEUE_TIMEOUT)
+    _dequeue(acquired)
+    if not acquired:
+        raise LLMUnavailable('the chatbot is busy, no slot came free in time')
+
+    try:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = request(timeout)
+            except Exception as e:
+                _record(started, success=False)
+                if not _should_retry(e, attempt):
+                    raise
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                # Retries go through the circuit breaker again, but keep their slot
+                with _lock:
+                    _metrics['in_flight'] += 1
+                continue
+            _record(started, success=True)
+            return result
+    finally:
+        _slots.release()
+
+
+async def acall_llm(request, timeout=LLM_TIMEOUT):
+    """
+    Same as call_llm, for coroutines running on the streaming event loop.
+
+    :param request: async function taking the timeout (seconds) that makes the upstream call.
+    :param timeout: timeout of each attempt.
+    :return: whatever request returns.
+    """
+    global _async_slots
+    # There is one streaming loop per process, the semaphore belongs to it
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+    _admit()
+    try:
+        await asyncio.wait_for(_async_slots.acquire(), LLM_QUEUE_TIMEOUT)
+        acquired = True
+    except asyncio.TimeoutError:
+        acquired = False
+    _dequeue(acquired)
+    if not acquired:
+        raise LLMUnavailable('the chatbot is busy, no slot came free in time')
+
+    try:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = await request(timeout)
+            except Exception as e:
+                _record(started, success=False)
+                if not _should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                attempt += 1
+                with _lock:
+                    _metrics['in_flight'] += 1
+                continue
+            _record(started, success=True)
+            return result
+    finally:
+        _async_slots.release()
+
+
+def llm_metrics():
+    """
+    :return: dictionary of the client counters of this process -> requests, failures, retries, rejections,
+             current / max queue depth, requests in flight, circuit state and the latency histogram.
+    """
+    with _lock:
+        metrics = dict(_metrics, latency_buckets=list(_metrics['latency_buckets']))
+        metrics['circuit_open'] = _breaker['opened_at'] is not None
+    metrics['latency_buckets'] = dict(zip(LATENCY_BUCKETS, metrics['latency_buckets']))
+    return metrics
@@ -0,0 +1,216 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import diskcache
+import pandas as pd
+
+"""
+Local store of daily closing prices for the stock price predictor.
+
+Prices are kept in a sqlite file, so a chart only downloads from Yahoo Finance the dates it doesn't have yet
+(plus a top up of the latest days once the data is older than the TTL). Callers asking for the same ticker at
+the same time wait for a single download instead of each making their own (within a process and across the
+background job processes).
+
+Offline use (tests, load tests, no network):
+    MARKET_DATA_OFFLINE=1   -> never download, only use what is stored
+    MARKET_DATA_FIXTURE=... -> CSV file with Date,Close columns loaded into the store on first use
+                               (for the ticker in MARKET_DATA_FIXTURE_TICKER, default ^AXJO)
+"""
+
+MARKET_DATABASE = os.getenv('MARKET_DATA_DB', 'market_data.db')
+# Seconds before the latest stored prices are topped up again
+MARKET_DATA_TTL = int(os.getenv('MARKET_DATA_TTL', 6 * 60 * 60))
+OFFLINE = os.getenv('MARKET_DATA_OFFLINE', '0') == '1'
+FIXTURE = os.getenv('MARKET_DATA_FIXTURE')
+FIXTURE_TICKER = os.getenv('MARKET_DATA_FIXTURE_TICKER', '^AXJO')
+# Days back from today where an empty download is taken as "no close published yet" rather than a failure
+RECENT_DAYS = 4
+
+_LOCK_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'market_data_locks')
+
+# One lock per ticker for the threads of this process, guarded by _registry_lock
+_ticker_locks = {}
+_registry_lock = threading.Lock()
+_fixture_loaded = False
+
+
+def _connect():
+    db_connection = sqlite3.connect(MARKET_DATABASE, timeout=60)
+    db_connection.execute("CREATE TABLE IF NOT EXISTS prices "
+                          "(ticker TEXT, date TEXT, close REAL, PRIMARY KEY (ticker, date))")
+    # Range of dates [start, end) already downloaded for each ticker and when it was last topped up
+    db_connection.execute("CREATE TABLE IF NOT EXISTS coverage "
+                          "(ticker TEXT PRIMARY KEY, start TEXT, end TEXT, fetched_at REAL)")
+    return db_connection
+
+
+@contextmanager
+def _ticker_lock(ticker):
+    """
+    Lets only one caller per ticker check and fill the store at a time -> everyone else waits and then reads
+    what the first caller downloaded.
+    """
+    with _registry_lock:
+        thread_lock = _ticker_locks.setdefault(ticker, threading.Lock())
+    with thread_lock:
+        # Background callbacks run in other processes, diskcache's lock works across them
+        with diskcache.Cache(_LOCK_DIRECTORY) as lock_cache:
+            with diskcache.Lock(lock_cache, f'prices-{ticker}', expire=120):
+                yield
+
+
+def _download(ticker, start, end):
+    """
+    :return: data frame with Date and Close columns from Yahoo Finance for [start, end).
+    """
+    import yfinance as yf
+
+    data = yf.download(ticker, start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'), progress=False)
+    if data.empty:
+        return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'Close': pd.Series(dtype=float)})
+    close = data['Close']
+    # Newer yfinance versions return one column per ticker even for a single ticker
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    return pd.DataFrame({'Date': close.index, 'Close': close.values})
+
+
+def store_prices(ticker, prices, start, end, fetched_at=None):
+    """
+    Saves prices into the store and extends the covered range of the ticker.
+
+    :param ticker: ticker symbol, i.e. '^AXJO'.
+    :param prices: data frame with Date and Close columns.
+    :param start: first date the prices cover.
+    :param end: date after the last date the prices cover.
+    :param fetched_at: time of the download (defaults to now).
+    """
+    rows = [(ticker, pd.Timestamp(date).strftime('%Y-%m-%d'), float(close))
+            for date, close in zip(prices['Date'], prices['Close'])]
+    start, end = pd.Timestamp(start).strftime('%Y-%m-%d'), pd.Timestamp(end).strftime('%Y-%m-%d')
+    db_connection = _connect()
+    with db_connection:
+        db_connection.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?)", rows)
+        covered = db_connection.execute("SELECT start, end FROM coverage WHERE ticker = ?", (ticker,)).fetchone()
+        if covered is not None:
+            start, end = min(start, covered[0]), max(end, covered[1])
+        db_connection.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)",
+                              (ticker, start, end, time.time() if fetched_at is None else fetched_at))
+    db_connection.close()
+
+
+def load_fixture(csv_path, ticker=FIXTURE_TICKER):
+    """
+    Fills the store from a CSV file (Date,Close columns) so the predictor can run without network access.
+
+    :param csv_path: path of the fixture file.
+    :param ticker: ticker the fixture prices belong to.
+    """
+    prices = pd.read_csv(csv_path, parse_dates=['Date'])
+    store_prices(ticker, prices, prices['Date'].min(), prices['Date'].max() + timedelta(days=1))
+
+
+def _load_fixture_once():
+    global _fixture_loaded
+    if FIXTURE and not _fixture_loaded:
+        load_fixture(FIXTURE)
+        _fixture_loaded = True
+
+
+def _missing_ranges(coverage, start, end, ttl):
+    """
+    :return: list of (start, end) ranges that have to be downloaded to answer [start, end).
+    """
+    if coverage is None:
+        return [(start, end)]
+    covered_start, covered_end, fetched_at = pd.Timestamp(coverage[0]), pd.Timestamp(coverage[1]), coverage[2]
+    ranges = []
+    if start < covered_start:
+        ranges.append((start, covered_start))
+    if end > covered_end:
+        ranges.append((covered_end, end))
+    elif time.time() - fetched_at > ttl and end >= covered_end - timedelta(days=1):
+        # The latest close may have been a partial day when it was downloaded -> top up the last few days
+        ranges.append((covered_end - timedelta(days=3), covered_end))
+    return ranges
+
+
+def _can_be_empty(start, end):
+    """
+    :return: True if [start, end) can have no prices -> no business days (weekends) or too recent for a close.
+    """
+    recent = pd.Timestamp(datetime.today()).normalize() - timedelta(days=RECENT_DAYS)
+    return end > recent or len(pd.bdate_range(start, end - timedelta(days=1))) == 0
+
+
+def get_prices(ticker, start, end, ttl=MARKET_DATA_TTL):
+    """
+    Closing prices of a ticker between two dates, only downloading what isn't stored yet.
+
+    :param ticker: ticker symbol, i.e. '^AXJO'.
+    :param start: first date wanted.
+    :param end: date after the last date wanted (like yf.download).
+    :param ttl: seconds before the latest stored prices are topped up again.
+    :return: data frame with Date and Close columns.
+    :raises ValueError: nothing is stored for the dates and the download failed.
+    """
+    _load_fixture_once()
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+
+    failed = []
+    with _ticker_lock(ticker):
+        if not OFFLINE:
+            db_connection = _connect()
+            coverage = db_connection.execute("SELECT start, end, fetched_at FROM coverage WHERE ticker = ?",
+                                             (ticker,)).fetchone()
+            db_connection.close()
+            for fetch_start, fetch_end in _missing_ranges(coverage, start, end, ttl):
+                try:
+                    downloaded = _download(ticker, fetch_start, fetch_end)
+                except Exception as e:
+                    print(f"Download of {ticker} failed: {e}")
+                    failed.append((fetch_start, fetch_end))
+                    continue
+                if downloaded.empty and not _can_be_empty(fetch_start, fetch_end):
+                    # yfinance returns nothing instead of raising when offline / rate limited -> a range of past
+                    # trading days stays uncovered so the next call downloads it again
+                    failed.append((fetch_start, fetch_end))
+                    continue
+                # Weekends, holidays and today before the close are stored as covered (empty) -> the TTL applies
+                store_prices(ticker, downloaded, fetch_start, fetch_end)
+
+    db_connection = _connect()
+    prices = pd.read_sql("SELECT date AS Date, close AS Close FROM prices "
+                         "WHERE ticker = ? AND date >= ? AND date < ? ORDER BY date",
+                         db_connection, params=(ticker, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')),
+                         parse_dates=['Date'])
+    db_connection.close()
+    if prices.empty and failed:
+        raise ValueError(f"No prices for {ticker} between {start:%Y-%m-%d} and {end:%Y-%m-%d}, the download "
+                         f"failed (offline or rate limited?)")
+    return prices
+
+
+def get_latest_prices(ticker, days=60):
+    """
+    Closing prices of the last `days` days. When offline this is the last `days` days that are stored,
+    so a fixture from any period can be used.
+
+    :param ticker: ticker symbol, i.e. '^AXJO'.
+    :param days: number of calendar days to go back.
+    :return: data frame with Date and Close columns.
+    """
+    end = pd.Timestamp(datetime.today()).normalize()
+    if OFFLINE:
+        _load_fixture_once()
+        db_connection = _connect()
+        covered = db_connection.execute("SELECT end FROM coverage WHERE ticker = ?", (ticker,)).fetchone()
+        db_connection.close()
+        if covered is not None:
+            end = pd.Timestamp(covered[0])
+    return get_prices(ticker, end - timedelta(days=days), end)
@@ -0,0 +1,287 @@
+import threading
+import time
+
+import numpy as np
+import plotly.graph_objects as go
+
+from Instrumentation import timed_phase
+
+"""
+Monte Carlo retirement / savings projections for the planner page -> every path (and every scenario) is simulated
+at once with numpy, one year per step.
+
+Each year contributions are paid in (before retirement, growing with inflation and contribution_growth) or the
+withdrawal is taken out (from retirement, in today's dollars so indexed to inflation), then the balance grows by a
+lognormal return (expected_return, volatility) less the fee. Inflation is drawn every year too.
+
+The balance is linear in balance, contribution and withdrawal, so the engine keeps per path
+    growth       -> what $1 of starting balance becomes
+    contributed  -> what $1 a year of contributions becomes
+    withdrawn    -> what $1 a year of withdrawals costs
+and a projection is  max(balance x growth + contribution x contributed - withdrawal x withdrawn, 0)  (no
+contributions after retirement, so a path that went below zero never comes back and the max is exact).
+
+Inputs are split in stages, each cached with the inputs it depends on, and a projection only recomputes the stages
+whose inputs changed:
+    draws       <- seed, paths                                     (random numbers, drawn once)
+    market      <- expected_return, volatility, fee
+    inflation   <- inflation, inflation_volatility
+    components  <- current_age, retirement_age, end_age, contribution_growth (+ market, inflation)
+    outcome     <- balance, contribution, withdrawal (+ components)
+Moving the balance, contribution or withdrawal slider is just the last stage (about 25ms for 10k paths x 60 years,
+mostly the percentiles, against 120ms from scratch), a market slider redoes market -> outcome (about 50ms), and the
+same random numbers are kept so the chart only moves because of the input.
+
+Any input but current_age can also be an array of scenarios (one projection per value, all paths of all scenarios
+together, inputs with several values need the same number of them), which is what the sensitivity chart uses.
+"""
+
+# Input -> (label, minimum, maximum, step, default), shared with the sliders of the planner page
+ASSUMPTIONS = {
+    'current_age': ('Current age', 18, 80, 1, 35),
+    'retirement_age': ('Retirement age', 40, 80, 1, 67),
+    'end_age': ('Plan until age', 60, 100, 1, 95),
+    'balance': ('Current balance ($)', 0, 2_000_000, 10_000, 150_000),
+    'contribution': ('Contributions per year ($)', 0, 100_000, 1_000, 15_000),
+    'contribution_growth': ('Contribution growth above inflation', 0, 0.05, 0.005, 0.01),
+    'withdrawal': ("Retirement income per year (today's $)", 0, 200_000, 1_000, 60_000),
+    'expected_return': ('Expected return', 0, 0.12, 0.005, 0.065),
+    'volatility': ('Return volatility', 0, 0.3, 0.01, 0.11),
+    'fee': ('Fees', 0, 0.03, 0.001, 0.008),
+    'inflation': ('Inflation', 0, 0.08, 0.0025, 0.025),
+    'inflation_volatility': ('Inflation volatility', 0, 0.03, 0.0025, 0.01),
+}
+DEFAULTS = {name: spec[4] for name, spec in ASSUMPTIONS.items()}
+# Percentiles of the paths shown in the fan chart
+PERCENTILES = [5, 25, 50, 75, 95]
+PROJECTION_PATHS = 10000
+# Random numbers are drawn for the longest plan once, shorter plans use the first years
+MAX_YEARS = 100
+
+STAGES = {
+    'draws': ['seed', 'paths'],
+    'market': ['expected_return', 'volatility', 'fee'],
+    'inflation': ['inflation', 'inflation_volatility'],
+    'components': ['current_age', 'retirement_age', 'end_age', 'contribution_growth'],
+    'outcome': ['balance', 'contribution', 'withdrawal'],
+}
+
+
+def _scenarios(value):
+    # Scalar or list of scenario values -> (scenarios, 1, 1), broadcasts against (paths, years)
+    return np.asarray(value, dtype=float).reshape(-1, 1, 1)
+
+
+def _key(value):
+    return tuple(np.atleast_1d(np.asarray(value, dtype=float)).tolist())
+
+
+def draw_shocks(seed, paths):
+    """
+    :param seed: seed of the random generator.
+    :param paths: number of paths.
+    :return: standard normal draws (return shocks, inflation shocks), each of shape (paths, MAX_YEARS).
+    """
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((paths, MAX_YEARS)), rng.standard_normal((paths, MAX_YEARS))
+
+
+def market_growth(return_shocks, expected_return, volatility, fee):
+    """
+    :param return_shocks: standard normal draws (paths, years).
+    :param expected_return: average yearly return (0.065 = 6.5%), per scenario.
+    :param volatility: standard deviation of the yearly return, per scenario.
+    :param fee: yearly fee as a share of the balance, per scenario.
+    :return: yearly growth factor of the balance after fees, shape (scenarios, paths, years).
+    """
+    mean, volatility = 1 + _scenarios(expected_return), _scenarios(volatility)
+    # Lognormal with the given mean and standard deviation of the yearly return
+    sigma = np.sqrt(np.log1p((volatility / mean) ** 2))
+    return np.exp(np.log(mean) - sigma ** 2 / 2 + sigma * return_shocks) * (1 - _scenarios(fee))
+
+
+def price_index(inflation_shocks, inflation, inflation_volatility):
+    """
+    :param inflation_shocks: standard normal draws (paths, years).
+    :param inflation: average yearly inflation, per scenario.
+    :param inflation_volatility: standard deviation of the yearly inflation, per scenario.
+    :return: prices relative to today at the start of every year, shape (scenarios, paths, years + 1).
+    """
+    rates = np.maximum(_scenarios(inflation) + _scenarios(inflation_volatility) * inflation_shocks, -0.5)
+    index = np.ones(rates.shape[:-1] + (rates.shape[-1] + 1,))
+    np.cumprod(1 + rates, axis=-1, out=index[..., 1:])
+    return index
+
+
+def projection_components(growth, prices, current_age, retirement_age, end_age, contribution_growth):
+    """
+    Value of $1 of balance, $1 a year of contributions and $1 a year of withdrawals on every path.
+
+    :param growth: yearly growth factors from market_growth.
+    :param prices: price index from price_index.
+    :param current_age: age today.
+    :param retirement_age: age at which contributions stop and withdrawals start, per scenario.
+    :param end_age: last age of the plan, per scenario (the projection runs to the oldest).
+    :param contribution_growth: yearly growth of the contributions above inflation, per scenario.
+    :return: dictionary of 'ages' and 'growth', 'contributed', 'withdrawn', 'prices' of shape
+             (scenarios, paths, years + 1), plus 'end_years' and 'retire_years' (years until the end of the plan
+             and until retirement, per scenario).
+    """
+    current_age = int(current_age)
+    end_years = np.clip(np.round(np.asarray(end_age, dtype=float)).astype(int) - current_age, 1, MAX_YEARS)
+    years = int(end_years.max())
+    growth, prices = growth[..., :years], prices[..., :years + 1]
+    retire_years = np.clip(_scenarios(retirement_age) - current_age, 0, years)
+    year = np.arange(years)
+    working = year < retire_years
+    contributions = np.where(working, prices[..., :-1] * (1 + _scenarios(contribution_growth)) ** year, 0)
+    withdrawals = np.where(working, 0, prices[..., :-1])
+
+    compounded = np.ones(growth.shape[:-1] + (years + 1,))
+    np.cumprod(growth, axis=-1, out=compounded[..., 1:])
+    # Flows at the start of each year then a year of growth -> a flow paid at the start of year s is worth
+    # flow x compounded[t] / compounded[s] at the start of year t, so each component is one cumulative sum
+    contributed = np.zeros(np.broadcast_shapes(compounded.shape[:-1], contributions.shape[:-1]) + (years + 1,))
+    withdrawn = np.zeros(np.broadcast_shapes(compounded.shape[:-1], withdrawals.shape[:-1]) + (years + 1,))
+    contributed[..., 1:] = compounded[..., 1:] * np.cumsum(contributions / compounded[..., :-1], axis=-1)
+    withdrawn[..., 1:] = compounded[..., 1:] * np.cumsum(withdrawals / compounded[..., :-1], axis=-1)
+    return {'ages': current_age + np.arange(years + 1), 'growth': compounded, 'contributed': contributed,
+            'withdrawn': withdrawn, 'prices': prices, 'end_years': np.atleast_1d(end_years),
+            'retire_years': retire_years.astype(int).ravel()}
+
+
+def project_outcome(components, balance, contribution, withdrawal):
+    """
+    :param components: from projection_components.
+    :param balance: balance today, per scenario.
+    :param contribution: contributions this year, per scenario.
+    :param withdrawal: yearly retirement income in today's dollars, per scenario.
+    :return: dictionary of
+             'ages'          -> age at the start of every year
+             'bands'         -> percentile -> balances in today's dollars (scenarios, years + 1)
+             'success'       -> share of the paths where the money lasts until the end of the plan, per scenario
+             'at_retirement' -> median balance at retirement in today's dollars, per scenario
+    """
+    balances = np.maximum(_scenarios(balance) * components['growth']
+                          + _scenarios(contribution) * components['contributed']
+                          - _scenarios(withdrawal) * components['withdrawn'], 0)
+    real = balances / components['prices']
+    scenarios = max(len(real), len(components['end_years']), len(components['retire_years']))
+
+    def at_year(values, years):
+        # Value of every path at one year of each scenario -> (scenarios, paths)
+        values = np.broadcast_to(values, (scenarios,) + values.shape[1:])
+        index = np.broadcast_to(np.reshape(years, (-1, 1, 1)), values.shape[:-1] + (1,))
+        return np.take_along_axis(values, index, axis=-1)[..., 0]
+
+    return {
+        'ages': components['ages'],
+        # Most of the time of this stage
+        'bands': dict(zip(PERCENTILES, np.percentile(real, PERCENTILES, axis=1))),
+        # Every withdrawal until the end of the plan was paid if something is left at the end
+        'success': (at_year(balances, components['end_years']) > 0).mean(axis=1),
+        'at_retirement': np.median(at_year(real, components['retire_years']), axis=1),
+    }
+
+
+class ProjectionEngine:
+    """
+    Keeps the stages of the last projection and only recomputes what a change of inputs touches. One engine per
+    chart (the main projection and the sensitivity runs have different shapes and would evict each other).
+    """
+
+    def __init__(self, paths=PROJECTION_PATHS, seed=42):
+        self.paths = paths
+        self.seed = seed
+        self._stages = {}
+        self._lock = threading.Lock()
+        # (stage, seconds) of the stages recomputed by the last projection
+        self.last_run = []
+
+    def _stage(self, name, key, compute):
+        cached = self._stages.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        start = time.perf_counter()
+        value = compute()
+        self.last_run.append((name, time.perf_counter() - start))
+        self._stages[name] = (key, value)
+        return value
+
+    def project(self, **assumptions):
+        """
+        :param assumptions: any of the ASSUMPTIONS (DEFAULTS for the rest), scalars or arrays of scenarios.
+        :return: from project_outcome.
+        """
+        inputs = dict(DEFAULTS, **assumptions)
+        with self._lock:
+            self.last_run = []
+            # A stage's key holds its own inputs and the keys of the stages it is built on
+            keys = {'draws': (self.seed, self.paths)}
+            for name in ['market', 'inflation']:
+                keys[name] = (keys['draws'],) + tuple(_key(inputs[field]) for field in STAGES[name])
+            keys['components'] = (keys['market'], keys['inflation'], int(inputs['current_age'])) \
+                + tuple(_key(inputs[field]) for field in STAGES['components'][1:])
+            keys['outcome'] = (keys['components'],) + tuple(_key(inputs[field]) for field in STAGES['outcome'])
+
+            return_shocks, inflation_shocks = self._stage('draws', keys['draws'],
+                                                          lambda: draw_shocks(self.seed, self.paths))
+            growth = self._stage('market', keys['market'], lambda: market_growth(
+                return_shocks, inputs['expected_return'], inputs['volatility'], inputs['fee']))
+            prices = self._stage('inflation', keys['inflation'], lambda: price_index(
+                inflation_shocks, inputs['inflation'], inputs['inflation_volatility']))
+            components = self._stage('components', keys['components'], lambda: projection_components(
+                growth, prices, inputs['current_age'], inputs['retirement_age'], inputs['end_age'],
+                inputs['contribution_growth']))
+            return self._stage('outcome', keys['outcome'], lambda: project_outcome(
+                components, inputs['balance'], inputs['contribution'], inputs['withdrawal']))
+
+
+@timed_phase('figure')
+def projection_fan_chart(outcome, retirement_age):
+    """
+    Median balance (today's dollars) by age with the 25-75 and 5-95 percentile bands of the paths.
+
+    :param outcome: from ProjectionEngine.project (single scenario).
+    :param retirement_age: age marked on the chart.
+    :return: figure.
+    """
+    ages, bands = outcome['ages'], {p: values[0] for p, values in outcome['bands'].items()}
+    fig = go.Figure()
+    # Outer band first so the inner band is drawn on top of it, each band fills down to the trace before it
+    for lower, upper, colour in [(5, 95, 'rgba(31, 119, 180, 0.15)'), (25, 75, 'rgba(31, 119, 180, 0.35)')]:
+        fig.add_trace(go.Scatter(x=ages, y=bands[lower], mode='lines', line=dict(width=0), showlegend=False,
+                                 hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=ages, y=bands[upper], mode='lines', line=dict(width=0), fill='tonexty',
+                                 fillcolor=colour, name=f'p{lower} - p{upper}'))
+    fig.add_trace(go.Scatter(x=ages, y=bands[50], mode='lines', name='Median', line=dict(color='rgb(31, 119, 180)')))
+    fig.add_vline(x=retirement_age, line_dash='dash', annotation_text='Retirement')
+    fig.update_layout(title="Projected balance (today's dollars)",
+                      xaxis_title='Age', yaxis_title='Balance ($)', yaxis_tickformat='$,.0f')
+    return fig
+
+
+@timed_phase('figure')
+def sensitivity_chart(values, outcome, parameter):
+    """
+    Chance the money lasts until the end of the plan for every value of one input.
+
+    :param values: values of the input (the scenarios).
+    :param outcome: from ProjectionEngine.project with the input set to values.
+    :param parameter: name of the input (key of ASSUMPTIONS).
+    :return: figure.
+    """
+    fig = go.Figure(go.Scatter(x=values, y=100 * outcome['success'], mode='lines+markers'))
+    fig.update_layout(title=f"Chance the money lasts vs {ASSUMPTIONS[parameter][0].lower()}",
+                      xaxis_title=ASSUMPTIONS[parameter][0], yaxis_title='Chance (%)', yaxis_range=[0, 100])
+    return fig
+
+
+def sensitivity_values(parameter, points=21):
+    """
+    :param parameter: name of the input (key of ASSUMPTIONS).
+    :param points: number of scenarios.
+    :return: evenly spaced values over the slider range, on the slider steps.
+    """
+    _, minimum, maximum, step, _ = ASSUMPTIONS[parameter]
+    return np.unique(np.round(np.linspace(minimum, maximum, points) / step) * step)
@@ -0,0 +1,295 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+
+import duckdb
+import pandas as pd
+
+from Background_Jobs import job_cache, file_version, RESULT_EXPIRY
+from Helper_Functions import parse_dates, DATE_COLUMNS, performance_line_graph, create_bubble_plot, \
+    create_high_tax_geo_bubble_plot, create_hexabin_graph, sales_spider, sales_bar
+
+"""
+Ad-hoc SQL over the uploaded datasets with DuckDB (in process, columnar, vectorised), for the query page and the
+/api/query endpoint.
+
+Tables -> uploaded (home page), performance, sales and adviser_ranking. Each sqlite table is copied once per
+upload to a Parquet snapshot in ANALYTICS_DIR (dates parsed), and DuckDB queries the snapshots as views, so a
+question only reads the columns it uses instead of pulling a whole table into pandas. Snapshots are files, so
+every worker process shares them.
+
+Guard rails:
+- one SELECT statement per query, and DuckDB can only read the snapshot folder (no other files, no settings)
+- QUERY_MAX_ROWS rows at most per result (the result says when it was cut), QUERY_MEMORY_LIMIT for DuckDB
+- queries are interrupted after QUERY_TIMEOUT seconds
+- results are cached in the job cache per query and snapshot, so a new upload is never answered from the cache
+
+Results are data frames, so they go straight into the chart builders of Helper_Functions (CHART_BUILDERS).
+"""
+
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', 5000))
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', 10))
+QUERY_MEMORY_LIMIT = os.getenv('QUERY_MEMORY_LIMIT', '1GB')
+QUERY_THREADS = int(os.getenv('QUERY_THREADS', os.cpu_count()))
+ANALYTICS_DIRECTORY = os.path.abspath(os.getenv('ANALYTICS_DIR', 'analytics'))
+# Rows copied at a time from sqlite into a snapshot
+SNAPSHOT_CHUNK_ROWS = 200_000
+
+# Table name in the queries -> (sqlite file, table), paths like the pages write them
+TABLES = {
+    'uploaded': ('../uploaded_data.db', 'uploaded_data_table'),
+    'performance': ('performance_data.db', 'performance_data_table'),
+    'sales': ('sales_spider.db', 'sales_data_table'),
+    'adviser_ranking': ('adviser_rollup.db', 'adviser_ranking'),
+}
+
+# Chart builder -> (columns the result needs, function of the result)
+CHART_BUILDERS = {
+    'performance_line_graph': (['AcctId', 'EOM', 'ClosingBal'], performance_line_graph),
+    'create_bubble_plot': (['Income', 'Age', 'Size'], create_bubble_plot),
+    'create_high_tax_geo_bubble_plot': (['Latitude', 'Longitude', 'Average Taxable Income'],
+                                        create_high_tax_geo_bubble_plot),
+    'create_hexabin_graph': (['Latitude', 'Longitude', 'Income'], create_hexabin_graph),
+    # Sales charts are drawn for the first adviser of the result
+    'sales_spider': (['adviserCode', 'AssetClass'], lambda df: sales_spider(df, df['adviserCode'].iloc[0])),
+    'sales_bar': (['adviserCode', 'AssetClass', 'MarketValue'], lambda df: sales_bar(df, df['adviserCode'].iloc[0])),
+}
+
+
+class QueryError(Exception):
+    """
+    Query that can't be run (not a single SELECT, unknown table or column...), the message is for the user.
+    """
+
+
+class QueryTimeout(QueryError):
+    """
+    Query interrupted after QUERY_TIMEOUT seconds.
+    """
+
+
+_lock = threading.Lock()
+# DuckDB connection of this process and the snapshot behind every view
+_connection = None
+_views = {}
+_snapshot_locks = {name: threading.Lock() for name in TABLES}
+
+
+def snapshot(name):
+    """
+    Parquet copy of a table for its current upload, written the first time it is asked for.
+
+    :param name: table name (key of TABLES).
+    :return: path of the snapshot, None if the table wasn't uploaded.
+    """
+    database, table = TABLES[name]
+    version = file_version(database)
+    if version is None:
+        return None
+    path = os.path.join(ANALYTICS_DIRECTORY, f"{name}-{int(version * 1e6)}.parquet")
+    if os.path.exists(path):
+        return path
+    # One build per table at a time in this process -> the page asks for the tables and runs a query together
+    with _snapshot_locks[name]:
+        if not os.path.exists(path):
+            if not _write_snapshot(database, table, path):
+                return None
+    # Older uploads of the table aren't needed anymore
+    for old in os.listdir(ANALYTICS_DIRECTORY):
+        if old.startswith(f'{name}-') and old.endswith('.parquet') and os.path.join(ANALYTICS_DIRECTORY, old) != path:
+            try:
+                os.remove(os.path.join(ANALYTICS_DIRECTORY, old))
+            except FileNotFoundError:
+                # Removed by another worker
+                pass
+    return path
+
+
+def _write_snapshot(database, table, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(ANALYTICS_DIRECTORY, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    db_connection = sqlite3.connect(database)
+    writer = None
+    try:
+        for chunk in pd.read_sql(f'SELECT * FROM "{table}"', db_connection, chunksize=SNAPSHOT_CHUNK_ROWS):
+            for column in DATE_COLUMNS:
+                if column in chunk.columns:
+                    chunk[column] = parse_dates(chunk[column])
+            arrow_table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(temporary, arrow_table.schema)
+            writer.write_table(arrow_table)
+    except pd.errors.DatabaseError:
+        # The file is there but not the table yet
+        return False
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        # Mixed types in a column, or a chunk that doesn't fit the types of the first one
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.remove(temporary)
+        raise QueryError(f"{table} can't be queried, a column changes type part way through: {e}") from e
+    finally:
+        db_connection.close()
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        return False
+    # Temporary names are per thread and process, so every writer replaces its own file
+    os.replace(temporary, path)
+    return True
+
+
+def _connect():
+    connection = duckdb.connect(':memory:', config={'memory_limit': QUERY_MEMORY_LIMIT, 'threads': QUERY_THREADS})
+    os.makedirs(ANALYTICS_DIRECTORY, exist_ok=True)
+    # Queries can only read the snapshots, and can't change that
+    connection.execute(f"SET allowed_directories=['{ANALYTICS_DIRECTORY}']")
+    connection.execute("SET enable_external_access=false")
+    connection.execute("SET lock_configuration=true")
+    return connection
+
+
+def refresh_views():
+    """
+    Points the views of this process at the current snapshots.
+
+    :return: DuckDB connection, and the snapshot of every table (part of the result cache key).
+    """
+    global _connection
+    paths = {name: snapshot(name) for name in TABLES}
+    with _lock:
+        if _connection is None:
+            _connection = _connect()
+        for name, path in paths.items():
+            if _views.get(name) == path:
+                continue
+            if path is None:
+                _connection.execute(f'DROP VIEW IF EXISTS "{name}"')
+            else:
+                _connection.execute(f"""CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM read_parquet('{path}')""")
+            _views[name] = path
+    return _connection, paths
+
+
+def _single_select(sql):
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error as e:
+        raise QueryError(str(e)) from e
+    if len(statements) != 1:
+        raise QueryError("Send exactly one statement.")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise QueryError("Only SELECT queries can be run.")
+    return statements[0].query.strip()
+
+
+def run_query(sql, limit=QUERY_MAX_ROWS, timeout=QUERY_TIMEOUT):
+    """
+    Runs an ad-hoc query over the uploaded tables.
+
+    :param sql: a single SELECT statement (tables: uploaded, performance, sales, adviser_ranking).
+    :param limit: maximum number of rows returned (capped at QUERY_MAX_ROWS).
+    :param timeout: seconds before the query is interrupted.
+    :return: dictionary of 'frame' (data frame), 'truncated' (more rows than the limit), 'seconds', 'cached'.
+    """
+    query = _single_select(sql)
+    limit = max(1, min(int(limit), QUERY_MAX_ROWS))
+    connection, paths = refresh_views()
+    key = 'adhoc-query-' + hashlib.sha256(json.dumps([query, limit, sorted(paths.items())]).encode()).hexdigest()
+    cached = job_cache.get(key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    start = time.perf_counter()
+    cursor = connection.cursor()
+    timer = threading.Timer(timeout, cursor.interrupt)
+    timer.start()
+    try:
+        # One extra row tells whether the result was cut
+        frame = cursor.execute(f"SELECT * FROM ({query}) LIMIT {limit + 1}").fetch_df()
+    except duckdb.InterruptException as e:
+        raise QueryTimeout(f"The query took longer than {timeout:g}s and was stopped.") from e
+    except duckdb.Error as e:
+        raise QueryError(str(e)) from e
+    finally:
+        timer.cancel()
+        cursor.close()
+
+    result = {'frame': frame.head(limit), 'truncated': len(frame) > limit, 'seconds': time.perf_counter() - start}
+    job_cache.set(key, result, expire=RESULT_EXPIRY)
+    return dict(result, cached=False)
+
+
+def table_schemas():
+    """
+    :return: dictionary of table name -> list of (column, type) for the tables uploaded so far.
+    """
+    connection, paths = refresh_views()
+    cursor = connection.cursor()
+    try:
+        return {name: [(row[0], row[1]) for row in cursor.execute(f'DESCRIBE "{name}"').fetchall()]
+                for name, path in paths.items() if path is not None}
+    finally:
+        cursor.close()
+
+
+def chart_from_result(builder, frame):
+    """
+    Draws a query result with one of the chart builders of Helper_Functions.
+
+    :param builder: key of CHART_BUILDERS.
+    :param frame: query result.
+    :return: figure.
+    """
+    columns, build = CHART_BUILDERS[builder]
+    missing = [column for column in columns if column not in frame.columns]
+    if missing:
+        raise QueryError(f"{builder} needs the columns {', '.join(missing)} in the result.")
+    if frame.empty:
+        raise QueryError("The query returned no rows to draw.")
+    return build(frame)
+
+
+def install_query_api(server):
+    """
+    Adds the query endpoints to the Flask server of the Dash app.
+
+    POST /api/query  {"sql": "...", "limit": 100} -> {"columns", "rows", "row_count", "truncated", "seconds", "cached"}
+    GET  /api/tables -> columns and types of every uploaded table
+
+    :param server: Flask server (app.server).
+    """
+    from flask import request, jsonify
+
+    @server.route('/api/query', methods=['POST'])
+    def query_endpoint():
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body.get('sql'), str):
+            return jsonify(error='Send the query as {"sql": "SELECT ..."}.'), 400
+        try:
+            result = run_query(body['sql'], body.get('limit', QUERY_MAX_ROWS))
+        except QueryTimeout as e:
+            return jsonify(error=str(e)), 408
+        except (QueryError, ValueError, TypeError) as e:
+            return jsonify(error=str(e)), 400
+        frame = result['frame']
+        return jsonify(columns=list(frame.columns),
+                       rows=json.loads(frame.to_json(orient='records', date_format='iso')),
+                       row_count=len(frame), truncated=result['truncated'], seconds=result['seconds'],
+                       cached=result['cached'])
+
+    @server.route('/api/tables')
+    def tables_endpoint():
+        try:
+            schemas = table_schemas()
+        except QueryError as e:
+            return jsonify(error=str(e)), 400
+        return jsonify({name: [{'column': column, 'type': kind} for column, kind in columns]
+                        for name, columns in schemas.items()})
@@ -1,156 +1,279 @@
-import yfinance as yf
 import pandas as pd
-from datetime import datetime, timedelta
 import plotly.graph_objects as go
-import random
+import numpy as np
+from Market_Data_Store import get_latest_prices
+from Instrumentation import timed_phase
 
 
 # Primitive price predictions with markov chains...
 
+# States of the default classification, index in this list = StateIndex
+STATES = ['INCREASE', 'SAME', 'DECREASE']
+# Percentiles of the simulated paths shown in the prediction fan chart
+PERCENTILES = [5, 25, 50, 75, 95]
+# Days of prices the page trains on (the batch forecasts use the same window, so both are the same model)
+TRAINING_DAYS = 60
 
-def obtain_data():
+
+def obtain_data(ticker_symbol="^AXJO", days=TRAINING_DAYS):
     """
     This function obtains the last 60 days worth of data from the present day.
+    Prices come from the local market data store (Market_Data_Store.py), which only downloads from
+    Yahoo Finance the days it doesn't have yet.
 
+    :param ticker_symbol: ticker to obtain, the ASX200 by default.
+    :param days: number of days to go back.
     :return: Dataframe containing the dates and correlated prices of the ASX200 60 days prior to present day.
     """
-    ticker_symbol = "^AXJO"
-
-    # Get today's date
-    end_date = datetime.today().strftime('%Y-%m-%d')
-
-    # Calculate the date 60 days ago
-    start_date = (datetime.today() - timedelta(days=60)).strftime('%Y-%m-%d')
-
-    # Fetch historical data from Yahoo Finance
-    asx200_data = yf.download(ticker_symbol, start=start_date, end=end_date)
-    # Reset index to make 'Date' a regular column
-    asx200_data.reset_index(inplace=True)
-
     # Keep only the 'Date' and 'Close' columns
-    asx200_data = asx200_data[['Date', 'Close']]
+    asx200_data = get_latest_prices(ticker_symbol, days)
 
     return asx200_data
 
 
-def classify_data(df):
+def classify_data(df, n_bins=None, by=None):
     """
     Adds another column to the data frame that contains the classifications of states relating to the data.
-
-    :param df: Data frame to be processed.
-    :return: Updated data frame that contains the state classifications.
+    By default the state is the sign of the change in price from the previous day (INCREASE / SAME / DECREASE),
+    with n_bins the daily changes are split into that many quantile bins instead (Q1 = biggest falls).
+    Everything is done on whole columns, so decades of data for many tickers is fine.
+
+    :param df: Data frame to be processed (Date and Close columns).
+    :param n_bins: Number of quantile bins for the changes, None for the 3 sign states.
+    :param by: Column to group by (i.e. 'Ticker') so changes are never taken across two tickers.
+    :return: Updated data frame with the 'State' name and 'StateIndex' (-1 for the first day, no previous close).
     """
-    df['State'] = 'SAME'
+    change = df.groupby(by, sort=False)['Close'].diff() if by else df['Close'].diff()
+
+    if n_bins is None:
+        state_index = np.select([change > 0, change < 0, change == 0], [0, 2, 1], default=-1)
+        names = np.array(STATES + ['NONE'])
+    else:
+        state_index = pd.qcut(change, n_bins, labels=False, duplicates='drop').fillna(-1).to_numpy(dtype=int)
+        names = np.array([f'Q{i + 1}' for i in range(state_index.max() + 1)] + ['NONE'])
 
-    # Classify states based on price changes compared to the previous day
-    for i in range(1, len(df)):
-        if df.loc[i, 'Close'] > df.loc[i - 1, 'Close']:
-            df.loc[i, 'State'] = 'INCREASE'
-        elif df.loc[i, 'Close'] < df.loc[i - 1, 'Close']:
-            df.loc[i, 'State'] = 'DECREASE'
+    df['StateIndex'] = state_index
+    # -1 picks the trailing 'NONE'
+    df['State'] = names[state_index]
 
     return df
 
 
-def get_transition_function(df):
+def estimate_transition_matrix(states, n_states, order=1, groups=None):
+    """
+    Estimates a Markov transition matrix from a sequence of states in one pass, by counting every
+    (previous `order` states -> next state) pair with np.bincount.
+
+    :param states: Array of state indices (0 .. n_states - 1, negative for days without a state).
+    :param n_states: Number of states.
+    :param order: How many previous days the next state depends on.
+    :param groups: Optional array (i.e. ticker of each row), transitions are never counted across groups.
+    :return: Array of shape (n_states ** order, n_states) -> row = previous states encoded in base n_states
+             (oldest first), column = next state. Rows never seen are left uniform.
+    """
+    states = np.asarray(states)
+    n = len(states) - order
+    if n <= 0:
+        return np.full((n_states ** order, n_states), 1 / n_states)
+
+    # Encode the previous `order` states of every row as one number, and check the window is usable
+    from_code = np.zeros(n, dtype=np.int64)
+    valid = states[order:] >= 0
+    for lag in range(order, 0, -1):
+        previous = states[order - lag: len(states) - lag]
+        from_code = from_code * n_states + np.maximum(previous, 0)
+        valid &= previous >= 0
+        if groups is not None:
+            groups = np.asarray(groups)
+            valid &= groups[order - lag: len(states) - lag] == groups[order:]
+
+    counts = np.bincount(from_code[valid] * n_states + states[order:][valid],
+                         minlength=n_states ** order * n_states).reshape(n_states ** order, n_states)
+    totals = counts.sum(axis=1, keepdims=True)
+
+    return np.where(totals > 0, counts / np.maximum(totals, 1), 1 / n_states)
+
+
+def get_transition_function(df, order=1, by=None):
     """
     Obtains the probabilities for state transitioning.
-    Note: the order of probabilities correlate to [INCREASE, SAME, DECREASE].
+    Note: the order of states for the default classification is [INCREASE, SAME, DECREASE].
 
-    df: The data frame containing the state classifications (i.e., complete data frame).
-    :return: List containing the transition probabilities in the order [INCREASE, SAME, DECREASE].
+    :param df: The data frame containing the state classifications (i.e., complete data frame).
+    :param order: How many previous days the next state depends on.
+    :param by: Column to group by (i.e. 'Ticker') when the frame holds more than one ticker.
+    :return: Transition matrix, row = current state(s), column = next state.
     """
-    transitions = {'INCREASE': 0, 'SAME': 0, 'DECREASE': 0}
+    n_states = int(df['StateIndex'].max()) + 1
+    # The sign states always have 3 columns, even if one of them never happened
+    if df['State'].isin(STATES).any():
+        n_states = len(STATES)
 
-    # Iterate through all days except the last one
-    for i in range(len(df) - 1):
-        current_state = df.iloc[i]['State']
-        next_state = df.iloc[i + 1]['State']
+    return estimate_transition_matrix(df['StateIndex'].to_numpy(), n_states, order,
+                                      None if by is None else df[by].to_numpy())
 
-        # Determine the type of transition
-        if next_state > current_state:
-            transitions['INCREASE'] += 1
-        elif next_state == current_state:
-            transitions['SAME'] += 1
-        else:
-            transitions['DECREASE'] += 1
 
-    # Calculate transition probabilities
-    total_transitions = sum(transitions.values())
-    transition_probabilities = [count / total_transitions for count in transitions.values()]
+def state_moves(df):
+    """
+    Average change in price of each state, used as the move of that state when simulating quantile states.
 
-    return transition_probabilities
+    :param df: Data frame classified by classify_data.
+    :return: Array with the average change of each state index.
+    """
+    change = df['Close'].diff()
+    valid = df['StateIndex'] >= 0
+    return change[valid].groupby(df['StateIndex'][valid]).mean().sort_index().to_numpy()
 
 
-def predict_future_values(transition_func, last_60_days, days):
+def simulate_paths(transition_func, last_value, days, n_paths=10000, step=5, seed=None, moves=None,
+                   initial_states=None):
+    """
+    Monte Carlo simulation of future closing values -> all paths are simulated together with numpy
+    (10k paths x 365 days takes a fraction of a second).
+    A stack of transition matrices simulates many models in one go (i.e. every window of a backtest), each with
+    its own last value, initial states and seed.
+
+    :param transition_func: Either probabilities of the next state (same every day), a transition matrix
+                            from get_transition_function (next state depends on the previous ones), or an array
+                            of transition matrices of shape (models, rows, states).
+    :param last_value: Last known closing value, every path starts from it (one per model for a stack).
+    :param days: Number of days into the future to simulate.
+    :param n_paths: Number of paths to simulate (per model for a stack).
+    :param step: Change in value for an INCREASE / DECREASE day (3 sign states).
+    :param seed: Seed for the random generator, give one for repeatable results (one per model for a stack,
+                 model i draws the same numbers as a single matrix simulated with seed[i]).
+    :param moves: Change in value for each state, overrides step (i.e. from state_moves).
+    :param initial_states: The last `order` states seen (oldest first), needed for a transition matrix
+                           (shape (models, order) for a stack).
+    :return: Array of shape (n_paths, days) with the simulated closing values, (models, n_paths, days) for a stack.
+    """
+    rng = np.random.default_rng(seed if np.ndim(seed) == 0 else None)
+    probabilities = np.asarray(transition_func, dtype=float)
+    moves = np.array([step, 0, -step], dtype=float) if moves is None else np.asarray(moves, dtype=float)
+    n_states = probabilities.shape[-1]
+
+    if probabilities.ndim == 1:
+        cumulative = np.cumsum(probabilities / probabilities.sum())
+        # Pick the state of each day by where a uniform draw falls in the cumulative probabilities
+        states = np.searchsorted(cumulative, rng.random((n_paths, days)), side='right')
+        np.minimum(states, n_states - 1, out=states)
+    else:
+        # A single matrix is a stack of one
+        stacked = probabilities.ndim == 3
+        matrices = probabilities if stacked else probabilities[None]
+        cumulative = np.cumsum(matrices / matrices.sum(axis=2, keepdims=True), axis=2)
+        n_models, n_codes = cumulative.shape[:2]
+        initial_states = np.zeros((n_models, 0), dtype=np.int64) if initial_states is None \
+            else np.asarray(initial_states, dtype=np.int64).reshape(n_models, -1)
+        code = np.zeros(n_models, dtype=np.int64)
+        for state in initial_states.T:
+            code = (code * n_states + np.maximum(state, 0)) % n_codes
+        codes = np.repeat(code[:, None], n_paths, axis=1)
+        if stacked:
+            seeds = [None] * n_models if seed is None else seed
+            draws = np.stack([np.random.default_rng(model_seed).random((n_paths, days)) for model_seed in seeds])
+        else:
+            draws = rng.random((n_paths, days))[None]
+        models = np.arange(n_models)[:, None]
+        states = np.empty((n_models, n_paths, days), dtype=np.int64)
+        # One step per day, every path of every model at once
+        for day in range(days):
+            next_states = (draws[:, :, day, None] >= cumulative[models, codes]).sum(axis=2)
+            np.minimum(next_states, n_states - 1, out=next_states)
+            states[:, :, day] = next_states
+            codes = (codes * n_states + next_states) % n_codes
+        if not stacked:
+            return last_value + np.cumsum(moves[states[0]], axis=1)
+        return np.asarray(last_value, dtype=float)[:, None, None] + np.cumsum(moves[states], axis=2)
+
+    return last_value + np.cumsum(moves[states], axis=1)
+
+
+def predict_future_values(transition_func, last_60_days, days, seed=None, initial_states=None):
     """
-    Predict future closing values based on the transition probabilities.
+    Predict future closing values based on the transition probabilities (a single simulated path).
 
     :param transition_func: List of transition probabilities for state prediction.
     :param last_60_days: Closing values of the last 60 days.
     :param days: Number of days into the future to predict.
+    :param seed: Seed for the random generator.
+    :param initial_states: The last states seen (oldest first) when transition_func is a transition matrix.
     :return: Predicted closing values for the future days.
     """
-    predicted_values = []
-
-    # Initialize the current value as the last value from the training data
-    current_value = last_60_days[-1]
-
-    # Predict future values based on the transition probabilities
-    for _ in range(days):
-        # Determine the next state based on transition probabilities
-        next_state_index = predict_state_index(transition_func)
-        next_state = ['INCREASE', 'SAME', 'DECREASE'][next_state_index]
-
-        # Determine the next value based on the predicted state
-        if next_state == 'INCREASE':
-            current_value += 5
-        elif next_state == 'DECREASE':
-            current_value -= 5
-
-        # Append the predicted value to the list
-        predicted_values.append(current_value)
-
-        # Update the last 60 days with the new value
-        last_60_days = last_60_days[1:] + [current_value]
+    return simulate_paths(transition_func, last_60_days[-1], days, n_paths=1, seed=seed,
+                          initial_states=initial_states)[0].tolist()
 
-    return predicted_values
 
-
-def predict_state_index(transition_probabilities):
+def forecast_percentiles(transition_func, df, days, n_paths=10000, seed=None, moves=None):
     """
-    Predict the next state index based on the transition probabilities.
+    Simulates the future values from the training data and summarises every day by its percentiles.
 
-    :param transition_probabilities: List of transition probabilities.
-    :return: Index of the predicted state.
+    :param transition_func: Transition function for state prediction.
+    :param df: DataFrame containing the (classified) training data.
+    :param days: Number of days into the future to predict.
+    :param n_paths: Number of paths to simulate.
+    :param seed: Seed for the random generator.
+    :param moves: Change in value for each state (see state_moves), None for the default +/- 5 steps.
+    :return: (future dates, dictionary of percentile -> array of values for every future date).
     """
-    # If the first state is 'SAME', set its probability to 1 and adjust other probabilities accordingly
-    transition_probabilities = [1] + [prob / (len(transition_probabilities) - 1) for prob in transition_probabilities[1:]]
-    # Randomly choose the next state index based on transition probabilities
-    return random.choices(range(len(transition_probabilities)), weights=transition_probabilities)[0]
+    future_dates = pd.date_range(start=df['Date'].iloc[-1], periods=days)
+    transition_func = np.asarray(transition_func)
+    # A transition matrix continues from the last states seen (as many as the order of the matrix)
+    order = round(np.log(transition_func.shape[0]) / np.log(transition_func.shape[-1])) \
+        if transition_func.ndim == 2 else 0
+    initial_states = df['StateIndex'].values[len(df) - order:] if order else None
+    paths = simulate_paths(transition_func, df['Close'].values[-1], days, n_paths=n_paths, seed=seed, moves=moves,
+                           initial_states=initial_states)
+
+    return future_dates, dict(zip(PERCENTILES, np.percentile(paths, PERCENTILES, axis=0)))
 
 
-def prediction_graph(days, transition_func, df):
+@timed_phase('figure')
+def fan_chart(df, future_dates, bands, title='Prediction Visualization'):
     """
-    Generate a prediction visualization for a given number of days into the future.
+    Training data followed by the median prediction with the 25-75 and 5-95 percentile bands.
 
-    :param days: Number of days into the future to predict.
-    :param transition_func: Transition function for state prediction.
     :param df: DataFrame containing the training data.
+    :param future_dates: Dates of the predicted values.
+    :param bands: Dictionary of percentile -> predicted values (see forecast_percentiles).
+    :param title: Title of the graph.
     :return: Plotly Figure object containing the prediction visualization.
     """
     # Plot the training data
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=df['Date'], y=df['Close'], mode='lines', name='Training Data'))
 
-    # Predict and plot future values
-    future_dates = pd.date_range(start=df['Date'].iloc[-1], periods=days)
-    future_values = predict_future_values(transition_func, df['Close'].values[-60:], days)
-    fig.add_trace(go.Scatter(x=future_dates, y=future_values, mode='lines', name='Predicted Values'))
+    # Outer band first so the inner band is drawn on top of it, each band fills down to the trace before it
+    for lower, upper, colour in [(5, 95, 'rgba(255, 127, 14, 0.15)'), (25, 75, 'rgba(255, 127, 14, 0.35)')]:
+        fig.add_trace(go.Scatter(x=future_dates, y=bands[lower], mode='lines', line=dict(width=0),
+                                 showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=future_dates, y=bands[upper], mode='lines', line=dict(width=0),
+                                 fill='tonexty', fillcolor=colour, name=f'p{lower} - p{upper}'))
+    fig.add_trace(go.Scatter(x=future_dates, y=bands[50], mode='lines', name='Predicted Values (median)',
+                             line=dict(color='rgb(255, 127, 14)')))
 
     # Customize plot layout
-    fig.update_layout(title='Prediction Visualization',
+    fig.update_layout(title=title,
                       xaxis_title='Date',
                       yaxis_title='Closing Value')
 
     return fig
+
+
+@timed_phase('figure')
+def prediction_graph(days, transition_func, df, n_paths=10000, seed=None, moves=None):
+    """
+    Generate a prediction visualization for a given number of days into the future.
+    Shows a fan chart of the simulated paths -> median line with the 25-75 and 5-95 percentile bands.
+
+    :param days: Number of days into the future to predict.
+    :param transition_func: Transition function for state prediction.
+    :param df: DataFrame containing the training data.
+    :param n_paths: Number of paths to simulate.
+    :param seed: Seed for the random generator.
+    :param moves: Change in value for each state (see state_moves), None for the default +/- 5 steps.
+    :return: Plotly Figure object containing the prediction visualization.
+    """
+    future_dates, bands = forecast_percentiles(transition_func, df, days, n_paths, seed, moves)
+
+    return fan_chart(df, future_dates, bands, f'Prediction Visualization ({n_paths} simulated paths)')
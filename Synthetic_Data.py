@@ -0,0 +1,364 @@
+import argparse
+import os
+import time
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+"""
+Synthetic datasets in the shape of the real extracts (Data/*.csv), to load / stress test every page.
+
+- performance -> performance_extract.csv (AcctId, EOM, ClosingBal), one row per account per month end
+- sales       -> spider_graph_data.csv (adviser / account / sleeve / security holdings)
+- geo         -> Average Taxable Income Across Australia.csv plus an Income column (bubble map and hexabin)
+- income_age  -> Incomes vs Age.csv (bubble plot)
+
+Every column is drawn with numpy in one go per chunk, cardinalities follow the real files (about 16 holdings
+per account, 2-3 accounts per adviser, 36 month ends...). Chunks are written one after the other so memory
+stays at one chunk whatever the row count (1e8 rows is fine), and each chunk has its own seed derived from
+the dataset seed -> the same seed and chunk size give the same file, however many processes generated it.
+
+Usage:
+    python Synthetic_Data.py performance --rows 100000000 --output perf.parquet --processes 4
+    python Synthetic_Data.py sales --rows 1000000 --output sales.csv --seed 7
+"""
+
+CHUNK_ROWS = int(os.getenv('SYNTHETIC_CHUNK_ROWS', 1_000_000))
+# Same date format as the extracts
+DATE_FORMAT = '%d/%m/%Y'
+
+# Performance extract -> 36 month ends from January 2018, some accounts opened part way through (balance 0)
+MONTHS = 36
+FIRST_EOM = '2018-01-31'
+LATE_OPENING_SHARE = 0.1
+
+# Holdings extract
+HOLDINGS_PER_ACCOUNT = (2, 31)
+ACCOUNTS_PER_ADVISER = 2.5
+SECURITY_COUNT = 5000
+PORTAL_IDS = [19, 78]
+MODELS = ['Cash', 'Equities', 'Fixed Interest', 'Alternatives', 'Property', 'Conservative', 'Tailored', 'Balanced',
+          'Growth', 'Income']
+ACCOUNT_TYPES = ['Superfund (Accumulation)', 'Superfund (Pension)', 'Joint', 'Individual', 'Trust']
+# Asset class -> share of the securities, listed on the ASX (3 letter code) or managed fund (APIR code)
+ASSET_CLASSES = {
+    'Australian Equity': (0.35, True), 'International Equity': (0.15, False), 'Australian Fixed Interest': (0.1, False),
+    'International Fixed Interest': (0.05, False), 'Australian Property': (0.08, True),
+    'International Property': (0.04, False), 'International Infrastructure': (0.03, False),
+    'Alternative Investments': (0.12, False), 'Cash': (0.08, False),
+}
+GICS = ['Banks', 'Materials', 'Health Care Equipment & Services', 'Diversified Financials', 'Real Estate',
+        'Utilities', 'Software & Services', 'Telecommunication Services', 'Energy', 'Retailing']
+
+# Geo income -> postcodes around the capital cities, (latitude, longitude, first postcode, weight)
+CITIES = {
+    'Sydney': (-33.8688, 151.2093, 2000, 0.32), 'Melbourne': (-37.8136, 144.9631, 3000, 0.3),
+    'Brisbane': (-27.4698, 153.0251, 4000, 0.16), 'Perth': (-31.9523, 115.8613, 6000, 0.12),
+    'Adelaide': (-34.9285, 138.6007, 5000, 0.1),
+}
+POSTCODE_COUNT = 2600
+
+# Incomes vs age -> weekly income bands and age groups of the census table
+INCOME_BANDS = [0, 149, 299, 399, 499, 649, 799, 999, 1249, 1499, 1749, 1999, 2999, 3499, 3500]
+AGE_GROUPS = [15, 20, 25, 35, 45, 55, 65, 75, 85]
+
+
+def performance_chunk(rng, first_row, rows, months=MONTHS):
+    """
+    :param rng: numpy random generator of the chunk.
+    :param first_row: row number of the first row of the chunk (a multiple of months).
+    :param rows: number of rows of the chunk.
+    :param months: number of month ends per account.
+    :return: data frame with the performance_extract columns (AcctId, EOM, ClosingBal).
+    """
+    accounts = -(-rows // months)
+    month_ends = pd.date_range(FIRST_EOM, periods=months, freq=pd.offsets.MonthEnd()).strftime(DATE_FORMAT)
+
+    # Random walk of monthly returns from a log normal opening balance (median around $900k like the extract)
+    opening = rng.lognormal(np.log(900_000), 0.9, size=(accounts, 1))
+    returns = rng.normal(0.006, 0.035, size=(accounts, months))
+    balances = opening * np.exp(np.cumsum(returns, axis=1))
+    # Some accounts only open part way through -> zero balance before that
+    opened = np.where(rng.random(accounts) < LATE_OPENING_SHARE, rng.integers(1, months, size=accounts), 0)
+    balances[np.arange(months) < opened[:, None]] = 0
+
+    account_ids = 10_000 + first_row // months + np.arange(accounts)
+    return pd.DataFrame({
+        'AcctId': np.repeat(account_ids, months)[:rows],
+        'EOM': pd.Categorical.from_codes(np.tile(np.arange(months), accounts)[:rows], month_ends),
+        'ClosingBal': balances.ravel()[:rows].round(2),
+    })
+
+
+@lru_cache(maxsize=4)
+def _security_pool(seed):
+    """
+    Securities shared by every chunk of a dataset -> codes, asset class, GICS sector, price and popularity.
+    """
+    rng = np.random.default_rng([seed, 0])
+    names = list(ASSET_CLASSES)
+    shares = np.array([ASSET_CLASSES[name][0] for name in names])
+    asset_class = rng.choice(len(names), size=SECURITY_COUNT, p=shares / shares.sum())
+    listed = np.array([ASSET_CLASSES[name][1] for name in names])[asset_class]
+
+    letters = rng.integers(0, 26, size=(SECURITY_COUNT, 3))
+    prefix = [''.join(chr(65 + letter) for letter in row) for row in letters]
+    codes = np.where(listed, prefix, [f'{p}{i % 10000:04d}AU' for i, p in enumerate(prefix)])
+    # Keep codes unique (3 letters give 17576 codes, so a few duplicates get a suffix)
+    codes = pd.Series(codes)
+    codes = np.where(codes.duplicated(), codes + pd.Series(np.arange(SECURITY_COUNT)).astype(str), codes)
+
+    gics = np.where(listed, np.array(GICS, dtype=object)[rng.integers(0, len(GICS), SECURITY_COUNT)], None)
+    prices = np.where(listed, rng.lognormal(np.log(12), 1.2, SECURITY_COUNT), rng.lognormal(0, 0.4, SECURITY_COUNT))
+    prices = prices.round(2).clip(0.01)
+    # A few securities are held by most accounts, most by only a few
+    popularity = 1 / np.arange(1, SECURITY_COUNT + 1) ** 0.9
+    return {
+        'codes': np.asarray(codes, dtype=object),
+        'asset_class': np.array(names, dtype=object)[asset_class],
+        'gics': gics,
+        'prices': prices,
+        'price_text': np.array([f'${price:.2f}' for price in prices], dtype=object),
+        'popularity': popularity / popularity.sum(),
+    }
+
+
+def sales_chunk(rng, first_row, rows, seed=42, advisers=100, value_date='31/01/2018'):
+    """
+    :param rng: numpy random generator of the chunk.
+    :param first_row: row number of the first row of the chunk.
+    :param rows: number of rows of the chunk.
+    :param seed: dataset seed (the securities are the same in every chunk).
+    :param advisers: number of advisers in the whole dataset.
+    :param value_date: ValueDate of every holding.
+    :return: data frame with the spider_graph_data columns.
+    """
+    securities = _security_pool(seed)
+
+    # Enough accounts to cover the rows, the last one is cut short
+    low, high = HOLDINGS_PER_ACCOUNT
+    holdings = rng.integers(low, high, size=rows // low + 1)
+    accounts = np.searchsorted(np.cumsum(holdings), rows) + 1
+    holdings = holdings[:accounts]
+    account = np.repeat(np.arange(accounts), holdings)[:rows]
+
+    account_ids = 10_000 + first_row + np.arange(accounts)
+    adviser_codes = 1_000 + rng.integers(0, max(advisers, 1), size=accounts)
+    account_types = rng.integers(0, len(ACCOUNT_TYPES), size=accounts)
+    # 1 to 4 sleeves (each with a model) per account
+    sleeves = rng.integers(1, 5, size=accounts)
+    sleeve = (rng.random(rows) * sleeves[account]).astype(np.int64)
+    sleeve_ids = account_ids[account] * 4 + sleeve
+
+    security = rng.choice(SECURITY_COUNT, size=rows, p=securities['popularity'])
+    quantity = np.maximum(rng.lognormal(np.log(16_000), 1.6, size=rows), 1).astype(np.int64)
+
+    return pd.DataFrame({
+        'PortalID': np.array(PORTAL_IDS)[(account_ids[account] % len(PORTAL_IDS))],
+        'adviserCode': adviser_codes[account],
+        'ValueDate': pd.Categorical.from_codes(np.zeros(rows, dtype=np.int8), [value_date]),
+        'AcctId': account_ids[account],
+        'SleeveID': sleeve_ids,
+        'Model': pd.Categorical.from_codes(sleeve_ids % len(MODELS), MODELS),
+        'AccountTypeDescription': pd.Categorical.from_codes(account_types[account], ACCOUNT_TYPES),
+        'SecCode': securities['codes'][security],
+        'AssetClass': securities['asset_class'][security],
+        'GICS': securities['gics'][security],
+        ' Price ': securities['price_text'][security],
+        'Quantity': quantity,
+        'MarketValue': (securities['prices'][security] * quantity).round(2),
+    })
+
+
+@lru_cache(maxsize=4)
+def _postcode_pool(seed):
+    """
+    Postcodes shared by every chunk of a dataset -> code, suburb, centre, average taxable income and
+    share of the people living there.
+    """
+    rng = np.random.default_rng([seed, 0])
+    names = list(CITIES)
+    weights = np.array([CITIES[name][3] for name in names])
+    city = np.sort(rng.choice(len(names), size=POSTCODE_COUNT, p=weights / weights.sum()))
+    first_postcode = np.array([CITIES[name][2] for name in names])[city]
+    # Number the postcodes of each city from its first postcode
+    postcode = first_postcode + np.arange(POSTCODE_COUNT) - np.searchsorted(city, city)
+
+    # Richer suburbs are closer to the centre
+    distance = rng.exponential(0.25, size=POSTCODE_COUNT)
+    angle = rng.uniform(0, 2 * np.pi, size=POSTCODE_COUNT)
+    latitude = np.array([CITIES[name][0] for name in names])[city] + distance * np.sin(angle)
+    longitude = np.array([CITIES[name][1] for name in names])[city] + distance * np.cos(angle)
+    average_income = rng.lognormal(np.log(70_000), 0.35, size=POSTCODE_COUNT) * np.exp(-distance)
+    population = rng.lognormal(0, 1, size=POSTCODE_COUNT)
+    return {
+        'postcode': postcode,
+        'suburb': np.array([f'{names[c]} {p}' for c, p in zip(city, postcode)], dtype=object),
+        'latitude': latitude,
+        'longitude': longitude,
+        'average_income': average_income.round(0).astype(np.int64) + 20_000,
+        'population': population / population.sum(),
+    }
+
+
+def geo_income_chunk(rng, first_row, rows, seed=42):
+    """
+    :param rng: numpy random generator of the chunk.
+    :param first_row: row number of the first row of the chunk.
+    :param rows: number of rows of the chunk.
+    :param seed: dataset seed (the postcodes are the same in every chunk).
+    :return: data frame with Postcode, Average Taxable Income, Suburb, Latitude, Longitude and the Income of
+             one person per row.
+    """
+    postcodes = _postcode_pool(seed)
+    postcode = rng.choice(POSTCODE_COUNT, size=rows, p=postcodes['population'])
+    average_income = postcodes['average_income'][postcode]
+    return pd.DataFrame({
+        'Postcode': postcodes['postcode'][postcode],
+        'Average Taxable Income': average_income,
+        'Suburb': pd.Categorical.from_codes(postcode, postcodes['suburb']),
+        'Latitude': (postcodes['latitude'][postcode] + rng.normal(0, 0.01, size=rows)).round(6),
+        'Longitude': (postcodes['longitude'][postcode] + rng.normal(0, 0.01, size=rows)).round(6),
+        'Income': (average_income * rng.lognormal(-0.1, 0.45, size=rows)).round(2),
+    })
+
+
+def income_age_chunk(rng, first_row, rows):
+    """
+    :param rng: numpy random generator of the chunk.
+    :param first_row: row number of the first row of the chunk.
+    :param rows: number of rows of the chunk.
+    :return: data frame with the Incomes vs Age columns (Income band, Age group, Size, Population).
+    """
+    population = rng.lognormal(np.log(52_000), 1.3, size=rows).astype(np.int64) + 100
+    return pd.DataFrame({
+        'Income': np.array(INCOME_BANDS)[rng.integers(0, len(INCOME_BANDS), size=rows)],
+        'Age': np.array(AGE_GROUPS)[rng.integers(0, len(AGE_GROUPS), size=rows)],
+        'Size': population / 10_000,
+        'Population': population,
+    })
+
+
+SCHEMAS = {
+    'performance': performance_chunk,
+    'sales': sales_chunk,
+    'geo': geo_income_chunk,
+    'income_age': income_age_chunk,
+}
+
+
+def _options(schema, rows, seed):
+    # Dataset wide settings every chunk needs
+    if schema == 'sales':
+        return {'seed': seed, 'advisers': max(1, round(rows / np.mean(HOLDINGS_PER_ACCOUNT) / ACCOUNTS_PER_ADVISER))}
+    if schema == 'geo':
+        return {'seed': seed}
+    return {}
+
+
+def _chunks(schema, rows, seed, chunk_rows):
+    # The performance chunks hold whole accounts
+    if schema == 'performance':
+        chunk_rows = max(chunk_rows // MONTHS, 1) * MONTHS
+    options = _options(schema, rows, seed)
+    return [(schema, seed, index, first_row, min(chunk_rows, rows - first_row), options)
+            for index, first_row in enumerate(range(0, rows, chunk_rows))]
+
+
+def make_chunk(task):
+    """
+    Runs in a pool process (or inline) -> generates one chunk.
+
+    :param task: tuple of (schema, seed, chunk index, first row, rows, options).
+    :return: data frame of the chunk.
+    """
+    schema, seed, index, first_row, rows, options = task
+    return SCHEMAS[schema](np.random.default_rng([seed, index + 1]), first_row, rows, **options)
+
+
+def generate(schema, rows, seed=42, chunk_rows=CHUNK_ROWS):
+    """
+    Generates a dataset chunk by chunk, in memory.
+
+    :param schema: 'performance', 'sales', 'geo' or 'income_age'.
+    :param rows: total number of rows.
+    :param seed: seed of the dataset.
+    :param chunk_rows: number of rows per chunk.
+    :return: iterator of data frames.
+    """
+    for task in _chunks(schema, rows, seed, chunk_rows):
+        yield make_chunk(task)
+
+
+def generate_frame(schema, rows, seed=42):
+    """
+    :param schema: 'performance', 'sales', 'geo' or 'income_age'.
+    :param rows: total number of rows.
+    :param seed: seed of the dataset.
+    :return: the whole dataset as one data frame (for small sizes, i.e. tests and benchmarks).
+    """
+    return pd.concat(generate(schema, rows, seed), ignore_index=True)
+
+
+def write_dataset(schema, rows, output, seed=42, chunk_rows=CHUNK_ROWS, processes=1):
+    """
+    Generates a dataset and writes it chunk by chunk (CSV, or Parquet when output ends with .parquet).
+
+    :param schema: 'performance', 'sales', 'geo' or 'income_age'.
+    :param rows: total number of rows.
+    :param output: path of the file written.
+    :param seed: seed of the dataset.
+    :param chunk_rows: number of rows per chunk (memory is about one chunk per process).
+    :param processes: number of processes generating chunks, the file is still written in order.
+    :return: number of rows written.
+    """
+    tasks = _chunks(schema, rows, seed, chunk_rows)
+    parquet = output.endswith('.parquet')
+    writer = None
+    written = 0
+    start = time.perf_counter()
+
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        chunks = pool.imap(make_chunk, tasks) if pool else map(make_chunk, tasks)
+        for chunk in chunks:
+            if parquet:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(output, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+            written += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+        if pool:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {written:,} {schema} rows to '{output}' in {elapsed:.1f}s ({written / elapsed:,.0f} rows/s)")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic datasets in the shape of the real extracts.')
+    parser.add_argument('schema', choices=list(SCHEMAS))
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--output', help='.csv or .parquet file (defaults to synthetic_<schema>.csv)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    write_dataset(args.schema, args.rows, args.output or f'synthetic_{args.schema}.csv', args.seed, args.chunk_rows,
+                  args.processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,21 @@ Data provided is stored in SQL Lite database for transportable use.
 import dash
 import dash_bootstrap_components as dbc
 from Helper_Functions import *
+from Background_Jobs import background_manager
+from Instrumentation import install_instrumentation
+from Query_Engine import install_query_api
 
 
 # Create instance of dash component with VAPOR aesthetic
-app = Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.LUX])
+# Slow callbacks (background=True) run through the local diskcache job manager, see Background_Jobs.py
+app = Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.LUX],
+           background_callback_manager=background_manager)
+# WSGI entry point for production -> gunicorn -c gunicorn.conf.py Visualiser_Tool_App:server
+server = app.server
+# Callback timings / profiling, scraped from /metrics (see Instrumentation.py)
+install_instrumentation(server)
+# Ad-hoc SQL over the uploaded tables -> POST /api/query, GET /api/tables (see Query_Engine.py)
+install_query_api(server)
 
 navbar = dbc.NavbarSimple(
     brand="HUB24",
@@ -17,6 +28,8 @@ navbar = dbc.NavbarSimple(
         dbc.NavItem(dbc.NavLink("Home", href="/")),
         dbc.NavItem(dbc.NavLink("Performance", href="/performance")),
         dbc.NavItem(dbc.NavLink("Sales", href="/sales")),
+        dbc.NavItem(dbc.NavLink("Query", href="/query")),
+        dbc.NavItem(dbc.NavLink("Planner", href="/planner")),
         dbc.NavItem(dbc.NavLink("AI Chatbot & Stock Price Predictor", href="/chatbot"))
     ],
     sticky="top",
@@ -0,0 +1,94 @@
+/*
+Clientside view switching for the home page (pages/home.py).
+
+The data comes from the 'home-data-store' (built once after upload by compact_view_data in
+Helper_Functions.py), the figures below mirror create_bubble_plot and create_high_tax_geo_bubble_plot.
+The hexabin figure is binned on the server at upload time and only picked from the store here.
+*/
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    home: {
+        switch_view: function (selectedRadio, viewData) {
+            var noUpdate = window.dash_clientside.no_update;
+            if (!viewData) {
+                return ['No data uploaded ❌!', noUpdate];
+            }
+            var columns = viewData.columns;
+            var missing = function (names) {
+                return names.filter(function (name) { return !(name in columns); });
+            };
+            var graph = null;
+
+            if (selectedRadio === 'Income vs age data for bubble chart output.') {
+                if (missing(['Income', 'Age', 'Size']).length) {
+                    return ['Uploaded data is missing: ' + missing(['Income', 'Age', 'Size']).join(', '), noUpdate];
+                }
+                graph = {
+                    data: [{
+                        type: 'scatter',
+                        x: columns['Income'],
+                        y: columns['Age'],
+                        mode: 'markers',
+                        marker: {
+                            size: columns['Size'],
+                            color: columns['Income'].map(function (_, i) { return i; }),
+                            colorscale: 'Viridis',
+                            colorbar: {title: {text: 'Age (lighter colour = older)'}}
+                        }
+                    }],
+                    layout: {
+                        title: {text: 'Weekly Income Vs Age: Bubble Plot'},
+                        xaxis: {title: {text: 'Income (0 - ..., ... - ..., to 3500+)'}},
+                        yaxis: {title: {text: 'Age (0 - 20, 20 - 40, ...).'}},
+                        width: 1600,
+                        height: 800
+                    }
+                };
+            } else if (selectedRadio === 'Post code & Taxable Income') {
+                var needed = ['Latitude', 'Longitude', 'Average Taxable Income'];
+                if (missing(needed).length) {
+                    return ['Uploaded data is missing: ' + missing(needed).join(', '), noUpdate];
+                }
+                var income = columns['Average Taxable Income'];
+                // Same marker scaling as plotly express (size_max=20, area sizing)
+                var sizeref = 2.0 * Math.max.apply(null, income) / (20 * 20);
+                graph = {
+                    data: [{
+                        type: 'scattermapbox',
+                        lat: columns['Latitude'],
+                        lon: columns['Longitude'],
+                        mode: 'markers',
+                        marker: {
+                            size: income,
+                            sizemode: 'area',
+                            sizeref: sizeref,
+                            color: income,
+                            coloraxis: 'coloraxis'
+                        },
+                        hovertemplate: 'Average Taxable Income=%{marker.color}<br>Latitude=%{lat}' +
+                            '<br>Longitude=%{lon}<extra></extra>'
+                    }],
+                    layout: {
+                        mapbox: {
+                            center: {lat: -25.2744, lon: 133.7751},
+                            zoom: 3,
+                            bearing: 0,
+                            pitch: 0,
+                            style: 'open-street-map'
+                        },
+                        coloraxis: {colorscale: 'Plasma', colorbar: {title: {text: 'Average Taxable Income'}}},
+                        margin: {t: 60},
+                        height: 1000,
+                        width: 2000
+                    }
+                };
+            } else if (selectedRadio === 'Hexabin version of above') {
+                if (!viewData.hexbin) {
+                    return ['Uploaded data is missing: Latitude, Longitude and Income', noUpdate];
+                }
+                graph = viewData.hexbin;
+            }
+
+            return ['Data uploaded 😊!', graph];
+        }
+    }
+});
@@ -0,0 +1,188 @@
+"""
+Benchmarks for the hot paths of Helper_Functions.py (text_output, sales_spider, sales_bar, create_hexabin_graph,
+performance_line_graph, populate_longitude_latitude) and for turning their figures into JSON, which is what
+Dash does with every figure it sends.
+
+Every function runs at increasing row counts on synthetic data in the shape of the real Data/*.csv extracts
+(Synthetic_Data.py, fixed seed, optimise_dtypes applied like the pages do). The time is the best of --repeat
+runs, the peak memory comes from one more run under tracemalloc. A size is skipped when the smaller size
+suggests it would take more than --budget seconds (text_output and populate_longitude_latitude loop in Python).
+
+Results are compared with the stored baseline (helper_functions_baseline.json next to this file) and the
+script exits with an error when a case got slower than the baseline by more than --threshold. Baselines only
+mean something on the machine they were recorded on -> re-record with --save-baseline after changing machine.
+
+Usage (from the repository root):
+    python benchmarks/helper_functions_benchmark.py --sizes 1000 100000 10000000
+    python benchmarks/helper_functions_benchmark.py --only text_output sales_bar --save-baseline
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Helper_Functions import *  # noqa: E402
+from Synthetic_Data import generate_frame  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'helper_functions_baseline.json')
+SEED = 42
+# Differences below this many seconds are timer noise, never a regression
+NOISE_SECONDS = 0.005
+# Input files of populate_longitude_latitude, removed on exit
+WORK_DIRECTORY = tempfile.TemporaryDirectory(prefix='helper-benchmark-')
+
+
+def performance_data(rows):
+    return optimise_dtypes(generate_frame('performance', rows, SEED))
+
+
+def sales_data(rows):
+    return optimise_dtypes(generate_frame('sales', rows, SEED))
+
+
+def geo_data(rows):
+    return optimise_dtypes(generate_frame('geo', rows, SEED))
+
+
+def postcode_files(rows):
+    """
+    Target file (postcodes without coordinates) and source file (postcode, lat, long) for
+    populate_longitude_latitude, written to a temporary folder.
+    """
+    folder = WORK_DIRECTORY.name
+    target = os.path.join(folder, 'target.csv')
+    source = os.path.join(folder, 'source.csv')
+    generate_frame('geo', rows, SEED).drop(columns=['Latitude', 'Longitude']).to_csv(target, index=False)
+    # One row per postcode, like the australian_meta_data file
+    postcodes = generate_frame('geo', 100_000, SEED).groupby('Postcode')[['Latitude', 'Longitude']].first()
+    postcodes.rename(columns={'Latitude': 'lat', 'Longitude': 'long'}).rename_axis('postcode').to_csv(source)
+    return target, source, os.path.join(folder, 'output.csv')
+
+
+def first_adviser(df):
+    return df['adviserCode'].iloc[0]
+
+
+# name -> (data builder, function of the data, True if it returns a figure)
+CASES = {
+    'text_output': (performance_data, text_output, False),
+    'performance_line_graph': (performance_data, performance_line_graph, True),
+    'sales_spider': (sales_data, lambda df: sales_spider(df, first_adviser(df)), True),
+    'sales_bar': (sales_data, lambda df: sales_bar(df, first_adviser(df)), True),
+    'create_hexabin_graph': (geo_data, create_hexabin_graph, True),
+    'populate_longitude_latitude': (postcode_files, lambda files: populate_longitude_latitude(*files), False),
+}
+
+
+def measure(function, argument, repeat):
+    """
+    :return: (best time of repeat runs in seconds, peak traced memory in MB, result of the last run).
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def run(cases, sizes, repeat, budget):
+    """
+    Runs every case at every size (smallest first).
+
+    :return: dictionary of 'case@rows' -> {'seconds', 'peak_mb'} (plus 'bytes' for the JSON cases).
+    """
+    results = {}
+    for name in cases:
+        build, function, returns_figure = CASES[name]
+        previous = None
+        for rows in sorted(sizes):
+            # Assume at least linear growth from the previous size
+            if previous is not None and previous[1] * rows / previous[0] > budget:
+                print(f"{name:<34} {rows:>11,} skipped (about {previous[1] * rows / previous[0]:,.0f}s expected)")
+                continue
+            data = build(rows)
+            repeats = repeat if rows <= 100_000 else 1
+            seconds, peak, figure = measure(function, data, repeats)
+            results[f'{name}@{rows}'] = {'seconds': seconds, 'peak_mb': peak}
+            print(f"{name:<34} {rows:>11,} {seconds:>10.4f}s {peak:>10.1f} MB")
+            previous = (rows, seconds)
+
+            if returns_figure:
+                seconds, peak, text = measure(lambda fig: fig.to_json(), figure, repeats)
+                results[f'{name}.to_json@{rows}'] = {'seconds': seconds, 'peak_mb': peak, 'bytes': len(text)}
+                print(f"{name + '.to_json':<34} {rows:>11,} {seconds:>10.4f}s {peak:>10.1f} MB "
+                      f"{len(text) / 1e6:>10.1f} MB of JSON")
+            del data, figure
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: list of the cases slower than the baseline by more than the threshold.
+    """
+    regressions = []
+    print(f"\n{'case':<50} {'baseline':>10} {'now':>10} {'change':>8}")
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        before, now = baseline[case]['seconds'], result['seconds']
+        change = now / before - 1 if before else 0
+        regressed = change > threshold and now - before > NOISE_SECONDS
+        print(f"{case:<50} {before:>9.4f}s {now:>9.4f}s {100 * change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(case)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 10_000_000])
+    parser.add_argument('--only', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case up to 1e5 rows (best one counts)')
+    parser.add_argument('--budget', type=float, default=120, help='skip sizes expected to take longer (seconds)')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slow down against the baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args()
+
+    print(f"{'case':<34} {'rows':>11} {'time':>11} {'peak':>13}")
+    results = run(args.only, args.sizes, args.repeat, args.budget)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.save_baseline:
+        # Cases that weren't run keep their old numbers
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to '{args.baseline}'")
+        return
+
+    if not baseline:
+        print("\nNo baseline yet, record one with --save-baseline")
+        return
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        sys.exit(f"{len(regressions)} case(s) slower than the baseline by more than {100 * args.threshold:.0f}%")
+    print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Local stand-in for the OpenAI chat completions API, so the chatbot can be tested and load tested without
+the real API (and without spending tokens).
+
+Answers echo the last user message after --delay seconds (the model latency), either whole or, when the request
+asks for stream=true, word by word as server sent events (first word after --delay, then one word every
+--token-delay seconds). /stats returns how many completions
+were requested, to check caching and coalescing.
+
+Usage (from the repository root):
+    python benchmarks/llm_stub_server.py --port 8099 --delay 1.0 --token-delay 0.05
+    LLM_BASE_URL=http://127.0.0.1:8099/v1 API_KEY=stub python Visualiser_Tool_App.py
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+settings = {'delay': 1.0, 'token_delay': 0.05}
+stats = {'completions': 0}
+stats_lock = threading.Lock()
+
+
+def answer_for(messages):
+    question = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    return f"Stub answer to: {question}"
+
+
+@app.post('/v1/chat/completions')
+def chat_completions():
+    body = request.get_json()
+    with stats_lock:
+        stats['completions'] += 1
+    answer = answer_for(body['messages'])
+    if body.get('stream'):
+        return Response(stream_answer(answer, body.get('model', 'stub')), mimetype='text/event-stream')
+    time.sleep(settings['delay'])
+    return jsonify({
+        'id': f'chatcmpl-{uuid.uuid4().hex}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': answer}}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': len(answer.split()), 'total_tokens': 0},
+    })
+
+
+def stream_answer(answer, model):
+    completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+    words = answer.split(' ')
+    # Same model latency as a whole answer before the first word, then one word at a time
+    time.sleep(settings['delay'])
+    for i, word in enumerate(words):
+        chunk = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'finish_reason': None,
+                         'delta': {'content': word if i == 0 else ' ' + word}}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        time.sleep(settings['token_delay'])
+    done = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'delta': {}}]}
+    yield f"data: {json.dumps(done)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get('/stats')
+def get_stats():
+    with stats_lock:
+        return jsonify(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds before each answer / first streamed word')
+    parser.add_argument('--token-delay', type=float, default=0.05, help='seconds between streamed words')
+    args = parser.parse_args()
+    settings['delay'] = args.delay
+    settings['token_delay'] = args.token_delay
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
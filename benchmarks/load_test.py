@@ -0,0 +1,471 @@
+"""
+Load test of the Dash app with concurrent virtual users.
+
+Every virtual user loads the app and replays what an analyst does, callback by callback, the way the browser
+sends them (background callbacks are polled until their result is ready, the chatbot answer is polled until
+it is complete):
+    home        -> upload a file, page / sort the preview, switch views (only hits the server when the views
+                   are not switched clientside, CLIENTSIDE_VIEWS=0)
+    performance -> upload the performance extract, generate the output
+    sales       -> upload the holdings extract, click an adviser button
+    chatbot     -> ask a question, run the stock price prediction
+and the p50 / p95 / p99 latency and the throughput of every step are printed at the end.
+
+Nothing leaves the machine -> the chatbot talks to the local stub (llm_stub_server.py, started here) and the
+predictor reads a generated price fixture (MARKET_DATA_OFFLINE). Databases and caches go to a temporary folder.
+
+Targets:
+    in process (default) -> the Flask test client of Visualiser_Tool_App, one per virtual user
+    --serve              -> starts gunicorn (gunicorn.conf.py) with WEB_CONCURRENCY / GUNICORN_THREADS
+    --url                -> a server that is already running (start it with the environment printed by --print-env)
+
+Usage (from the repository root):
+    python benchmarks/load_test.py --users 8 --duration 60
+    python benchmarks/load_test.py --serve --workers 2 --threads 4 --users 16 --rows 100000
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from Synthetic_Data import generate_frame  # noqa: E402
+
+UPDATE_PATH = '/_dash-update-component'
+QUESTIONS = [
+    'Which account gained the most?',
+    'Which adviser manages the most money?',
+    'What is a hexabin plot?',
+    'Summarise the asset classes of the holdings.',
+    'How do I read a bubble chart?',
+]
+# The sales page only has a callback for this adviser button
+SALES_ADVISER = '1201'
+
+
+class InProcessClient:
+    """
+    Flask test client of the app (imported once, one client per virtual user).
+    """
+
+    def __init__(self, server):
+        self.client = server.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.data
+
+    def post(self, path, body, query=None):
+        response = self.client.post(path, json=body, query_string=query)
+        return response.status_code, response.data
+
+
+class HttpClient:
+    """
+    Plain HTTP client for a server that is running.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def _open(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.url + path))
+
+    def post(self, path, body, query=None):
+        url = self.url + path + (f'?{urllib.parse.urlencode(query)}' if query else '')
+        return self._open(urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST',
+                                                 headers={'Content-Type': 'application/json'}))
+
+
+def _parse_id(component_id):
+    # Dictionary ids come back from /_dash-dependencies as JSON text
+    return json.loads(component_id) if component_id.startswith('{') else component_id
+
+
+def _parse_outputs(output):
+    specs = output[2:-2].split('...') if output.startswith('..') else [output]
+    outputs = []
+    for spec in specs:
+        component_id, prop = spec.rsplit('.', 1)
+        outputs.append({'id': _parse_id(component_id), 'property': prop})
+    return outputs
+
+
+class Callbacks:
+    """
+    Request bodies of the callbacks, built from /_dash-dependencies like the browser does.
+    """
+
+    def __init__(self, dependencies):
+        self.dependencies = [dependency for dependency in dependencies if not dependency.get('clientside_function')]
+
+    def find(self, output, trigger=None):
+        """
+        :param output: 'id.property' of one of the outputs of the callback.
+        :param trigger: 'id.property' of one of its inputs, for outputs updated by several callbacks.
+        :return: the dependency of the callback, or None if there is no server callback for it.
+        """
+        for dependency in self.dependencies:
+            specs = _parse_outputs(dependency['output'])
+            if not any(f"{spec['id']}.{spec['property'].split('@')[0]}" == output for spec in specs):
+                continue
+            if trigger is None or any(f"{item['id']}.{item['property']}" == trigger for item in dependency['inputs']):
+                return dependency
+        return None
+
+    @staticmethod
+    def body(dependency, values, changed):
+        """
+        :param dependency: dependency from find().
+        :param values: dictionary of 'id.property' -> value for the inputs and states (missing ones are None).
+        :param changed: 'id.property' of the input that triggered the callback.
+        :return: body of the /_dash-update-component request.
+        """
+        def fill(items):
+            return [{'id': _parse_id(item['id']), 'property': item['property'],
+                     'value': values.get(f"{item['id']}.{item['property']}")} for item in items]
+
+        outputs = _parse_outputs(dependency['output'])
+        return {
+            'output': dependency['output'],
+            'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+            'inputs': fill(dependency['inputs']),
+            'state': fill(dependency.get('state', [])),
+            'changedPropIds': [changed],
+        }
+
+
+class Recorder:
+    """
+    Latencies, errors and requests of every step, shared by the virtual users.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.requests = 0
+
+    def record(self, step, seconds, ok, requests):
+        with self.lock:
+            self.latencies.setdefault(step, [])
+            self.errors.setdefault(step, 0)
+            if ok:
+                self.latencies[step].append(seconds)
+            else:
+                self.errors[step] += 1
+            self.requests += requests
+
+    def report(self, elapsed):
+        print(f"\n{'step':<28} {'count':>7} {'errors':>7} {'per s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for step in self.latencies:
+            latencies = sorted(self.latencies[step])
+            count = len(latencies)
+            if count:
+                p50, p95, p99 = (1000 * latencies[min(int(count * q), count - 1)] for q in (0.5, 0.95, 0.99))
+                print(f"{step:<28} {count:>7} {self.errors[step]:>7} {count / elapsed:>8.2f} {p50:>9.1f} "
+                      f"{p95:>9.1f} {p99:>9.1f}")
+            else:
+                print(f"{step:<28} {count:>7} {self.errors[step]:>7}")
+        print(f"\n{self.requests:,} requests in {elapsed:.1f}s -> {self.requests / elapsed:.1f} requests/s")
+
+
+class VirtualUser:
+    """
+    One analyst going through the pages in a loop.
+    """
+
+    def __init__(self, client, callbacks, uploads, recorder, poll_interval, think_time, unique_questions, seed):
+        self.client = client
+        self.callbacks = callbacks
+        self.uploads = uploads
+        self.recorder = recorder
+        self.poll_interval = poll_interval
+        self.think_time = think_time
+        self.unique_questions = unique_questions
+        self.random = random.Random(seed)
+        self.clicks = 0
+
+    def think(self):
+        if self.think_time:
+            time.sleep(self.random.uniform(0, 2 * self.think_time))
+
+    def call(self, output, values, changed):
+        """
+        Runs a callback until its result is there (background callbacks are polled).
+
+        :return: (response of the callback or None when nothing was updated, number of requests).
+        """
+        dependency = self.callbacks.find(output, changed)
+        body = Callbacks.body(dependency, values, changed)
+        status, data = self.client.post(UPDATE_PATH, body)
+        requests = 1
+        while True:
+            if status == 204:
+                return None, requests
+            if status != 200:
+                raise RuntimeError(f"{output}: HTTP {status}")
+            reply = json.loads(data)
+            if 'response' in reply:
+                return reply['response'], requests
+            if 'cacheKey' in reply:
+                job = {'cacheKey': reply['cacheKey'], 'job': reply['job']}
+            # Background job still running
+            time.sleep(self.poll_interval)
+            status, data = self.client.post(UPDATE_PATH, body, query=job)
+            requests += 1
+
+    def step(self, name, action):
+        start = time.perf_counter()
+        try:
+            requests = action()
+            ok = True
+        except Exception as e:
+            print(f"{name}: {e}")
+            requests, ok = 1, False
+        self.recorder.record(name, time.perf_counter() - start, ok, requests)
+        self.think()
+
+    def page_load(self):
+        for path in ['/', '/_dash-layout', '/_dash-dependencies']:
+            status, _ = self.client.get(path)
+            if status != 200:
+                raise RuntimeError(f"{path}: HTTP {status}")
+        return 3
+
+    def upload(self, output, upload_id, name):
+        values = {f'{upload_id}.contents': self.uploads[name], f'{upload_id}.filename': f'{name}.csv',
+                  f'{upload_id}.last_modified': time.time()}
+        return self.call(output, values, f'{upload_id}.contents')[1]
+
+    def preview_page(self):
+        values = {'upload-preview.page_current': self.random.randint(0, 4), 'upload-preview.page_size': 20,
+                  'upload-preview.sort_by': [{'column_id': 'Income', 'direction': 'desc'}],
+                  'upload-preview.filter_query': ''}
+        return self.call('upload-preview.data', values, 'upload-preview.page_current')[1]
+
+    def switch_views(self):
+        requests = 0
+        for view in ["Income vs age data for bubble chart output.", "Post code & Taxable Income",
+                     "Hexabin version of above"]:
+            requests += self.call('visualisation.figure', {'spec-radio.value': view}, 'spec-radio.value')[1]
+        return requests
+
+    def click(self, output, button, values=None):
+        self.clicks += 1
+        values = dict(values or {}, **{f'{button}.n_clicks': self.clicks})
+        return self.call(output, values, f'{button}.n_clicks')[1]
+
+    def adviser_click(self):
+        # The button has a dictionary id -> reuse its text from the dependencies so the keys line up
+        button = self.callbacks.find('sales-bar-graph.figure')['inputs'][0]['id']
+        self.clicks += 1
+        return self.call('sales-bar-graph.figure', {f'{button}.n_clicks': self.clicks}, f'{button}.n_clicks')[1]
+
+    def ask_chatbot(self):
+        question = self.random.choice(QUESTIONS)
+        if self.random.random() < self.unique_questions:
+            question = f"{question} (variant {self.random.randint(0, 10 ** 9)})"
+        start = time.perf_counter()
+        response, requests = self.call('chat-stream.data', {'enter-button.n_clicks': 1, 'input-box.value': question},
+                                       'enter-button.n_clicks')
+        stream_id = response['chat-stream']['data']
+        first_text = None
+        polls = 0
+        while True:
+            polls += 1
+            response, count = self.call('chat-poll.disabled', {'chat-poll.n_intervals': polls,
+                                                               'chat-stream.data': stream_id},
+                                        'chat-poll.n_intervals')
+            requests += count
+            text = response['output-container']['children'] if response else ''
+            if first_text is None and text and text != 'Response: ':
+                first_text = time.perf_counter() - start
+                self.recorder.record('chatbot first words', first_text, True, 0)
+            if response and response['chat-poll']['disabled']:
+                return requests
+            time.sleep(self.poll_interval)
+
+    def run(self, deadline, iterations, server_views):
+        self.step('page load', self.page_load)
+        done = 0
+        while time.time() < deadline and (iterations is None or done < iterations):
+            self.step('home upload', lambda: self.upload('upload-status.children', 'upload-data', 'home'))
+            self.step('home preview page', self.preview_page)
+            if server_views:
+                self.step('home switch views', self.switch_views)
+            self.step('performance upload', lambda: self.upload('advisor-upload.children', 'upload-data',
+                                                                'performance'))
+            self.step('performance generate', lambda: self.click('perf-vis.figure', 'button'))
+            self.step('sales upload', lambda: self.upload('sales-upload.children', 'upload-sales', 'sales'))
+            self.step('sales adviser click', self.adviser_click)
+            self.step('chatbot question', self.ask_chatbot)
+            self.step('stock prediction', lambda: self.click('prediction-vis.figure', 'prediction-button',
+                                                             {'prediction-input.value': '30'}))
+            done += 1
+
+
+def data_uri(df):
+    return 'data:text/csv;base64,' + base64.b64encode(df.to_csv(index=False).encode('utf-8')).decode('ascii')
+
+
+def prepare_uploads(rows):
+    """
+    Files uploaded by the virtual users -> the real extracts, or synthetic ones of `rows` rows.
+    """
+    data = os.path.join(REPO_ROOT, 'Data')
+    if rows is None:
+        home = pd.read_csv(os.path.join(data, 'dummy_data_sydney.csv'))
+        performance = pd.read_csv(os.path.join(data, 'performance_extract.csv'))
+        sales = pd.read_csv(os.path.join(data, 'spider_graph_data.csv'))
+    else:
+        home = generate_frame('geo', rows)
+        performance = generate_frame('performance', rows)
+        sales = generate_frame('sales', rows)
+        sales.loc[sales['adviserCode'] == sales['adviserCode'].iloc[0], 'adviserCode'] = int(SALES_ADVISER)
+    # The home page views need ages for the bubble plot
+    home['Age'] = np.random.default_rng(0).integers(15, 86, len(home))
+    home['Size'] = 10.0
+    return {'home': data_uri(home), 'performance': data_uri(performance), 'sales': data_uri(sales)}
+
+
+def stub_environment(work_directory, llm_url):
+    """
+    Environment that keeps the app local -> stub chatbot, offline market data, databases in the work folder.
+    """
+    fixture = os.path.join(work_directory, 'market_fixture.csv')
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=3 * 260)
+    closes = 7000 * np.exp(np.cumsum(np.random.default_rng(1).normal(0.0002, 0.01, len(dates))))
+    pd.DataFrame({'Date': dates, 'Close': closes.round(2)}).to_csv(fixture, index=False)
+    return {
+        'API_KEY': 'stub',
+        'LLM_BASE_URL': llm_url,
+        'MARKET_DATA_OFFLINE': '1',
+        'MARKET_DATA_FIXTURE': fixture,
+        'MARKET_DATA_DB': os.path.join(work_directory, 'market_data.db'),
+        'JOB_CACHE_DIR': os.path.join(work_directory, 'cache'),
+        'CHAT_CACHE_DB': os.path.join(work_directory, 'chat_cache.db'),
+        'FORECAST_DB': os.path.join(work_directory, 'forecasts.db'),
+    }
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=4, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load (users finish their loop)')
+    parser.add_argument('--iterations', type=int, help='loops per user instead of a duration')
+    parser.add_argument('--rows', type=int, help='rows of the uploaded files (synthetic), the real extracts if unset')
+    parser.add_argument('--think-time', type=float, default=0.0, help='average pause between steps (seconds)')
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--unique-questions', type=float, default=0.5, help='share of questions not asked before')
+    parser.add_argument('--url', help='load test a running server instead')
+    parser.add_argument('--serve', action='store_true', help='start gunicorn and load test it')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8062)
+    parser.add_argument('--llm-port', type=int, default=8099)
+    parser.add_argument('--llm-delay', type=float, default=0.5,
+                        help='seconds before each stub answer / first streamed word')
+    parser.add_argument('--llm-token-delay', type=float, default=0.02)
+    parser.add_argument('--print-env', action='store_true', help='print the stub environment for --url and exit')
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix='load-test-')
+    env = stub_environment(work_directory, f'http://127.0.0.1:{args.llm_port}/v1')
+    if args.print_env:
+        # The folder is kept -> it holds the fixture and the databases of the server started with this environment
+        print('\n'.join(f'{key}={value}' for key, value in env.items()))
+        return
+
+    processes = []
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, 'benchmarks', 'llm_stub_server.py'), '--port', str(args.llm_port),
+             '--delay', str(args.llm_delay), '--token-delay', str(args.llm_token_delay)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        wait_until_up(f'http://127.0.0.1:{args.llm_port}/stats')
+
+        if args.url or args.serve:
+            url = args.url
+            if args.serve:
+                url = f'http://127.0.0.1:{args.port}'
+                # The pages write their sqlite files next to the working directory
+                server_directory = os.path.join(work_directory, 'server')
+                os.makedirs(server_directory)
+                processes.append(subprocess.Popen(
+                    [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+                     'Visualiser_Tool_App:server'],
+                    cwd=server_directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    env=dict(os.environ, **env, PYTHONPATH=REPO_ROOT, WEB_CONCURRENCY=str(args.workers),
+                             GUNICORN_THREADS=str(args.threads), BIND=f'127.0.0.1:{args.port}')))
+                wait_until_up(url + '/')
+            make_client = lambda: HttpClient(url)  # noqa: E731
+        else:
+            os.environ.update(env)
+            # Pages and assets are found from the repository, the databases are written in the work folder
+            os.chdir(REPO_ROOT)
+            import Visualiser_Tool_App
+            server_directory = os.path.join(work_directory, 'server')
+            os.makedirs(server_directory)
+            os.chdir(server_directory)
+            make_client = lambda: InProcessClient(Visualiser_Tool_App.server)  # noqa: E731
+
+        status, dependencies = make_client().get('/_dash-dependencies')
+        callbacks = Callbacks(json.loads(dependencies))
+        server_views = callbacks.find('visualisation.figure') is not None
+        uploads = prepare_uploads(args.rows)
+
+        recorder = Recorder()
+        deadline = time.time() + (args.duration if args.iterations is None else float('inf'))
+        users = [VirtualUser(make_client(), callbacks, uploads, recorder, args.poll_interval, args.think_time,
+                             args.unique_questions, seed) for seed in range(args.users)]
+        print(f"{args.users} virtual users against {args.url or ('gunicorn' if args.serve else 'the app in process')}"
+              f"{'' if args.iterations else f' for {args.duration:.0f}s'}...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            for result in [pool.submit(user.run, deadline, args.iterations, server_views) for user in users]:
+                result.result()
+        recorder.report(time.perf_counter() - start)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
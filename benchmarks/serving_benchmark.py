@@ -0,0 +1,91 @@
+"""
+Worker / thread sizing benchmark for the production server (gunicorn.conf.py).
+
+Starts gunicorn once per (workers, threads) combination, hammers a handful of endpoints with a pool of
+concurrent clients and prints the throughput and latency for each combination.
+
+Usage (from the repository root):
+    python benchmarks/serving_benchmark.py --workers 1 2 4 --threads 1 4 8 --clients 32 --requests 2000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Layout and dependency requests are what every page load costs, before any callback fires
+ENDPOINTS = ['/', '/_dash-layout', '/_dash-dependencies', '/performance', '/sales']
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def timed_get(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run_combination(workers, threads, clients, total_requests, port):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               BIND=f'127.0.0.1:{port}')
+    # The chatbot page builds an OpenAI client on import, a placeholder key is enough to serve pages
+    env.setdefault('API_KEY', 'benchmark')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'Visualiser_Tool_App:server'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_up(base + '/')
+        urls = [base + ENDPOINTS[i % len(ENDPOINTS)] for i in range(total_requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            latencies = sorted(pool.map(timed_get, urls))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'workers': workers,
+        'threads': threads,
+        'req_per_sec': total_requests / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=8061)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'threads':>8} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for workers in args.workers:
+        for threads in args.threads:
+            result = run_combination(workers, threads, args.clients, args.requests, args.port)
+            print(f"{result['workers']:>8} {result['threads']:>8} {result['req_per_sec']:>10.1f} "
+                  f"{result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
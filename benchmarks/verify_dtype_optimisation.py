@@ -0,0 +1,108 @@
+"""
+Checks that optimise_dtypes (Helper_Functions.py) shrinks the reference datasets without changing any
+chart or text output built from them, and prints the memory before and after for each dataset.
+
+Charts built from the optimised frame are compared with charts built from the CSV exactly as pandas reads it.
+One change is intended and listed in INTENDED_CHANGES: the date columns are parsed, so the EOM axis of
+performance_line_graph holds dates instead of the '31/01/2018' strings (a real time axis, in date order). For that
+chart the baseline x values are parsed before comparing, everything else has to be identical.
+
+Usage (from the repository root):
+    python benchmarks/verify_dtype_optimisation.py
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Helper_Functions import *  # noqa: E402
+
+
+def normalise(value):
+    """
+    Turns a figure dictionary into plain python values, so that figures built from int16 and int64
+    columns (same numbers, different array types) compare equal.
+    """
+    if isinstance(value, dict):
+        return {key: normalise(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalise(item) for item in value]
+    if isinstance(value, (np.ndarray, pd.Series, pd.Index, pd.Categorical)):
+        return [normalise(item) for item in np.asarray(value, dtype=object).tolist()]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def dates_on_x(figure):
+    """
+    The intended change of a chart with dates on the x axis -> the baseline's date strings parsed.
+    """
+    for trace in figure.get('data', []):
+        if 'x' in trace:
+            trace['x'] = parse_dates(pd.Series(np.asarray(trace['x'], dtype=object))).to_numpy()
+    return figure
+
+
+# Chart -> (what changes on purpose, how the baseline figure is brought to it)
+INTENDED_CHANGES = {
+    'performance_line_graph': ('EOM axis text -> dates', dates_on_x),
+}
+
+
+def load_pair(file_name):
+    # Untouched baseline -> the CSV as pandas reads it, nothing parsed
+    raw = pd.read_csv(os.path.join('Data', file_name), encoding='utf-8-sig')
+    before = raw.memory_usage(deep=True).sum()
+    optimised = optimise_dtypes(raw.copy())
+    after = optimised.memory_usage(deep=True).sum()
+    print(f"{file_name}: {before / 1024:.1f} KB -> {after / 1024:.1f} KB")
+    return raw, optimised
+
+
+def check(name, build, raw, optimised):
+    expected, actual = build(raw.copy()), build(optimised)
+    intended = INTENDED_CHANGES.get(name)
+    if hasattr(expected, 'to_dict'):
+        expected = expected.to_dict()
+        if intended is not None:
+            expected = intended[1](expected)
+        expected, actual = normalise(expected), normalise(actual.to_dict())
+    status = 'same' if expected == actual else 'DIFFERENT'
+    if intended is not None and expected == actual:
+        status += f' apart from the intended change ({intended[0]})'
+    print(f"    {name}: {status}")
+    return expected == actual
+
+
+def main():
+    results = []
+
+    raw, optimised = load_pair('performance_extract.csv')
+    results.append(check('performance_line_graph', performance_line_graph, raw, optimised))
+    results.append(check('text_output', text_output, raw, optimised))
+    results.append(check('worst_account', worst_account, raw, optimised))
+
+    raw, optimised = load_pair('spider_graph_data.csv')
+    for adviser in raw['adviserCode'].unique():
+        results.append(check(f'sales_spider {adviser}', lambda df: sales_spider(df, adviser), raw, optimised))
+        results.append(check(f'sales_bar {adviser}', lambda df: sales_bar(df, adviser), raw, optimised))
+
+    raw, optimised = load_pair('Incomes vs Age.csv')
+    results.append(check('create_bubble_plot', create_bubble_plot, raw, optimised))
+
+    raw, optimised = load_pair('Average Taxable Income Across Australia.csv')
+    results.append(check('create_high_tax_geo_bubble_plot', create_high_tax_geo_bubble_plot, raw, optimised))
+
+    raw, optimised = load_pair('dummy_data_sydney.csv')
+    results.append(check('create_hexabin_graph', create_hexabin_graph, raw, optimised))
+
+    if not all(results):
+        sys.exit('Optimised dtypes changed chart output')
+    print('All outputs unchanged.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Production serving config for the visualiser tool.
+
+Usage (from the repository root):
+    gunicorn -c gunicorn.conf.py Visualiser_Tool_App:server
+
+The app is imported once in the master process (preload_app), the workers are then forked and share the
+imported modules (dash, pandas, plotly, the page layouts) copy-on-write. The data itself is uploaded, and read
+from sqlite / the balance store per request.
+Worker and thread counts can be overridden with environment variables, see the README for the
+sizing benchmark (benchmarks/serving_benchmark.py).
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8050')
+
+# Callbacks are mostly pandas / plotly work (CPU bound, holds the GIL) -> scale with processes first,
+# threads only help to overlap the sqlite reads and upstream (OpenAI / Yahoo Finance) calls.
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+# Recycle workers now and then so a leaky callback can't grow a worker forever
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+
+def pre_fork(server, worker):
+    # Keep the preloaded objects out of the collector, so collections in the workers don't write to
+    # (and therefore copy) the shared pages
+    gc.freeze()
@@ -1,6 +1,13 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIError
 from dotenv import load_dotenv
 import os
+import uuid
+import asyncio
+import threading
+from Chat_Cache import cached_response, lookup_response, save_response, count_request, normalise_prompt
+from Background_Jobs import job_cache
+from LLM_Client import call_llm, acall_llm, LLMUnavailable
+from Dataset_Summaries import chat_context
 
 # Load environment variables from .env file
 load_dotenv()
@@ -8,28 +15,161 @@ load_dotenv()
 # Access the API key from the environment variable
 api_key = os.getenv('API_KEY')
 
-# Store the api key...
-client = OpenAI(api_key=api_key)
+# Where the completions are sent, point it at a local stand-in for testing
+# (i.e. LLM_BASE_URL=http://127.0.0.1:8099/v1 with benchmarks/llm_stub_server.py)
+base_url = os.getenv('LLM_BASE_URL')
+
+MODEL = "gpt-3.5-turbo"
+SYSTEM_BIAS = "You're an informative AI chatbot that specialises in data science, visualisation and analytics."
+
+# Store the api key... (retries and timeouts are handled by LLM_Client.py, not by the openai package)
+client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+
+def system_prompt(user_input):
+    """
+    The system prompt with a summary of the uploaded data (within the token budget of Dataset_Summaries.py),
+    so questions about the data can be answered without sending the tables.
+    :param user_input: Input given by the user (a string).
+    :return: the system prompt.
+    """
+    context = chat_context(user_input)
+    return f"{SYSTEM_BIAS}\n\n{context}" if context else SYSTEM_BIAS
 
 
 # Interactive function for I/O
 def chatbot(user_input):
     """
     This function takes in user input then uses the OpenAI API key to output the response generated by
-    the gpt-3.5-turbo model.
+    the gpt-3.5-turbo model. Repeated (or reworded only by case / spacing) questions are answered from
+    the response cache, see Chat_Cache.py. Requests go through the limiter / retries of LLM_Client.py.
+    A summary of the uploaded data is sent along, so a new upload also means new answers.
     :param user_input: Input given by the user (a string).
     :return: Response from OpenAI API.
     """
-    system_bias = "You're an informative AI chatbot that specialises in data science, visualisation and analytics."
     # Message from user input given to the API
+    system = system_prompt(user_input)
     messages = [
-        {"role": "system", "content": system_bias},
+        {"role": "system", "content": system},
         {"role": "user", "content": user_input}
     ]
 
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages
-    )
+    def complete(timeout):
+        completion = client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            timeout=timeout
+        )
+        return completion.choices[0].message.content
+
+    try:
+        return cached_response(user_input, lambda: call_llm(complete), context=f'{MODEL}\x00{system}')
+    except LLMUnavailable as e:
+        return f"Sorry, {e}. Please try again shortly."
+    except APIError as e:
+        return f"Sorry, the chatbot backend didn't answer ({e}). Please try again shortly."
+
+
+# Streaming -> answers are streamed by an async client on one event loop thread per process, which keeps
+# its connections open between requests. The text received so far is written to the shared job cache, so
+# the page can poll it from any worker (see pages/chatbot.py).
+STREAM_EXPIRY = 10 * 60
+_stream_loop = None
+_stream_client = None
+_stream_pid = None
+_stream_lock = threading.Lock()
+# (Normalised prompt, system prompt) -> id of the stream already answering it in this process
+_open_streams = {}
+
+
+def _get_stream_loop():
+    global _stream_loop, _stream_client, _stream_pid
+    with _stream_lock:
+        # Threads don't survive a fork, so a preloaded server starts its own loop in every worker
+        if _stream_pid != os.getpid():
+            _stream_loop = asyncio.new_event_loop()
+            threading.Thread(target=_stream_loop.run_forever, name='chat-stream-loop', daemon=True).start()
+            _stream_client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+            _stream_pid = os.getpid()
+        return _stream_loop
+
+
+def _write_stream(stream_id, text, done):
+    job_cache.set(f'chat-stream-{stream_id}', (text, done), expire=STREAM_EXPIRY)
+
 
-    return completion.choices[0].message.content
+async def _stream_completion(stream_id, user_input, key, system):
+    text = ''
+
+    async def stream_answer(timeout):
+        nonlocal text
+        stream = await _stream_client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user_input}
+            ],
+            stream=True,
+            timeout=timeout
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text += chunk.choices[0].delta.content
+                    _write_stream(stream_id, text, False)
+        except Exception as e:
+            # Part of the answer is already on the page, asking again would repeat it -> don't retry
+            if text:
+                raise RuntimeError(f'stream interrupted: {e}') from e
+            raise
+
+    try:
+        await acall_llm(stream_answer)
+        save_response(user_input, text, context=f'{MODEL}\x00{system}')
+        _write_stream(stream_id, text, True)
+    except LLMUnavailable as e:
+        _write_stream(stream_id, f"Sorry, {e}. Please try again shortly.", True)
+    except Exception as e:
+        print(e)
+        _write_stream(stream_id, text + ' [There was an error getting the rest of the response.]', True)
+    finally:
+        with _stream_lock:
+            _open_streams.pop(key, None)
+
+
+def start_chat_stream(user_input):
+    """
+    Starts streaming the answer to the user input in the background and returns straight away.
+    Cached answers are available at once, a question already being streamed is joined instead of asked again.
+
+    :param user_input: Input given by the user (a string).
+    :return: id to read the answer with (see read_chat_stream).
+    """
+    system = system_prompt(user_input)
+    cached = lookup_response(user_input, context=f'{MODEL}\x00{system}')
+    stream_id = uuid.uuid4().hex
+    if cached is not None:
+        _write_stream(stream_id, cached, True)
+        return stream_id
+
+    loop = _get_stream_loop()
+    # Same question about the same data
+    key = (normalise_prompt(user_input), system)
+    with _stream_lock:
+        joined = key in _open_streams
+        count_request(coalesced=joined)
+        if joined:
+            return _open_streams[key]
+        _open_streams[key] = stream_id
+    _write_stream(stream_id, '', False)
+    asyncio.run_coroutine_threadsafe(_stream_completion(stream_id, user_input, key, system), loop)
+
+    return stream_id
+
+
+def read_chat_stream(stream_id):
+    """
+    :param stream_id: id given by start_chat_stream.
+    :return: (text received so far, True once the answer is complete).
+    """
+    return job_cache.get(f'chat-stream-{stream_id}', ('', True))
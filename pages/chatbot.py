@@ -1,13 +1,18 @@
 import dash
 from dash import Dash, dcc, html, Output, Input, callback, State, ALL, callback_context
 import dash_bootstrap_components as dbc
+from dash.exceptions import PreventUpdate
 
 import Stock_Price_Predictor
 from Helper_Functions import *
+from Instrumentation import instrumented
 from io import StringIO
-from openai_function import chatbot
+from openai_function import chatbot, start_chat_stream, read_chat_stream
 from datetime import datetime
 from Stock_Price_Predictor import *
+from Background_Jobs import cached_manager
+from Batch_Forecast import get_forecast, FORECAST_DATABASE
+from Market_Data_Store import MARKET_DATABASE
 
 dash.register_page(__name__)
 
@@ -41,6 +46,9 @@ layout = dbc.Container(
                 html.H5("Response will be below:", className='text-left')
             )
         ),
+        # Id of the answer being streamed, and the timer that polls it until it is complete
+        dcc.Store(id='chat-stream'),
+        dcc.Interval(id='chat-poll', interval=250, disabled=True),
         dbc.Row(
             dbc.Col(
                 html.Div(id='output-container',
@@ -75,9 +83,18 @@ layout = dbc.Container(
                     ),
                 ),
                 dbc.Col(html.Button('Generate Prediction Visual', id='prediction-button', n_clicks=0,
+                                    style={'padding': '10px', 'margin': '10px auto', 'border-radius': '5px'})),
+                dbc.Col(html.Button('Cancel', id='prediction-cancel', n_clicks=0,
                                     style={'padding': '10px', 'margin': '10px auto', 'border-radius': '5px'}))
             ]
         ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    html.Progress(id='prediction-progress', value='0', max='3', style={'visibility': 'hidden'})
+                ),
+            ]
+        ),
         dbc.Row(
             [
                 dbc.Col(
@@ -97,27 +114,73 @@ layout = dbc.Container(
 
 
 # Use OpenAI api key or make you're own chatbot trained on primitive data...
+# The answer is streamed in the background, the callback returns straight away and the words are
+# shown as they arrive by polling (stream_output)
 @callback(
-    Output('output-container', 'children'),
+    [Output('output-container', 'children'),
+     Output('chat-stream', 'data'),
+     Output('chat-poll', 'disabled')],
     [Input('enter-button', 'n_clicks')],
     [State('input-box', 'value')]
 )
+@instrumented
 def update_output(n_clicks, input_text):
     if n_clicks:
-        return f'Response: {chatbot(input_text)}'
+        return 'Response: ', start_chat_stream(input_text), False
     else:
-        return ''
+        return '', None, True
+
+
+@callback(
+    [Output('output-container', 'children', allow_duplicate=True),
+     Output('chat-poll', 'disabled', allow_duplicate=True)],
+    Input('chat-poll', 'n_intervals'),
+    State('chat-stream', 'data'),
+    prevent_initial_call=True
+)
+@instrumented
+def stream_output(n_intervals, stream_id):
+    if stream_id is None:
+        return dash.no_update, True
+    text, done = read_chat_stream(stream_id)
+    # Stop polling once the answer is complete
+    return f'Response: {text}', done
 
 
 @callback(
     Output('prediction-vis', 'figure'),
     [Input('prediction-button', 'n_clicks'),
-     Input('prediction-input', 'value')]
+     Input('prediction-input', 'value')],
+    # Downloading + simulating runs as a background job, cached per number of days until a new batch forecast
+    # lands or the stored prices are topped up
+    background=True,
+    manager=cached_manager(FORECAST_DATABASE, MARKET_DATABASE),
+    cache_args_to_ignore=[0],
+    progress=[Output('prediction-progress', 'value')],
+    running=[
+        (Output('prediction-progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'}),
+    ],
+    # The button stays enabled -> clicking it again while a job runs starts a new one, and Dash ends the old job
+    # itself (oldJob), so only the cancel button is a cancel input
+    cancel=[Input('prediction-cancel', 'n_clicks')],
 )
-def show_prediction(n_clicks, value):
+@instrumented
+def show_prediction(set_progress, n_clicks, value):
     # Output the prediction graph
     if n_clicks > 0:
-        return prediction_graph(int(value), Stock_Price_Predictor.get_transition_function(classify_data(obtain_data())),
-                                classify_data(obtain_data()))
+        set_progress('1')
+        # One read of the price store for both the transition function and the training data
+        training_data = classify_data(obtain_data())
+        # Use the latest batch forecast (Batch_Forecast.py) when there is a recent one, otherwise simulate now
+        forecast = get_forecast('^AXJO', int(value))
+        if forecast is not None:
+            return fan_chart(training_data, forecast['Date'],
+                             {percentile: forecast[f'p{percentile}'] for percentile in PERCENTILES},
+                             'Prediction Visualization (overnight forecast)')
+        set_progress('2')
+        transition_func = Stock_Price_Predictor.get_transition_function(training_data)
+        set_progress('3')
+        return prediction_graph(int(value), transition_func, training_data)
     else:
-        return default_graph()
+        # Nothing to predict yet, keep the empty graph (raising also stops the empty result being cached)
+        raise PreventUpdate
@@ -1,17 +1,26 @@
+import os
 import dash
 import dash_bootstrap_components as dbc
-from dash import Dash, dcc, html, Output, Input, callback, State
-import base64
+from dash import Dash, dcc, html, Output, Input, callback, State, clientside_callback, ClientsideFunction
 import sqlite3
-from io import StringIO
 from Helper_Functions import *
+from Instrumentation import instrumented
+from Dataset_Summaries import save_summary
+from Background_Jobs import cached_manager
 
 dash.register_page(__name__, path="/")
 
+# When on, a compact copy of the upload is kept in the browser and switching between outputs is done by a
+# clientside callback (assets/home_views.js) -> no server round trip per radio click.
+# Set CLIENTSIDE_VIEWS=0 to build every graph on the server instead.
+CLIENTSIDE_VIEWS = os.getenv('CLIENTSIDE_VIEWS', '1') == '1'
+
 
 layout = dbc.Container(
     [
         dcc.Location(id="home-url", refresh=False),
+        # Compact, column projected copy of the uploaded data (see compact_view_data)
+        dcc.Store(id='home-data-store'),
         # Leading row
         dbc.Row(
             [
@@ -63,6 +72,15 @@ layout = dbc.Container(
                 ),
             ]
         ),
+        # Preview of the uploaded file, rows are paged in from the server (see update_preview_page)
+        dbc.Row(
+            [
+                dbc.Col(
+                    html.Div(id='upload-preview-container', children=preview_table([])),
+                    className='mb-4'
+                ),
+            ]
+        ),
         dbc.Row(
             [
                 dbc.Col(
@@ -94,6 +112,14 @@ layout = dbc.Container(
             ],
             className="mb-4",
         ),
+        # Progress of the graph being built (hexabin plots can take a while)
+        dbc.Row(
+            [
+                dbc.Col(
+                    html.Progress(id='home-progress', value='0', max='3', style={'visibility': 'hidden'})
+                ),
+            ]
+        ),
         dbc.Row(
             [
                 dbc.Col(
@@ -108,49 +134,77 @@ layout = dbc.Container(
 
 @callback(
     # Output
-    Output('upload-status', 'children'),
+    [
+        Output('upload-status', 'children'),
+        Output('upload-preview-container', 'children'),
+        Output('home-data-store', 'data'),
+    ],
     Input('upload-data', 'contents'),
+    [
+        State('upload-data', 'filename'),
+        State('upload-data', 'last_modified'),
+    ],
     prevent_initial_call=True
 )
-def store_data(contents):
+@instrumented
+def store_data(contents, filename, last_modified):
     """
     When the user uploads data (CSV), this will update the graph and also
     let the user know if data was properly uploaded.
 
     :param contents: Preview of the data (some columns).
-    :return: Display of graph and upload success.
+    :param filename: name of the uploaded file.
+    :param last_modified: last modified timestamp of the uploaded file.
+    :return: Upload success, the paged preview, and the compact copy of the data for the browser.
     """
     # Check if the contents exists or not -> indicative whether something was uploaded
     upload_status = []
-    content_type, content_string = contents.split(',')
-    decoded_content = base64.b64decode(content_string)
-    df = pd.read_csv(StringIO(decoded_content.decode('utf-8')))
+    df = optimise_dtypes(decode_upload(contents, filename))
     # Currently just going to be one singular .db file -> assuming need to upload each time...
     db_connection = sqlite3.connect('../uploaded_data.db')
     df.to_sql('uploaded_data_table', db_connection, if_exists='replace', index=False)
     db_connection.close()
+    # Summary for the chatbot, built once here instead of on every question
+    save_summary('home', df)
     # Shows the upload status when user uploads a file
     upload_status.append(f"CSV successfully uploaded and stored ✅.")
 
-    return upload_status
+    preview = preview_upload(df, filename, last_modified)
+
+    if CLIENTSIDE_VIEWS:
+        return upload_status, preview, compact_view_data(df)
+    return upload_status, preview, None
 
 
 @callback(
-    # Output message for which radio item is selected
     [
-        Output('output-message', 'children'),
-        Output('visualisation', 'figure')
+        Output('upload-preview', 'data'),
+        Output('upload-preview', 'page_count'),
     ],
     [
-        Input('spec-radio', 'value'),
+        Input('upload-preview', 'page_current'),
+        Input('upload-preview', 'page_size'),
+        Input('upload-preview', 'sort_by'),
+        Input('upload-preview', 'filter_query'),
     ],
     prevent_initial_call=True
 )
-def update_output(selected_radio):
+@instrumented
+def update_preview_page(page_current, page_size, sort_by, filter_query):
+    """
+    Sends only the visible page of the preview, sorted and filtered by the stored table.
+    """
+    return get_preview_page(page_current, page_size, sort_by, filter_query)
+
+
+@instrumented
+def update_output(set_progress, selected_radio):
     # Dependent on which radio is selected, output specific graph (only if compatible data provided)
     graph = None
+    set_progress('1')
     # Obtain the data frame
     data = get_uploaded_data()
+    set_progress('2')
     if data is not None:
         # Three possible outputs (the outputs do not update dynamically, small functional flaw)
         if selected_radio == "Income vs age data for bubble chart output.":
@@ -164,3 +218,36 @@ def update_output(selected_radio):
     else:
         return "No data uploaded ❌!", None
 
+
+if CLIENTSIDE_VIEWS:
+    # Views are switched in the browser from the data in home-data-store
+    clientside_callback(
+        ClientsideFunction(namespace='home', function_name='switch_view'),
+        [
+            Output('output-message', 'children'),
+            Output('visualisation', 'figure')
+        ],
+        [
+            Input('spec-radio', 'value'),
+            Input('home-data-store', 'data'),
+        ],
+        prevent_initial_call=True
+    )
+else:
+    callback(
+        # Output message for which radio item is selected
+        [
+            Output('output-message', 'children'),
+            Output('visualisation', 'figure')
+        ],
+        [
+            Input('spec-radio', 'value'),
+        ],
+        # Runs as a background job, results cached per radio selection until the next upload.
+        # Selecting another output while one is still rendering cancels the old job.
+        background=True,
+        manager=cached_manager('../uploaded_data.db'),
+        progress=[Output('home-progress', 'value')],
+        running=[(Output('home-progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'})],
+        prevent_initial_call=True
+    )(update_output)
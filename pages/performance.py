@@ -6,9 +6,19 @@ import dash
 from dash import Dash, dcc, html, Output, Input, callback, State
 import dash_bootstrap_components as dbc
 from Helper_Functions import *
+from Instrumentation import instrumented
+from Dataset_Summaries import save_summary
+from Background_Jobs import cached_manager
+from Balance_Store import save_balances
+from Adviser_Rollup import build_rollup, get_adviser_ranking, get_adviser_accounts, \
+    get_adviser_series
 
 dash.register_page(__name__)
 
+# Advisers listed in the ranking table, and accounts drawn when drilling down into one of them
+RANKING_ROWS = 100
+DRILLDOWN_ACCOUNTS = 50
+
 """
 Contains the layout for the performance analytics of advisors. 
 """
@@ -64,9 +74,16 @@ layout = dbc.Container(
         dbc.Row(
             [
                 dbc.Col(
-                    html.Button('Generate Output', id='button', n_clicks=0,
-                                className='btn btn-primary',
-                                style={'margin-top': '10px', 'border-radius': '8px'})
+                    [
+                        html.Button('Generate Output', id='button', n_clicks=0,
+                                    className='btn btn-primary',
+                                    style={'margin-top': '10px', 'border-radius': '8px'}),
+                        html.Button('Cancel', id='perf-cancel', n_clicks=0,
+                                    className='btn btn-secondary',
+                                    style={'margin-top': '10px', 'margin-left': '10px', 'border-radius': '8px'}),
+                        html.Progress(id='perf-progress', value='0', max='4',
+                                      style={'margin-left': '10px', 'visibility': 'hidden'}),
+                    ]
                 )
             ]
         ),
@@ -102,6 +119,53 @@ layout = dbc.Container(
                              )
                 )
             ]
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    [
+                        html.H3("Advisers Ranked by Gain"),
+                        # Needs both the performance file and the holdings file (sales page) to be uploaded
+                        dcc.Markdown("Upload the holdings on the sales page to see advisers. "
+                                     "Click an adviser to see their accounts."),
+                    ]
+                )
+            ],
+            className='mt-4',
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dash_table.DataTable(
+                        id='adviser-ranking',
+                        columns=[
+                            {'name': 'Rank', 'id': 'Rank', 'type': 'numeric'},
+                            {'name': 'Advisor Code', 'id': 'adviserCode', 'type': 'numeric'},
+                            {'name': 'Accounts', 'id': 'Accounts', 'type': 'numeric'},
+                            {'name': 'First Balance', 'id': 'FirstBal', 'type': 'numeric',
+                             'format': dash_table.FormatTemplate.money(0)},
+                            {'name': 'Last Balance', 'id': 'LastBal', 'type': 'numeric',
+                             'format': dash_table.FormatTemplate.money(0)},
+                            {'name': 'Gain', 'id': 'Gain', 'type': 'numeric',
+                             'format': dash_table.FormatTemplate.money(0)},
+                            {'name': 'Gain %', 'id': 'GainPct', 'type': 'numeric',
+                             'format': dash_table.Format.Format(precision=1,
+                                                                scheme=dash_table.Format.Scheme.fixed)},
+                        ],
+                        data=[],
+                        page_size=10,
+                        sort_action='native',
+                        style_table={'overflowX': 'auto'},
+                    )
+                )
+            ]
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.Graph(id='adviser-drilldown', figure=default_graph())
+                ),
+            ]
         )
     ],
     fluid=True,
@@ -113,17 +177,24 @@ layout = dbc.Container(
     Input('upload-data', 'contents'),
     prevent_initial_call=True
 )
+@instrumented
 def upload_status(contents):
     if contents is not None:
         # Decode the contents to get the file data
         content_type, content_string = contents.split(',')
         decoded_content = base64.b64decode(content_string)
         # Store into data base with sql lite
-        df = pd.read_csv(StringIO(decoded_content.decode('utf-8')))
+        df = optimise_dtypes(pd.read_csv(StringIO(decoded_content.decode('utf-8'))))
         # Currently just going to be one singular .db file -> assuming need to upload each time...
         db_connection = sqlite3.connect('performance_data.db')
         df.to_sql('performance_data_table', db_connection, if_exists='replace', index=False)
         db_connection.close()
+        # Same data as memory-mapped arrays per account, for reading single accounts / date ranges
+        save_balances(df)
+        # Adviser totals and ranking, if the holdings were uploaded already
+        build_rollup()
+        # Summary for the chatbot, built once here instead of on every question
+        save_summary('performance', df)
 
         # For demonstration purposes, let's assume the upload was successful
         return 'File successfully uploaded 😊.'
@@ -136,11 +207,62 @@ def upload_status(contents):
      Output('text-output', 'children'),
      Output("2ndoutput", 'children')],
     Input('button', 'n_clicks'),
+    # Full-book graph runs as a background job, cached until a new file is uploaded
+    background=True,
+    manager=cached_manager('performance_data.db'),
+    # n_clicks only says how often the button was pressed, the output is the same for every click
+    cache_args_to_ignore=[0],
+    progress=[Output('perf-progress', 'value')],
+    running=[
+        (Output('perf-progress', 'style'), {'margin-left': '10px', 'visibility': 'visible'},
+         {'margin-left': '10px', 'visibility': 'hidden'}),
+    ],
+    # The button stays enabled -> clicking it again while a job runs starts a new one, and Dash ends the old job
+    # itself (oldJob), so only the cancel button is a cancel input
+    cancel=[Input('perf-cancel', 'n_clicks')],
     prevent_initial_call=True
 )
-def generate_output(n_clicks):
+@instrumented
+def generate_output(set_progress, n_clicks):
+    set_progress('1')
     data = get_perf_data()
     if n_clicks > 0:
-        return performance_line_graph(data), text_output(data), worst_account(data)
+        set_progress('2')
+        graph = performance_line_graph(data)
+        set_progress('3')
+        best = text_output(data)
+        set_progress('4')
+        return graph, best, worst_account(data)
     # Check if pressed
     return None, "", ""
+
+
+@callback(
+    Output('adviser-ranking', 'data'),
+    # Also runs when the page opens -> shows the ranking of the last uploads
+    Input('advisor-upload', 'children'),
+)
+@instrumented
+def update_ranking(upload_message):
+    ranking = get_adviser_ranking(RANKING_ROWS)
+    return [] if ranking is None else ranking.to_dict('records')
+
+
+@callback(
+    Output('adviser-drilldown', 'figure'),
+    Input('adviser-ranking', 'active_cell'),
+    State('adviser-ranking', 'derived_viewport_data'),
+    prevent_initial_call=True
+)
+@instrumented
+def adviser_drilldown(active_cell, rows):
+    if not active_cell or not rows or active_cell['row'] >= len(rows):
+        return dash.no_update
+    adviser = rows[active_cell['row']]['adviserCode']
+    accounts = get_adviser_accounts(adviser)
+    series = get_adviser_series(adviser)
+    if accounts is None or series is None:
+        return default_graph()
+    # Best accounts only for advisers with a lot of them, the total still covers every account
+    balances = get_perf_data(accounts['AcctId'].head(DRILLDOWN_ACCOUNTS).tolist())
+    return adviser_drilldown_graph(adviser, series, balances)
@@ -0,0 +1,114 @@
+import dash
+from dash import dcc, html, Output, Input, State, callback
+import dash_bootstrap_components as dbc
+
+from Instrumentation import instrumented
+from Planning_Engine import ProjectionEngine, ASSUMPTIONS, projection_fan_chart, sensitivity_chart, \
+    sensitivity_values
+
+dash.register_page(__name__)
+
+# Paths behind the fan chart, and behind every scenario of the sensitivity chart
+PROJECTION_PATHS = 10000
+SENSITIVITY_PATHS = 2000
+
+# One engine per chart and process -> a slider only recomputes the stages it feeds (see Planning_Engine.py)
+projection_engine = ProjectionEngine(paths=PROJECTION_PATHS)
+sensitivity_engine = ProjectionEngine(paths=SENSITIVITY_PATHS)
+
+"""
+Retirement / savings planner -> Monte Carlo projection of the balance with the sliders as assumptions. The fan chart
+follows the sliders while they are dragged, the sensitivity chart updates when they are let go.
+"""
+
+
+def assumption_slider(name):
+    label, minimum, maximum, step, default = ASSUMPTIONS[name]
+    return html.Div([
+        html.Label(label),
+        dcc.Slider(id=f'planner-{name}', min=minimum, max=maximum, step=step, value=default,
+                   marks={minimum: f'{minimum:,}', maximum: f'{maximum:,}'},
+                   tooltip={'placement': 'bottom', 'always_visible': False}),
+    ], className='mb-2')
+
+
+layout = dbc.Container(
+    [
+        dbc.Row(
+            dbc.Col(
+                html.H1("Financial Planner", className='text-center'),
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Markdown(f"Projection of {PROJECTION_PATHS:,} simulated market and inflation paths. "
+                             "Balances are in today's dollars."),
+            ),
+            className='mb-4',
+        ),
+        dbc.Row(
+            [
+                dbc.Col([assumption_slider(name) for name in ASSUMPTIONS], width=4),
+                dbc.Col(
+                    [
+                        html.Div(id='planner-summary', style={'margin-bottom': '10px'}),
+                        dcc.Graph(id='planner-projection'),
+                        html.Label("Sensitivity of the chance the money lasts to:"),
+                        dcc.Dropdown(
+                            id='planner-sensitivity-input',
+                            options=[{'label': spec[0], 'value': name} for name, spec in ASSUMPTIONS.items()
+                                     if name != 'current_age'],
+                            value='retirement_age',
+                            clearable=False,
+                        ),
+                        dcc.Graph(id='planner-sensitivity'),
+                    ],
+                    width=8,
+                ),
+            ]
+        ),
+    ],
+    fluid=True,
+)
+
+
+@callback(
+    [Output('planner-projection', 'figure'),
+     Output('planner-summary', 'children')],
+    [Input(f'planner-{name}', 'drag_value') for name in ASSUMPTIONS],
+    [State(f'planner-{name}', 'value') for name in ASSUMPTIONS],
+)
+@instrumented
+def update_projection(*values):
+    """
+    Redraws the projection while a slider moves, only the stages behind the slider are recomputed.
+    """
+    dragged, settled = values[:len(ASSUMPTIONS)], values[len(ASSUMPTIONS):]
+    # drag_value is empty until a slider was first moved
+    assumptions = {name: settled_value if drag_value is None else drag_value
+                   for name, drag_value, settled_value in zip(ASSUMPTIONS, dragged, settled)}
+    outcome = projection_engine.project(**assumptions)
+    recomputed = ', '.join(f"{stage} ({seconds * 1000:.0f} ms)" for stage, seconds in projection_engine.last_run)
+    summary = [
+        html.B(f"{outcome['success'][0]:.0%}"),
+        f" chance the money lasts until {assumptions['end_age']:.0f}. Median balance at retirement: ",
+        html.B(f"${outcome['at_retirement'][0]:,.0f}"),
+        html.Br(),
+        html.Small(f"Recomputed: {recomputed or 'nothing'}", className='text-muted'),
+    ]
+    return projection_fan_chart(outcome, assumptions['retirement_age']), summary
+
+
+@callback(
+    Output('planner-sensitivity', 'figure'),
+    [Input('planner-sensitivity-input', 'value')] + [Input(f'planner-{name}', 'value') for name in ASSUMPTIONS],
+)
+@instrumented
+def update_sensitivity(parameter, *values):
+    """
+    Every value of one input as a scenario of a single projection, the other inputs as set on the sliders.
+    """
+    assumptions = dict(zip(ASSUMPTIONS, values))
+    assumptions[parameter] = sensitivity_values(parameter)
+    outcome = sensitivity_engine.project(**assumptions)
+    return sensitivity_chart(assumptions[parameter], outcome, parameter)
@@ -0,0 +1,141 @@
+import dash
+from dash import dcc, html, Output, Input, State, callback, dash_table
+import dash_bootstrap_components as dbc
+
+from Helper_Functions import default_graph
+from Instrumentation import instrumented
+from Query_Engine import run_query, table_schemas, chart_from_result, QueryError, CHART_BUILDERS, QUERY_MAX_ROWS
+
+dash.register_page(__name__)
+
+"""
+Ad-hoc SQL over the uploaded datasets (see Query_Engine.py), with the result shown as a table and optionally drawn
+with one of the existing chart builders.
+"""
+layout = dbc.Container(
+    [
+        dcc.Location(id='query-url', refresh=False),
+        dbc.Row(
+            dbc.Col(
+                html.H1("Ad-hoc Query", className='text-center'),
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Markdown(f"Query the uploaded data with SQL (one SELECT, at most {QUERY_MAX_ROWS:,} rows back). "
+                             "Tables uploaded so far:"),
+            ),
+            className='mb-2',
+        ),
+        dbc.Row(
+            dbc.Col(
+                html.Div(id='query-tables')
+            ),
+            className='mb-2',
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Textarea(
+                    id='query-sql',
+                    value='SELECT AcctId, EOM, ClosingBal FROM performance WHERE AcctId IN '
+                          '(SELECT AcctId FROM performance GROUP BY AcctId ORDER BY max(ClosingBal) DESC LIMIT 5)',
+                    style={'width': '100%', 'height': '120px', 'font-family': 'monospace', 'padding': '10px',
+                           'border-radius': '5px', 'border': '1px solid #ccc'}
+                )
+            )
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.Dropdown(
+                        id='query-chart',
+                        options=[{'label': 'Table only', 'value': ''}]
+                        + [{'label': name, 'value': name} for name in CHART_BUILDERS],
+                        value='performance_line_graph',
+                        clearable=False,
+                    ),
+                    width=4,
+                ),
+                dbc.Col(
+                    html.Button('Run Query', id='query-run', n_clicks=0, className='btn btn-primary',
+                                style={'border-radius': '8px'}),
+                    width=2,
+                ),
+            ],
+            className='mt-2',
+        ),
+        dbc.Row(
+            dbc.Col(
+                html.Div(id='query-status', style={'margin-top': '10px'})
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dash_table.DataTable(
+                    id='query-result',
+                    columns=[],
+                    data=[],
+                    page_size=15,
+                    sort_action='native',
+                    style_table={'overflowX': 'auto'},
+                )
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Graph(id='query-graph', figure=default_graph())
+            )
+        ),
+    ],
+    fluid=True,
+)
+
+
+@callback(
+    Output('query-tables', 'children'),
+    Input('query-url', 'pathname'),
+)
+@instrumented
+def show_tables(pathname):
+    try:
+        schemas = table_schemas()
+    except QueryError as e:
+        return f"❌ {e}"
+    if not schemas:
+        return "Nothing uploaded yet."
+    return html.Ul([
+        html.Li([html.B(name), f" -> {', '.join(f'{column} ({kind})' for column, kind in columns)}"])
+        for name, columns in schemas.items()
+    ])
+
+
+@callback(
+    [Output('query-result', 'columns'),
+     Output('query-result', 'data'),
+     Output('query-status', 'children'),
+     Output('query-graph', 'figure')],
+    Input('query-run', 'n_clicks'),
+    [State('query-sql', 'value'),
+     State('query-chart', 'value')],
+    prevent_initial_call=True
+)
+@instrumented
+def run_query_output(n_clicks, sql, builder):
+    try:
+        result = run_query(sql or '')
+    except QueryError as e:
+        return [], [], f"❌ {e}", default_graph()
+    frame = result['frame']
+    status = f"{len(frame):,} rows in {result['seconds'] * 1000:.0f} ms" \
+             + (" (cached)" if result['cached'] else "") \
+             + (f" -> cut at {QUERY_MAX_ROWS:,} rows, aggregate or add a LIMIT" if result['truncated'] else "")
+    figure = default_graph()
+    if builder:
+        try:
+            figure = chart_from_result(builder, frame)
+        except QueryError as e:
+            status += f". Not drawn: {e}"
+    # Dates as text for the table, the chart keeps the real types
+    table = frame.astype({column: str for column, dtype in frame.dtypes.items() if dtype.kind == 'M'})
+    return [{'name': str(column), 'id': str(column)} for column in frame.columns], table.to_dict('records'), \
+        status, figure
@@ -2,6 +2,9 @@ import dash
 from dash import Dash, dcc, html, Output, Input, callback, State, ALL, callback_context
 import dash_bootstrap_components as dbc
 from Helper_Functions import *
+from Instrumentation import instrumented
+from Dataset_Summaries import save_summary
+from Adviser_Rollup import save_account_advisers
 from io import StringIO
 
 dash.register_page(__name__)
@@ -122,17 +125,22 @@ layout = dbc.Container(
     Input('upload-sales', 'contents'),
     prevent_initial_call=True
 )
+@instrumented
 def upload_status(contents):
     if contents is not None:
         # Decode the contents to get the file data
         content_type, content_string = contents.split(',')
         decoded_content = base64.b64decode(content_string)
         # Store into data base with sql lite
-        df = pd.read_csv(StringIO(decoded_content.decode('utf-8')))
+        df = optimise_dtypes(pd.read_csv(StringIO(decoded_content.decode('utf-8'))))
         # Currently just going to be one singular .db file -> assuming need to upload each time...
         db_connection = sqlite3.connect('sales_spider.db')
         df.to_sql('sales_data_table', db_connection, if_exists='replace', index=False)
         db_connection.close()
+        # Summary for the chatbot, built once here instead of on every question
+        save_summary('sales', df)
+        # Account -> adviser mapping for the adviser ranking of the performance page
+        save_account_advisers(df)
 
         # At this point create the list of all possible advisor buttons
         data = get_spider_data()
@@ -159,6 +167,7 @@ def upload_status(contents):
     State({'type': 'advisor-button', 'index': '1201'}, 'n_clicks'),
     prevent_initial_call=True
 )
+@instrumented
 def update_output(n_clicks, state_clicks):
     # Obtain the data frame
     data = get_spider_data()